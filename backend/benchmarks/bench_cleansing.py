@@ -0,0 +1,90 @@
+"""
+数値クレンジングのベンチマーク
+
+input/サンプルデータ.csv を指定行数まで複製し、clean_num (セル単位) と
+clean_metric_columns (ベクトル化) の処理時間と結果の一致を比較する。
+
+使い方:
+    python backend/benchmarks/bench_cleansing.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'src'))
+
+from cleansing import clean_num, clean_metric_columns  # noqa: E402
+
+SAMPLE_CSV = os.path.join(ROOT, 'input', 'サンプルデータ.csv')
+
+
+def load_scaled(rows, as_text):
+    """
+    サンプルデータを rows 行まで複製して読み込む
+    as_text=True の場合は全カラムを文字列として読み込む (汚れた数値カラムを想定)
+    """
+    df = pd.read_csv(SAMPLE_CSV, encoding='utf-8-sig', dtype=str if as_text else None)
+    repeat = -(-rows // len(df))
+    return pd.concat([df] * repeat, ignore_index=True).head(rows)
+
+
+def metric_columns(path):
+    """
+    型推論で数値と判定されたカラムを metric とみなす
+    """
+    df = pd.read_csv(path, encoding='utf-8-sig', nrows=1000)
+    return [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+
+
+def dirty(df, metrics):
+    """
+    3桁カンマ・全角数字・単位付きの表記を混ぜる
+    """
+    for i, m in enumerate(metrics):
+        s = df[m].astype(str)
+        if i % 3 == 0:
+            df[m] = s.str.replace(r'(\d)(?=(\d{3})+$)', r'\1,', regex=True)
+        elif i % 3 == 1:
+            df[m] = s.str.translate(str.maketrans('0123456789', '０１２３４５６７８９'))
+        else:
+            df[m] = '¥' + s + '円'
+    return df
+
+
+def bench(label, df, metrics):
+    base = df.copy()
+    start = time.perf_counter()
+    for m in metrics:
+        base[m] = base[m].apply(clean_num)
+    t_apply = time.perf_counter() - start
+
+    vec = df.copy()
+    start = time.perf_counter()
+    clean_metric_columns(vec, metrics)
+    t_vec = time.perf_counter() - start
+
+    same = all(
+        np.allclose(base[m].astype('float64'), vec[m], equal_nan=True) for m in metrics
+    )
+    print(f"{label:<12} rows={len(df):>9} metrics={len(metrics):>3} "
+          f"apply={t_apply:8.2f}s vectorized={t_vec:7.2f}s "
+          f"speedup={t_apply / t_vec if t_vec else float('inf'):7.1f}x match={same}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    metrics = metric_columns(SAMPLE_CSV)
+    bench('typed', load_scaled(args.rows, as_text=False), metrics)
+    bench('text', load_scaled(args.rows, as_text=True), metrics)
+    bench('dirty', dirty(load_scaled(args.rows, as_text=True), metrics), metrics)
+
+
+if __name__ == '__main__':
+    main()
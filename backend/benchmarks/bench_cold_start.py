@@ -0,0 +1,190 @@
+"""
+Lambda ハンドラのコールドスタート (import と初回リクエスト前の初期化) のベンチマーク
+
+ハンドラモジュール (dispatcher / status / processor) ごとに新しいインタープリタを起動し、次の値を計測する。
+EXECUTION_BACKEND=aws (ダミーの認証情報・リージョン) で実行し、通信は行わない。
+
+    import_ms   : モジュールの import (モジュールレベルのクライアント生成を含む)
+    reject_ms   : 認証エラーで終わる初回リクエスト (API Key 不一致、AWS を使わない経路)
+    clients_ms  : 代表的なリクエストが使うクライアント/リソースの初回生成 (REQUEST_CLIENTS)
+    first_ms    : import_ms + clients_ms (通信を除く、代表的な初回リクエストまでの初期化コスト)
+    process_ms  : インタープリタの起動から終了まで
+    boto3 / pandas : import 直後に読み込まれていたか
+
+--repeat 回の中央値を cold-start-<commit>.json に保存する。変更前のコミットと比較する場合は
+git worktree で取り出したソースを --src に指定して計測し、--compare で比較する。
+
+使い方:
+    python backend/benchmarks/bench_cold_start.py --repeat 5
+    git worktree add /tmp/datana-base <commit>
+    python backend/benchmarks/bench_cold_start.py --src /tmp/datana-base/backend/src --output cold-start-base.json
+    python backend/benchmarks/bench_cold_start.py --compare cold-start-base.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import SRC_DIR  # noqa: E402
+
+HANDLERS = ('dispatcher', 'status', 'processor')
+# 代表的なリクエストが使うモジュールのクライアント/リソース
+#   dispatcher: CSV アップロード用 Presigned URL の発行とジョブ登録 (外部S3ソース指定時のみ lambda_client も使う)
+#   status    : ジョブの照会 (完了時のみ s3 で結果の Presigned URL を発行する)
+#   processor : 分析ジョブ
+REQUEST_CLIENTS = {
+    'dispatcher': ('s3', 'dynamodb'),
+    'status': ('dynamodb',),
+    'processor': ('s3', 'dynamodb', 'bedrock'),
+}
+METRICS = ('import_ms', 'reject_ms', 'clients_ms', 'first_ms', 'process_ms')
+
+# 子プロセスで実行する計測コード (argv[1] がハンドラモジュール名)
+CHILD = """
+import importlib, json, sys, time
+name = sys.argv[1]
+started = time.perf_counter()
+mod = importlib.import_module(name)
+import_ms = (time.perf_counter() - started) * 1000
+loaded = {m: m in sys.modules for m in ('boto3', 'pandas')}
+
+reject_ms = None
+if name != 'processor':
+    started = time.perf_counter()
+    res = mod.handler({'headers': {'x-api-key': 'wrong'}}, None)
+    reject_ms = (time.perf_counter() - started) * 1000
+    assert res['statusCode'] == 401, res
+
+started = time.perf_counter()
+for client in %r[name]:
+    getattr(mod, client).meta
+clients_ms = (time.perf_counter() - started) * 1000
+print(json.dumps(dict(loaded, import_ms=import_ms, reject_ms=reject_ms, clients_ms=clients_ms,
+                      first_ms=import_ms + clients_ms)))
+""" % (REQUEST_CLIENTS,)
+
+
+def source_commit(src_dir):
+    """
+    計測するソースのコミット (git 管理外ならディレクトリ名)
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=src_dir, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return os.path.basename(src_dir)
+
+
+def child_env(src_dir):
+    """
+    子プロセスの環境変数 (aws バックエンド、通信しないダミーの設定)
+    """
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': src_dir,
+        'PYTHONDONTWRITEBYTECODE': '1',
+        'EXECUTION_BACKEND': 'aws',
+        'AWS_DEFAULT_REGION': env.get('AWS_DEFAULT_REGION', 'ap-northeast-1'),
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'DATA_BUCKET': 'bench-data',
+        'JOB_TABLE': 'bench-jobs',
+        'PROCESS_FUNCTION': 'bench-processor',
+        'API_KEY': 'bench-key',
+    })
+    return env
+
+
+def measure(handler, src_dir):
+    """
+    新しいインタープリタで 1 回計測
+    """
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, handler], cwd=src_dir, env=child_env(src_dir),
+        capture_output=True, text=True, check=True
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def summarize(runs):
+    """
+    計測値の中央値 (ミリ秒は小数 1 桁)
+    """
+    summary = {}
+    for metric in METRICS:
+        values = [r[metric] for r in runs if r.get(metric) is not None]
+        summary[metric] = round(statistics.median(values), 1) if values else None
+    summary.update({m: runs[0][m] for m in ('boto3', 'pandas')})
+    return summary
+
+
+def compare(results, baseline_path):
+    """
+    過去の結果とのハンドラ別比較 (比率 < 1 は速くなったことを示す)
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['meta']['commit']} ({baseline_path}):")
+    for handler, case in results['handlers'].items():
+        base = baseline['handlers'].get(handler)
+        if not base:
+            continue
+        print(f"  {handler}")
+        for metric in METRICS:
+            before, after = base.get(metric), case.get(metric)
+            if before is None or after is None:
+                continue
+            ratio = f"x{after / before:5.2f}" if before else ''
+            print(f"    {metric:<12} {before:8.1f}ms -> {after:8.1f}ms  {ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', nargs='+', default=list(HANDLERS), choices=HANDLERS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--src', default=SRC_DIR, help='計測するソースディレクトリ (既定: このリポジトリの backend/src)')
+    parser.add_argument('--output', help='結果 JSON の出力先 (既定: cold-start-<commit>.json)')
+    parser.add_argument('--compare', help='比較対象の結果 JSON')
+    args = parser.parse_args()
+
+    src_dir = os.path.abspath(args.src)
+    commit = source_commit(src_dir)
+    results = {
+        'meta': {
+            'commit': commit,
+            'src': src_dir,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'repeat': args.repeat,
+        },
+        'handlers': {},
+    }
+    for handler in args.handlers:
+        case = summarize([measure(handler, src_dir) for _ in range(args.repeat)])
+        results['handlers'][handler] = case
+        print(f"{handler:<10} " + ' '.join(
+            f"{m}={case[m]:.1f}" for m in METRICS if case[m] is not None
+        ) + f" boto3={case['boto3']} pandas={case['pandas']}")
+
+    output = args.output or f"cold-start-{commit}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
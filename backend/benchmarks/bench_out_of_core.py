@@ -0,0 +1,178 @@
+"""
+out-of-core 集計 (outofcore.py) と DataFrame 全体での集計の比較
+
+mes_data.py の合成 MES データと固定の分析プラン (mes_plan.json) について、次の 2 つの経路を
+それぞれ新しいプロセスで実行し、集計結果・処理時間・ピーク RSS を比較する。
+
+    in_memory   : load_dataset で全量を DataFrame に読み込み、build_charts / summarize_metrics で集計
+    out_of_core : aggregate_out_of_core でチャンクごとの部分集計から集計 (summarize_partials)
+
+集計結果の比較:
+    ランキング/構成比・時系列 : ラベルと値 (相対誤差 --rtol 以内)。上位件数の境界で値が同じラベルは入れ替わってよい
+    散布図                    : 件数の合計と各軸の最小・最大 (代表点そのものは一致しないことがある)
+    データ概要                : 行数と指標の値
+
+--max-groups を小さくすると、ロット番号などのランキングがディスク (/tmp) に書き出される経路を確認できる。
+不一致があれば終了コード 1 で終了する。
+
+使い方:
+    python backend/benchmarks/bench_out_of_core.py --rows 1000000 --lots 200000 --max-groups 20000
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import DATA_DIR, PLAN_PATH, dataset_path, git_commit, in_fresh_process, peak_rss_mb  # noqa: E402
+
+
+def run_path(csv_path, mode):
+    """
+    1 つの経路で集計 (子プロセスで実行)
+    """
+    import local_run
+    import processor
+    from ingest import read_head
+
+    with open(PLAN_PATH, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    key = f"bench/{os.path.basename(csv_path)}"
+    if not os.path.exists(processor.s3.path_for(processor.DATA_BUCKET, key)):
+        local_run.stage_input(processor.s3, processor.DATA_BUCKET, key, csv_path)
+    head_df, encoding = read_head(processor.s3, processor.DATA_BUCKET, key)
+    raw_headers = list(head_df.columns)
+
+    start = time.perf_counter()
+    if mode == 'in_memory':
+        df = processor.load_dataset(processor.DATA_BUCKET, key, plan, raw_headers, encoding)
+        charts = processor.build_charts(df, plan)
+        summary = processor.summarize_metrics(df, plan)
+    else:
+        charts, partials = processor.aggregate_out_of_core(processor.DATA_BUCKET, [key], plan, raw_headers, encoding)
+        summary = processor.summarize_partials(partials, plan)
+    seconds = time.perf_counter() - start
+    result = json.loads(json.dumps({'charts': charts, 'summary': summary}, default=float))
+    return dict(result, seconds=round(seconds, 3), peak_rss_mb=peak_rss_mb())
+
+
+def close(a, b, rtol):
+    if a is None or b is None or (isinstance(a, float) and math.isnan(a)) or (isinstance(b, float) and math.isnan(b)):
+        return (a is None or a != a) and (b is None or b != b)
+    return math.isclose(a, b, rel_tol=rtol, abs_tol=1e-9)
+
+
+def compare_labels(expected, actual, rtol):
+    """
+    {ラベル: 値} の比較 (境界で同値のラベルの入れ替わりは許容する)
+    戻り値: 不一致の説明 (一致すれば None)
+    """
+    if len(expected) != len(actual):
+        return f"{len(expected)} labels vs {len(actual)}"
+    for label in expected.keys() & actual.keys():
+        if not close(expected[label], actual[label], rtol):
+            return f"{label}: {expected[label]} vs {actual[label]}"
+    missing = expected.keys() - actual.keys()
+    extra = actual.keys() - expected.keys()
+    ties = sorted(expected[k] for k in missing)
+    others = sorted(actual[k] for k in extra)
+    if not all(close(a, b, rtol) for a, b in zip(ties, others)):
+        return f"labels differ: {sorted(missing)[:5]} vs {sorted(extra)[:5]}"
+    return None
+
+
+def compare_scatter(expected, actual, x_col, y_col):
+    """
+    散布図の件数の合計と各軸の範囲の比較
+    """
+    def profile(points):
+        count_key = 'count' if 'count' not in (x_col, y_col) else '_count'
+        return (
+            sum(p[count_key] for p in points),
+            min(p[x_col] for p in points), max(p[x_col] for p in points),
+            min(p[y_col] for p in points), max(p[y_col] for p in points),
+        )
+    a, b = profile(expected), profile(actual)
+    return None if a == b else f"count/range {a} vs {b}"
+
+
+def compare(expected, actual, plan, rtol):
+    """
+    戻り値: [(グラフ ID または summary, 不一致の説明), ...]
+    """
+    problems = []
+    for spec in plan['chart_specs']:
+        chart_id = spec['id']
+        a, b = expected['charts'].get(chart_id), actual['charts'].get(chart_id)
+        if a is None or b is None:
+            problem = None if a is b else 'missing chart'
+        elif spec.get('type') == 'scatter':
+            problem = compare_scatter(a, b, spec['dimension'], spec['metric'])
+        else:
+            problem = compare_labels(a, b, rtol)
+        if problem:
+            problems.append((chart_id, problem))
+
+    if expected['summary']['total_rows'] != actual['summary']['total_rows']:
+        problems.append(('summary', f"rows {expected['summary']['total_rows']} vs {actual['summary']['total_rows']}"))
+    problem = compare_labels(expected['summary']['metrics_summary'], actual['summary']['metrics_summary'], rtol)
+    if problem:
+        problems.append(('summary', problem))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--operators', type=int, default=200)
+    parser.add_argument('--lots', type=int, default=200_000)
+    parser.add_argument('--dirty', type=float, default=0.05, help='汚れた数値表記の割合 (0〜1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-groups', type=int, help='OUT_OF_CORE_MAX_GROUPS (ディスクへの書き出しを起こす場合に小さくする)')
+    parser.add_argument('--chunk-rows', type=int, help='CSV_CHUNK_ROWS')
+    parser.add_argument('--rtol', type=float, default=1e-4, help='値の比較の相対誤差')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='合成データの保存先 (同条件なら再利用)')
+    parser.add_argument('--output', help='結果 JSON の出力先 (既定: out-of-core-<commit>.json)')
+    args = parser.parse_args()
+
+    # 子プロセスは起動時の環境変数で設定を読む
+    if args.max_groups:
+        os.environ['OUT_OF_CORE_MAX_GROUPS'] = str(args.max_groups)
+    if args.chunk_rows:
+        os.environ['CSV_CHUNK_ROWS'] = str(args.chunk_rows)
+
+    path = dataset_path(args.data_dir, args.rows, args.machines, args.operators, args.lots, args.dirty, args.seed)
+    with open(PLAN_PATH, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+
+    runs = {mode: in_fresh_process(run_path, path, mode) for mode in ('in_memory', 'out_of_core')}
+    problems = compare(runs['in_memory'], runs['out_of_core'], plan, args.rtol)
+
+    print(f"rows={args.rows} size={os.path.getsize(path) / 1024 / 1024:.1f}MB lots={args.lots}")
+    for mode, run in runs.items():
+        print(f"  {mode:<12} {run['seconds']:8.3f}s  peak_rss={run['peak_rss_mb']:8.1f}MB")
+    for chart_id, problem in problems:
+        print(f"  MISMATCH {chart_id}: {problem}")
+    print(f"  {len(plan['chart_specs']) - len([p for p in problems if p[0] != 'summary'])}/{len(plan['chart_specs'])} charts match"
+          + ('' if any(p[0] == 'summary' for p in problems) else ', summary matches'))
+
+    commit = git_commit()
+    output = args.output or f"out-of-core-{commit}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {'commit': commit, 'rows': args.rows, 'lots': args.lots, 'bytes': os.path.getsize(path),
+                     'max_groups': args.max_groups, 'chunk_rows': args.chunk_rows},
+            'runs': {mode: {k: run[k] for k in ('seconds', 'peak_rss_mb')} for mode, run in runs.items()},
+            'mismatches': problems,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
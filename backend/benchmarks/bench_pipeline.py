@@ -0,0 +1,251 @@
+"""
+分析パイプラインのエンドツーエンド・ベンチマーク
+
+mes_data.py の合成 MES データ (行数・カーディナリティ・汚れた数値の割合を指定) と
+固定の分析プラン (mes_plan.json) を使い、ステージごとの処理時間とピーク RSS を計測する。
+
+    decode       : バイト列 → テキストのデコード
+    read_csv     : プラン参照カラムのみのチャンク読み込みと結合
+    clean_num    : metric カラムの数値化
+    date_parse   : date カラムのパース
+    chart.<id>   : グラフごとの集計 (単独実行)
+    charts       : 全グラフの集計 (本番と同じくまとめて実行)
+    summary      : 指標サマリー
+    json         : 結果 JSON のシリアライズ
+    end_to_end   : processor.handler 全体 (local バックエンド・スタブLLM、別プロセス)
+
+各ケースは新しいプロセスで実行するため、ピーク RSS はケースごとの値になる。
+結果は JSON に保存し、--compare で過去の結果 (別コミット) と比較できる。
+
+使い方:
+    python backend/benchmarks/bench_pipeline.py --rows 10000 100000 1000000 --dirty 0.05
+    python backend/benchmarks/bench_pipeline.py --rows 1000000 --compare pipeline-abc1234.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SRC_DIR = os.path.join(ROOT, 'backend', 'src')
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLAN_PATH = os.path.join(BENCH_DIR, 'mes_plan.json')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+# ベンチマーク中の処理は local バックエンドで実行する (processor などの import 前に設定)
+os.environ['EXECUTION_BACKEND'] = 'local'
+os.environ.setdefault('LOCAL_DATA_DIR', os.path.join(tempfile.gettempdir(), 'majin-bench', 'store'))
+os.environ['LOCAL_LLM_PLAN'] = PLAN_PATH
+
+from mes_data import generate  # noqa: E402
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'majin-bench', 'data')
+
+
+def peak_rss_mb():
+    """
+    このプロセスのピーク RSS (MB)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def dataset_path(data_dir, rows, machines, operators, lots, dirty, seed):
+    """
+    合成データのパス (同じ条件のファイルがあれば再利用する)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    name = f"mes-{rows}-m{machines}-o{operators}-l{lots}-d{dirty}-s{seed}.csv"
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        print(f"Generating {name} ...", file=sys.stderr)
+        generate(path + '.tmp', rows, machines, operators, lots, dirty, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def run_stages(csv_path):
+    """
+    ステージを個別に計測 (子プロセスで実行)
+    """
+    import pandas as pd
+    from ingest import SNIFF_BYTES, concat_chunks, open_text_stream, read_csv_chunks, sniff_encoding
+    from cleansing import clean_metric_columns
+    from timeseries import parse_date_column
+    from processor import METRIC_DTYPE, build_charts, build_load_spec, summarize_metrics
+
+    with open(PLAN_PATH, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    col_map = plan['column_mapping']
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
+    dates = [c for c, m in col_map.items() if m.get('role') == 'date']
+
+    stages = {}
+    stage_rss = {}
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        stages[name] = round(time.perf_counter() - start, 4)
+        stage_rss[name] = peak_rss_mb()
+        return result
+
+    with open(csv_path, 'rb') as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+    raw_headers = list(pd.read_csv(csv_path, encoding=encoding, nrows=0).columns)
+    usecols, dtype = build_load_spec(plan, raw_headers)
+
+    def decode():
+        with open(csv_path, 'rb') as f:
+            stream, _ = open_text_stream(f, encoding)
+            while stream.read(1024 * 1024):
+                pass
+
+    def read_csv():
+        with open(csv_path, 'rb') as f:
+            return concat_chunks(list(read_csv_chunks(f, encoding=encoding, usecols=usecols, dtype=dtype)))
+
+    def parse_dates():
+        date_formats = {}
+        for d in dates:
+            df[d] = parse_date_column(df[d], date_formats, d)
+
+    timed('decode', decode)
+    df = timed('read_csv', read_csv)
+    timed('clean_num', lambda: clean_metric_columns(df, metrics, dtype=METRIC_DTYPE))
+    timed('date_parse', parse_dates)
+
+    charts = {}
+    for spec in plan['chart_specs']:
+        single = dict(plan, chart_specs=[spec])
+        start = time.perf_counter()
+        build_charts(df, single)
+        charts[spec['id']] = round(time.perf_counter() - start, 4)
+    for chart_id, seconds in charts.items():
+        stages[f"chart.{chart_id}"] = seconds
+
+    charts_res = timed('charts', lambda: build_charts(df, plan))
+    summary = timed('summary', lambda: summarize_metrics(df, plan))
+    result = {'summary': summary, 'charts': charts_res, 'analysisPlan': plan}
+    payload = timed('json', lambda: json.dumps(result, ensure_ascii=False, default=str))
+
+    return {
+        'rows': len(df),
+        'stages': stages,
+        'stage_peak_rss_mb': stage_rss,
+        'result_bytes': len(payload.encode('utf-8')),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_end_to_end(csv_path):
+    """
+    processor.handler 全体の計測 (local バックエンド・スタブLLM、子プロセスで実行)
+    """
+    from local_run import run_file
+    summary = run_file(csv_path, bypass_cache=True)
+    return {'seconds': summary['seconds'], 'status': summary['status'], 'peak_rss_mb': peak_rss_mb()}
+
+
+def in_fresh_process(fn, *args):
+    """
+    新しいプロセスで fn を実行 (ピーク RSS をケースごとに分離する)
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    """
+    過去の結果とのステージ別比較 (比率 > 1 は遅くなったことを示す)
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    base_cases = {c['rows']: c for c in baseline['cases']}
+    print(f"\nCompared with {baseline['meta']['commit']} ({baseline_path}):")
+    for case in results['cases']:
+        base = base_cases.get(case['rows'])
+        if not base:
+            continue
+        print(f"  rows={case['rows']}")
+        for name, seconds in case['stages'].items():
+            before = base['stages'].get(name)
+            if before:
+                print(f"    {name:<16} {before:9.4f}s -> {seconds:9.4f}s  x{seconds / before:5.2f}")
+        print(f"    {'peak_rss_mb':<16} {base['peak_rss_mb']:9.1f}  -> {case['peak_rss_mb']:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--operators', type=int, default=200)
+    parser.add_argument('--lots', type=int, default=1000)
+    parser.add_argument('--dirty', type=float, default=0.05, help='汚れた数値表記の割合 (0〜1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='合成データの保存先 (同条件なら再利用)')
+    parser.add_argument('--no-end-to-end', action='store_true', help='handler 全体の計測を省略する')
+    parser.add_argument('--output', help='結果 JSON の出力先 (既定: pipeline-<commit>.json)')
+    parser.add_argument('--compare', help='比較対象の結果 JSON')
+    args = parser.parse_args()
+
+    import pandas as pd
+    commit = git_commit()
+    results = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'params': {
+                'machines': args.machines, 'operators': args.operators, 'lots': args.lots,
+                'dirty': args.dirty, 'seed': args.seed,
+            },
+        },
+        'cases': [],
+    }
+
+    for rows in args.rows:
+        path = dataset_path(args.data_dir, rows, args.machines, args.operators, args.lots, args.dirty, args.seed)
+        case = {'rows': rows, 'bytes': os.path.getsize(path)}
+        case.update(in_fresh_process(run_stages, path))
+        if not args.no_end_to_end:
+            case['end_to_end'] = in_fresh_process(run_end_to_end, path)
+        results['cases'].append(case)
+
+        main_stages = {k: v for k, v in case['stages'].items() if not k.startswith('chart.')}
+        print(f"rows={rows:>10} size={case['bytes'] / 1024 / 1024:8.1f}MB peak_rss={case['peak_rss_mb']:8.1f}MB "
+              + ' '.join(f"{k}={v:.3f}s" for k, v in main_stages.items())
+              + (f" end_to_end={case['end_to_end']['seconds']:.3f}s" if 'end_to_end' in case else ''))
+
+    output = args.output or f"pipeline-{commit}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+結果 JSON のサイズと洞察生成プロンプトのトークン数のベンチマーク
+
+mes_data.py の合成 MES データと固定の分析プラン (mes_plan.json) で集計した結果について、
+次の値を従来の形式と比較する (トークン数は prompt_digest.estimate_tokens による概算)。
+
+    result.json        : 従来の結果 JSON (json.dumps)
+    result.json.gz     : 従来の結果 JSON を gzip 圧縮 (RESULT_GZIP=true)
+    result.compact     : 列指向の結果 JSON (RESULT_FORMAT=compact)
+    result.compact.gz  : 列指向 + gzip
+    prompt.report      : 戦略レポートのプロンプト (従来: 先頭 10 グラフをそのまま埋め込み)
+    prompt.micro       : micro_insights のプロンプトの合計 (従来: チャンク内のグラフをそのまま埋め込み)
+
+--limit でランキングの表示件数を上書きすると、高カーディナリティの dimension (ロット番号など) の
+グラフが大きい場合を再現できる。
+
+あわせて、gzip 圧縮した結果 (従来 / 列指向) を結果キャッシュに登録・復元 (result_cache.store / restore) し、
+復元した結果が Content-Encoding: gzip のまま、jobId などのジョブ固有の項目だけが書き換わって取得できるかを確認する。不一致があれば終了コード 1 で終了する。
+
+使い方:
+    python backend/benchmarks/bench_result_size.py --rows 100000 1000000 --limit 10 1000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import DATA_DIR, PLAN_PATH, dataset_path, git_commit  # noqa: E402
+
+
+def load_frame(csv_path, plan):
+    """
+    プラン参照カラムを本番と同じくチャンク単位でクレンジングして読み込む
+    """
+    import pandas as pd
+    from ingest import SNIFF_BYTES, concat_chunks, read_csv_chunks, sniff_encoding
+    from processor import build_load_spec, prepare_chunk
+
+    col_map = plan['column_mapping']
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
+    dates = [c for c, m in col_map.items() if m.get('role') == 'date']
+    with open(csv_path, 'rb') as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+    raw_headers = list(pd.read_csv(csv_path, encoding=encoding, nrows=0).columns)
+    usecols, dtype = build_load_spec(plan, raw_headers)
+    date_formats = {}
+    with open(csv_path, 'rb') as f:
+        parts = [
+            prepare_chunk(chunk, metrics, dates, date_formats)
+            for chunk in read_csv_chunks(f, encoding=encoding, usecols=usecols, dtype=dtype)
+        ]
+    return concat_chunks(parts)
+
+
+def measure(df, plan):
+    """
+    結果のバイト数とプロンプトの推定トークン数 (従来 / 新形式)
+    """
+    import processor
+    import result_format
+    from prompt_digest import estimate_tokens
+
+    charts_res = processor.build_charts(df, plan)
+    summary = processor.summarize_metrics(df, plan)
+    result = {'summary': summary, 'charts': charts_res, 'analysisPlan': plan}
+
+    legacy = json.dumps(result, ensure_ascii=False, default=str).encode('utf-8')
+    compact, _ = result_format.encode_result(result, 'compact', use_gzip=False)
+    sizes = {
+        'result.json': len(legacy),
+        'result.json.gz': len(gzip.compress(legacy, compresslevel=6)),
+        'result.compact': len(compact),
+        'result.compact.gz': len(gzip.compress(compact, compresslevel=6)),
+    }
+
+    specs = plan['chart_specs']
+    chunks = [specs[i:i + processor.MICRO_INSIGHT_CHUNK_SIZE] for i in range(0, len(specs), processor.MICRO_INSIGHT_CHUNK_SIZE)]
+    legacy_report = json.dumps({k: v for k, v in list(charts_res.items())[:10]}, ensure_ascii=False, default=str)
+    legacy_micro = [
+        json.dumps([charts_res.get(s.get('id')) for s in chunk], ensure_ascii=False, default=str) for chunk in chunks
+    ]
+    tokens = {
+        'prompt.report': {
+            'legacy': estimate_tokens(processor.build_insight_prompt(summary, {})) + estimate_tokens(legacy_report),
+            'digest': estimate_tokens(processor.build_insight_prompt(summary, charts_res)),
+        },
+        'prompt.micro': {
+            'legacy': sum(
+                estimate_tokens(processor.build_micro_insight_prompt(summary, chunk, {})) + estimate_tokens(data)
+                for chunk, data in zip(chunks, legacy_micro)
+            ),
+            'digest': sum(
+                estimate_tokens(processor.build_micro_insight_prompt(summary, chunk, charts_res)) for chunk in chunks
+            ),
+        },
+    }
+    return sizes, tokens, result
+
+
+def check_cache_round_trip(result):
+    """
+    gzip 圧縮した結果を結果キャッシュ経由で別のジョブに復元し、ContentType / ContentEncoding と内容を比較
+    戻り値: 不一致の説明のリスト
+    """
+    import tempfile
+    import result_cache
+    import result_format
+    from local_backend import LocalObjectStore
+
+    problems = []
+    with tempfile.TemporaryDirectory() as root:
+        store = LocalObjectStore(root)
+        for name in ('json', 'compact'):
+            body, extra = result_format.encode_result(dict(result, jobId='source'), name, use_gzip=True)
+            store.put_object(Bucket='bench', Key='results/source.json', Body=body, **extra)
+            result_cache.store(store, 'bench', name, 'results/source.json')
+            if not result_cache.lookup(store, 'bench', name):
+                problems.append(f"{name}: cache entry not found")
+                continue
+            result_cache.restore(store, 'bench', name, 'results/restored.json', {'jobId': 'restored'})
+            restored = store.get_object(Bucket='bench', Key='results/restored.json')
+            headers = {k: restored.get(k) for k in ('ContentType', 'ContentEncoding')}
+            if headers != extra:
+                problems.append(f"{name}: headers {headers} vs {extra}")
+            expected = dict(result_format.decode_result(body), jobId='restored', cachedFrom={'jobId': 'source', 'processedAt': None})
+            if result_format.decode_result(restored['Body'].read()) != expected:
+                problems.append(f"{name}: restored result differs")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--limit', type=int, nargs='+', default=[None], help='ランキングの表示件数の上書き')
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--operators', type=int, default=200)
+    parser.add_argument('--lots', type=int, default=1000)
+    parser.add_argument('--dirty', type=float, default=0.05, help='汚れた数値表記の割合 (0〜1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='合成データの保存先 (同条件なら再利用)')
+    parser.add_argument('--output', help='結果 JSON の出力先 (既定: result-size-<commit>.json)')
+    args = parser.parse_args()
+
+    with open(PLAN_PATH, 'r', encoding='utf-8') as f:
+        base_plan = json.load(f)
+
+    commit = git_commit()
+    results = {'meta': {'commit': commit, 'params': vars(args)}, 'cases': []}
+    problems = []
+    for rows in args.rows:
+        path = dataset_path(args.data_dir, rows, args.machines, args.operators, args.lots, args.dirty, args.seed)
+        df = load_frame(path, base_plan)
+        for limit in args.limit:
+            plan = base_plan
+            if limit:
+                specs = [dict(s, limit=limit) if 'limit' in s else s for s in base_plan['chart_specs']]
+                plan = dict(base_plan, chart_specs=specs)
+            sizes, tokens, result = measure(df, plan)
+            cache_problems = check_cache_round_trip(result)
+            problems += cache_problems
+            results['cases'].append({
+                'rows': rows, 'limit': limit, 'bytes': sizes, 'tokens': tokens, 'cache_round_trip': cache_problems
+            })
+
+            base = sizes['result.json']
+            print(f"rows={rows:>10} limit={limit or '-':>5} "
+                  + ' '.join(f"{k}={v / 1024:.1f}KB({v / base:.0%})" for k, v in sizes.items()))
+            print(' ' * 28 + ' '.join(
+                f"{k}={t['legacy']}->{t['digest']}tok({t['digest'] / t['legacy']:.0%})" for k, t in tokens.items()
+            ))
+            for problem in cache_problems:
+                print(f"  MISMATCH result cache: {problem}")
+
+    output = args.output or f"result-size-{commit}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+DB.txt の Production_Logs スキーマに沿った合成 MES データの生成
+
+行数・カーディナリティ (設備 / 作業者 / ロット)・汚れた数値表記の割合を指定して CSV を出力する。
+汚れた表記は 3 種類を等分に混ぜる:
+    - 全角数字          (例: １２．５)
+    - 単位付き          (例: 12.5秒, 180.5℃, 250.2MPa)
+    - 桁区切りカンマ    (Cycle_Time のみ。設備停止による長いサイクルタイム 例: "1,234.5")
+
+使い方:
+    python backend/benchmarks/mes_data.py out.csv --rows 1000000 --machines 50 --dirty 0.05
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    'Timestamp', 'Machine_ID', 'Process_Name', 'Cycle_Time', 'Defect_Count',
+    'Temperature', 'Pressure', 'Operator_ID', 'Lot_Number'
+]
+PROCESSES = ['Pressing', 'Welding', 'Inspection']
+UNITS = {'Cycle_Time': '秒', 'Defect_Count': '個', 'Temperature': '℃', 'Pressure': 'MPa'}
+FULLWIDTH = str.maketrans('0123456789.', '０１２３４５６７８９．')
+# 生成時のチャンク行数 (10M 行でもメモリに全量を載せない)
+GENERATE_CHUNK_ROWS = 1_000_000
+
+
+def generate_chunk(rng, start, rows, total_rows, machines, operators, lots, dirty):
+    """
+    start 行目から rows 行分のデータを生成 (ロットは全体の行位置で連番に割り当てる)
+    """
+    index = np.arange(start, start + rows)
+    machine = rng.integers(0, machines, rows)
+    timestamps = np.datetime64('2025-12-01T08:00:00') + index.astype('timedelta64[s]') * 5
+
+    cycle = rng.normal(12.5, 1.5, rows) + (machine % 7) * 0.3
+    temperature = rng.normal(185, 10, rows)
+    defects = rng.poisson(np.where(temperature > 200, 2.0, 0.2))
+    pressure = rng.normal(250, 5, rows)
+
+    df = pd.DataFrame({
+        'Timestamp': np.char.replace(np.datetime_as_string(timestamps, unit='s'), 'T', ' '),
+        'Machine_ID': np.char.add('M', np.char.zfill((machine + 1).astype(str), 3)),
+        'Process_Name': np.array(PROCESSES)[machine % len(PROCESSES)],
+        'Cycle_Time': np.round(cycle, 1).astype(str),
+        'Defect_Count': defects.astype(str),
+        'Temperature': np.round(temperature, 1).astype(str),
+        'Pressure': np.round(pressure, 1).astype(str),
+        'Operator_ID': np.char.add('OP', np.char.zfill((rng.integers(0, operators, rows) + 1).astype(str), 3)),
+        'Lot_Number': np.char.add('LOT-', np.char.zfill((index * lots // total_rows + 1).astype(str), 5)),
+    }, columns=COLUMNS)
+
+    if dirty > 0:
+        for col in UNITS:
+            kind = np.where(rng.random(rows) < dirty, rng.integers(0, 3, rows), -1)
+            values = df[col].copy()
+            fullwidth = kind == 0
+            values[fullwidth] = values[fullwidth].str.translate(FULLWIDTH)
+            unit = kind == 1
+            values[unit] = values[unit] + UNITS[col]
+            if col == 'Cycle_Time':
+                stall = kind == 2
+                values[stall] = [f"{v:,.1f}" for v in rng.uniform(1000, 5000, int(stall.sum()))]
+            df[col] = values
+    return df
+
+
+def generate(path, rows, machines=3, operators=10, lots=100, dirty=0.0, seed=0):
+    """
+    合成データを CSV に書き出す (UTF-8 BOM 付き)
+    """
+    rng = np.random.default_rng(seed)
+    lots = max(1, min(lots, rows))
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - start)
+            chunk = generate_chunk(rng, start, n, rows, machines, operators, lots, dirty)
+            chunk.to_csv(f, index=False, header=start == 0)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--machines', type=int, default=3)
+    parser.add_argument('--operators', type=int, default=10)
+    parser.add_argument('--lots', type=int, default=100)
+    parser.add_argument('--dirty', type=float, default=0.0, help='汚れた数値表記の割合 (0〜1)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, args.rows, args.machines, args.operators, args.lots, args.dirty, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import pandas as pd
+
+AGG_FUNCS = ('sum', 'count', 'mean', 'max', 'min', 'std')
+
+
+def normalize_agg(agg_type):
+    """
+    未対応の集計種別は sum として扱う
+    """
+    return agg_type if agg_type in AGG_FUNCS else 'sum'
+
+
+def finalize_ranking(agg, limit=10, chart_type='bar'):
+    """
+    集計結果を降順に並べ、上位 limit 件 (+ 構成比グラフでは「その他」) に整形
+    """
+    agg = agg.sort_values(ascending=False)
+
+    # Ranking vs Share logic
+    include_others = chart_type in ['pie', 'doughnut']
+
+    if len(agg) > limit + 2:
+        top_n = agg.head(limit)
+        if include_others:
+            others_val = agg.iloc[limit:].sum()
+            others = pd.Series({'その他': others_val})
+            return pd.concat([top_n, others]).to_dict()
+        return top_n.to_dict()
+    return agg.to_dict()
+
+
+def plan_aggregations(specs, columns):
+    """
+    chart_specs を dimension 単位にまとめた実行計画を作る
+    戻り値: { dimension: [(metric, aggregation), ...] }
+    """
+    agg_plan = {}
+    for spec in specs:
+        dim = spec.get('dimension')
+        met = spec.get('metric')
+        if dim not in columns or met not in columns:
+            continue
+        pair = (met, normalize_agg(spec.get('aggregation', 'sum')))
+        pairs = agg_plan.setdefault(dim, [])
+        if pair not in pairs:
+            pairs.append(pair)
+    return agg_plan
+
+
+def execute_aggregations(df, agg_plan):
+    """
+    dimension ごとに一度の groupby(...).agg({...}) で全ての (metric, aggregation) を計算
+    mean は 0 より大きい値のみを対象とする (0 を欠損扱いにする既存仕様)
+    戻り値: { (dimension, metric, aggregation): Series }
+    """
+    results = {}
+    for dim, pairs in agg_plan.items():
+        # 入力カラムは (metric, mean用マスク有無) ごとに位置番号で管理する
+        positions = {}
+        columns = []
+        funcs = {}
+        for met, agg_type in pairs:
+            key = (met, agg_type == 'mean')
+            if key not in positions:
+                positions[key] = len(columns)
+                s = df[met]
+                columns.append(s.where(s > 0) if agg_type == 'mean' else s)
+            funcs.setdefault(positions[key], []).append(agg_type)
+
+        work = pd.concat(columns, axis=1, keys=range(len(columns)))
+        grouped = work.groupby(df[dim], observed=True).agg(funcs)
+
+        for met, agg_type in pairs:
+            agg = grouped[(positions[(met, agg_type == 'mean')], agg_type)]
+            if agg_type == 'mean':
+                agg = agg.dropna()
+            results[(dim, met, agg_type)] = agg.rename(met)
+    return results
+
+
+def aggregate_chart_specs(df, specs):
+    """
+    AIプランに基づく動的集計 (複数グラフを一括実行)
+    同じ dimension を持つグラフは一度の groupby スキャンで計算し、グラフごとに切り出す
+    戻り値: specs と同じ並びの集計結果 dict のリスト
+    """
+    agg_plan = plan_aggregations(specs, df.columns)
+    results = execute_aggregations(df, agg_plan)
+
+    charts = []
+    for spec in specs:
+        key = (spec.get('dimension'), spec.get('metric'), normalize_agg(spec.get('aggregation', 'sum')))
+        if key not in results:
+            charts.append({})
+            continue
+        charts.append(finalize_ranking(results[key], spec.get('limit', 10), spec.get('type', 'bar')))
+    return charts
+
+
+def aggregate_dynamic(df, spec):
+    """
+    AIプランに基づく動的集計
+    spec: { id, title, type, dimension, metric, aggregation, limit }
+    """
+    return aggregate_chart_specs(df, [spec])[0]
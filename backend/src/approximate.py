@@ -0,0 +1,281 @@
+"""
+大規模データ向けの近似集計 (決定的な層化サンプリング + 誤差範囲)
+
+数千万行のデータでは全グラフの厳密な groupby が Lambda の制限時間に収まらないため、
+行をサンプリングして集計し、グラフごとに 95% 信頼区間の半幅を chart_meta として返す。
+
+    - ランキング/構成比: dimension の値ごとの層化サンプリング
+      (各層の行数 N_g は全件から求め、小さい層は全件を残す。sum / count は N_g による比推定)
+    - 時系列: 一様サンプリング (sum は 1/抽出率 で拡大推定)
+    - max / min はサンプル内の極値 (誤差範囲は付けない)
+
+抽出率は先頭 PILOT_ROWS 行の厳密集計にかかった時間から全件の所要時間を見積もり、
+APPROX_LATENCY_BUDGET 秒に収まるように決める。乱数は固定シードのため同じ入力なら結果も同じ。
+"""
+import os
+import time
+import numpy as np
+import pandas as pd
+from aggregation import finalize_ranking, normalize_agg, plan_aggregations
+from timeseries import TS_AGG_FUNCS, execute_time_series, plan_time_series
+
+# exact: 常に厳密集計 / approximate: 常に近似 (予算内なら厳密) / auto: APPROX_MIN_ROWS 行以上で近似
+AGGREGATION_MODE = os.environ.get('AGGREGATION_MODE', 'exact')
+APPROX_MIN_ROWS = int(os.environ.get('APPROX_MIN_ROWS', '5000000'))
+# グラフ集計に使える時間 (秒)
+APPROX_LATENCY_BUDGET = float(os.environ.get('APPROX_LATENCY_BUDGET', '60'))
+# サンプル行数の下限 (これより少なくは抽出しない)
+APPROX_MIN_SAMPLE_ROWS = int(os.environ.get('APPROX_MIN_SAMPLE_ROWS', '200000'))
+# 層 (dimension の値) ごとに最低限残す行数
+APPROX_STRATUM_MIN_ROWS = int(os.environ.get('APPROX_STRATUM_MIN_ROWS', '1000'))
+# 抽出用乱数のシード (データ生成などでよく使われる 0 などと相関しない値)
+APPROX_SEED = 20240917
+# 所要時間の見積もりに使う行数
+PILOT_ROWS = 400_000
+# 95% 信頼区間
+Z_95 = 1.96
+
+
+def use_approximation(rows, requested=False):
+    """
+    近似集計を使うか (ジョブ単位の指定 > AGGREGATION_MODE)
+    """
+    if requested or AGGREGATION_MODE == 'approximate':
+        return True
+    return AGGREGATION_MODE == 'auto' and rows >= APPROX_MIN_ROWS
+
+
+def sample_fraction(df, run_exact, budget=None):
+    """
+    先頭 PILOT_ROWS / 4 行と PILOT_ROWS 行で run_exact(pilot) を実行した時間から全件の所要時間を見積もり、
+    予算内に収まる抽出率を返す (1.0 なら厳密集計で間に合う)
+    抽出率は 2 のべき乗分の 1 に切り下げる (実行ごとの時間の揺らぎで結果が変わりにくいように)
+    """
+    budget = APPROX_LATENCY_BUDGET if budget is None else budget
+    rows = len(df)
+    if rows <= PILOT_ROWS:
+        return 1.0
+    timings = []
+    for n in (PILOT_ROWS // 4, PILOT_ROWS):
+        start = time.perf_counter()
+        run_exact(df.iloc[:n])
+        timings.append(time.perf_counter() - start)
+    # 固定のオーバーヘッドを除いた行あたりの増分時間で外挿する
+    per_row = max(timings[1] - timings[0], 0) / (PILOT_ROWS - PILOT_ROWS // 4)
+    predicted = timings[1] + per_row * (rows - PILOT_ROWS)
+    # 見積もりの誤差とサンプリング自体の時間を見込んで予算の 8 割を使う
+    fraction = budget * 0.8 / predicted if predicted > 0 else 1.0
+    fraction = max(fraction, APPROX_MIN_SAMPLE_ROWS / rows)
+    fraction = 1.0 if fraction >= 1.0 else 2.0 ** np.floor(np.log2(fraction))
+    print(f"Aggregation estimate: {predicted:.1f}s for {rows} rows, budget {budget}s, fraction {fraction:.4f}")
+    return float(fraction)
+
+
+def uniform_draws(rows):
+    """
+    行ごとの一様乱数 (固定シードで決定的)
+    """
+    return np.random.default_rng(APPROX_SEED).random(rows, dtype=np.float32)
+
+
+def group_codes(s):
+    """
+    dimension カラムを (コード, ラベル) に変換 (欠損は -1)
+    """
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.codes.to_numpy(), s.cat.categories
+    codes, labels = pd.factorize(s)
+    return codes, labels
+
+
+def sample_values(s, rows):
+    """
+    サンプル行 (行番号の配列) の値を float64 で取り出す (全件を変換せずに抽出してから変換する)
+    """
+    return pd.Series(s.to_numpy().take(rows)).to_numpy(dtype='float64', na_value=np.nan)
+
+
+def bound_dict(halfwidths, labels):
+    """
+    ラベルごとの信頼区間の半幅 (JSON 用に float 化)
+    """
+    return {label: round(float(hw), 6) for label, hw in zip(labels, halfwidths) if pd.notna(hw)}
+
+
+def chart_meta(method, fraction, sample_rows, total_rows, values, bounds):
+    """
+    グラフの近似情報 (values: 表示する集計値, bounds: 同じキーの半幅。None は誤差範囲なし)
+    """
+    meta = {
+        'approximate': True,
+        'method': method,
+        'sampleFraction': round(fraction, 6),
+        'sampleRows': int(sample_rows),
+        'totalRows': int(total_rows),
+        'confidence': 0.95,
+        'errorBounds': bounds,
+    }
+    if bounds:
+        rel = [bounds[k] / abs(v) for k, v in values.items() if k in bounds and v]
+        meta['maxRelativeError'] = round(max(rel), 6) if rel else 0.0
+    return meta
+
+
+def estimate_groups(x, codes, counts, kept, agg_type):
+    """
+    層化サンプルからのグループ別推定値と 95% 信頼区間の半幅
+    x: サンプル行の値 / codes: サンプル行の層 / counts: 層ごとの全行数 / kept: 層ごとのサンプル行数
+    """
+    size = len(counts)
+    if agg_type in ('max', 'min'):
+        s = pd.Series(x).groupby(codes)
+        est = (s.max() if agg_type == 'max' else s.min()).reindex(range(size)).to_numpy()
+        return est, np.full(size, np.nan)
+
+    valid = ~np.isnan(x)
+    x0 = np.where(valid, x, 0.0)
+    n_valid = np.bincount(codes, weights=valid, minlength=size)
+    s1 = np.bincount(codes, weights=x0, minlength=size)
+    s2 = np.bincount(codes, weights=x0 * x0, minlength=size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 有限母集団修正 (全件を残した層は誤差 0)
+        fpc = np.clip(1 - kept / counts, 0, 1)
+        if agg_type in ('sum', 'count'):
+            # 比推定: N_g × (行あたり平均)、分散は 行の分散 × N_g^2 × fpc / n_g
+            if agg_type == 'count':
+                s1, s2 = n_valid, n_valid
+            mean_row = s1 / kept
+            var_row = np.maximum(s2 / kept - mean_row ** 2, 0) * kept / np.maximum(kept - 1, 1)
+            est = counts * mean_row
+            hw = Z_95 * counts * np.sqrt(var_row * fpc / kept)
+        else:
+            mean = s1 / n_valid
+            var = np.maximum(s2 / n_valid - mean ** 2, 0) * n_valid / np.maximum(n_valid - 1, 1)
+            if agg_type == 'mean':
+                est = mean
+                hw = Z_95 * np.sqrt(var * fpc / n_valid)
+            else:
+                est = np.sqrt(var)
+                hw = Z_95 * est * np.sqrt(fpc / (2 * np.maximum(n_valid - 1, 1)))
+        est = np.where(n_valid > 0, est, np.nan) if agg_type in ('mean', 'std') else est
+    return est, hw
+
+
+def aggregate_chart_specs(df, specs, fraction, draws=None):
+    """
+    ランキング/構成比グラフの近似集計 (aggregation.aggregate_chart_specs の近似版)
+    戻り値: (specs と同じ並びの集計結果 dict のリスト, 同じ並びの chart_meta のリスト)
+    """
+    draws = uniform_draws(len(df)) if draws is None else draws
+    agg_plan = plan_aggregations(specs, df.columns)
+    # 全層に共通の一様サンプル (行番号)
+    base = np.flatnonzero(draws < fraction)
+
+    results = {}
+    for dim, pairs in agg_plan.items():
+        codes, labels = group_codes(df[dim])
+        present = codes >= 0
+        counts = np.bincount(codes[present], minlength=len(labels)).astype(float)
+        # 層ごとの抽出率 (小さい層は全件)
+        rates = np.maximum(fraction, np.minimum(1.0, APPROX_STRATUM_MIN_ROWS / np.maximum(counts, 1)))
+        if (rates > fraction).any():
+            rows = np.flatnonzero(present & (draws < rates[np.where(present, codes, 0)]))
+        else:
+            rows = base[present[base]]
+        sample_codes = codes[rows]
+        kept = np.bincount(sample_codes, minlength=len(labels)).astype(float)
+
+        for met, agg_type in pairs:
+            x = sample_values(df[met], rows)
+            if agg_type == 'mean':
+                # mean は 0 より大きい値のみを対象とする (厳密集計と同じ仕様)
+                x = np.where(x > 0, x, np.nan)
+            est, hw = estimate_groups(x, sample_codes, counts, kept, agg_type)
+            has_rows = counts > 0
+            series = pd.Series(est[has_rows], index=labels[has_rows], name=met)
+            bounds = pd.Series(hw[has_rows], index=labels[has_rows])
+            if agg_type in ('mean', 'std', 'max', 'min'):
+                series = series.dropna()
+            results[(dim, met, agg_type)] = (series, bounds, len(rows))
+
+    charts, metas = [], []
+    for spec in specs:
+        key = (spec.get('dimension'), spec.get('metric'), normalize_agg(spec.get('aggregation', 'sum')))
+        if key not in results:
+            charts.append({})
+            metas.append(None)
+            continue
+        series, bounds, sample_rows = results[key]
+        chart = finalize_ranking(series, spec.get('limit', 10), spec.get('type', 'bar'))
+        shown = None
+        if key[2] not in ('max', 'min'):
+            top = [k for k in chart if k != 'その他']
+            shown = bound_dict(bounds.reindex(top).to_numpy(), top)
+            if 'その他' in chart:
+                # 「その他」は表示外の層の和 (層は独立なので分散を足し合わせる)
+                others = bounds.drop(top, errors='ignore').to_numpy()
+                shown['その他'] = round(float(np.sqrt(np.nansum(others ** 2))), 6)
+        charts.append(chart)
+        metas.append(chart_meta('stratified_sample', fraction, sample_rows, len(df), chart, shown))
+    return charts, metas
+
+
+def aggregate_time_series(df, specs, fraction, draws=None):
+    """
+    時系列グラフの近似集計 (timeseries.aggregate_time_series の近似版)
+    戻り値: (specs と同じ並びの集計結果 dict のリスト, 同じ並びの chart_meta のリスト)
+    """
+    draws = uniform_draws(len(df)) if draws is None else draws
+    ts_plan = plan_time_series(specs, df.columns)
+    rows = np.flatnonzero(draws < fraction)
+
+    # 誤差範囲の計算用に 2 乗和と件数のカラムを追加し、サンプルに対して同じ resample を実行する
+    columns = {}
+    stats_plan = {}
+    for d_col, pairs in ts_plan.items():
+        columns[d_col] = df[d_col].to_numpy().take(rows)
+        stats = list(pairs)
+        for met in dict.fromkeys(m for m, _ in pairs):
+            x = sample_values(df[met], rows)
+            columns[met] = x
+            columns[f"{met}\0sq"] = np.where(np.isnan(x), 0.0, x * x)
+            columns[f"{met}\0n"] = (~np.isnan(x)).astype(float)
+            for extra in (f"{met}\0sq", f"{met}\0n", met):
+                pair = (extra, 'sum')
+                if pair not in stats:
+                    stats.append(pair)
+        stats_plan[d_col] = stats
+    sample = pd.DataFrame(columns)
+    results = execute_time_series(sample, stats_plan)
+    sample_rows = len(rows)
+
+    charts, metas = [], []
+    for spec in specs:
+        agg_type = spec.get('aggregation', 'sum')
+        agg_type = agg_type if agg_type in TS_AGG_FUNCS else 'sum'
+        d_col, met = spec.get('dimension'), spec.get('metric')
+        if (d_col, met, agg_type) not in results:
+            charts.append(None)
+            metas.append(None)
+            continue
+        values = results[(d_col, met, agg_type)]
+        sq = results[(d_col, f"{met}\0sq", 'sum')]
+        n = results[(d_col, f"{met}\0n", 'sum')]
+        bounds = None
+        if agg_type == 'sum':
+            # Horvitz-Thompson 推定: 合計 / 抽出率、分散は (1 - p) / p^2 × Σx^2
+            values = {k: v / fraction for k, v in values.items()}
+            bounds = {
+                k: round(float(Z_95 * np.sqrt((1 - fraction) * sq.get(k, 0.0)) / fraction), 6) for k in values
+            }
+        elif agg_type == 'mean':
+            sums = results[(d_col, met, 'sum')]
+            bounds = {}
+            for k, v in values.items():
+                cnt = n.get(k, 0.0)
+                if cnt > 1:
+                    var = max(sq.get(k, 0.0) / cnt - (sums.get(k, 0.0) / cnt) ** 2, 0) * cnt / (cnt - 1)
+                    bounds[k] = round(float(Z_95 * np.sqrt(var * (1 - fraction) / cnt)), 6)
+        charts.append(values)
+        metas.append(chart_meta('uniform_sample', fraction, sample_rows, len(df), values, bounds))
+    return charts, metas
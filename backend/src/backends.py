@@ -0,0 +1,133 @@
+"""
+実行バックエンドの切り替え (ストレージ / ジョブテーブル / 非同期起動 / LLM)
+
+EXECUTION_BACKEND で切り替える:
+    aws   : boto3 (S3 / DynamoDB / Lambda / Bedrock) (既定)
+    local : local_backend のローカル実装 (ファイルシステム / SQLite / スレッドプール / スタブLLM)
+
+各ファクトリは boto3 のクライアント/リソースと同じ呼び出し方ができるオブジェクトを返すため、
+呼び出し側 (processor / dispatcher / status) はバックエンドを意識しない。
+
+コールドスタートを短くするため、各ファクトリは初回の属性アクセスまで生成 (boto3 の import を含む) を
+遅らせるプロキシを返す。生成したクライアント/リソースはプロセス内で共有し、ウォームスタート間で再利用する。
+"""
+import functools
+import os
+import tempfile
+import threading
+
+EXECUTION_BACKEND = os.environ.get('EXECUTION_BACKEND', 'aws')
+# local バックエンドのデータ置き場 (オブジェクトストアと SQLite のジョブテーブル)
+LOCAL_DATA_DIR = os.environ.get('LOCAL_DATA_DIR', os.path.join(tempfile.gettempdir(), 'majin-local'))
+
+
+def is_local():
+    """
+    local バックエンドで実行中か
+    """
+    return EXECUTION_BACKEND == 'local'
+
+
+def env(name, local_default):
+    """
+    必須の環境変数 (local バックエンドでは未設定時に既定値を使う)
+    """
+    value = os.environ.get(name)
+    if value:
+        return value
+    if is_local():
+        return local_default
+    raise KeyError(name)
+
+
+class LazyClient:
+    """
+    初回の属性アクセス時に factory() で生成し、以降はその結果に委譲するプロキシ
+    """
+    # boto3 の既定セッションでのクライアント生成はスレッドセーフでないため、生成はプロセス内で直列化する
+    lock = threading.Lock()
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+
+    def resolve(self):
+        """
+        生成済みのクライアント/リソース (未生成なら生成する)
+        """
+        if self._instance is None:
+            with LazyClient.lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def lazy(factory):
+    """
+    ファクトリを、生成を遅らせた共有プロキシを返す関数にする
+    """
+    proxy = LazyClient(factory)
+
+    @functools.wraps(factory)
+    def get():
+        return proxy
+    return get
+
+
+@lazy
+def object_store():
+    """
+    S3 クライアント相当
+    """
+    if is_local():
+        from local_backend import LocalObjectStore
+        return LocalObjectStore(os.path.join(LOCAL_DATA_DIR, 'objects'))
+    import boto3
+    return boto3.client('s3')
+
+
+@lazy
+def job_database():
+    """
+    DynamoDB リソース相当
+    """
+    if is_local():
+        from local_backend import LocalJobDatabase
+        return LocalJobDatabase(LOCAL_DATA_DIR)
+    import boto3
+    return boto3.resource('dynamodb')
+
+
+@lazy
+def function_invoker():
+    """
+    Lambda クライアント相当 (分析処理の非同期起動)
+    """
+    if is_local():
+        from local_backend import LocalFunctionInvoker
+        return LocalFunctionInvoker()
+    import boto3
+    return boto3.client('lambda')
+
+
+@lazy
+def llm_client():
+    """
+    Bedrock Runtime クライアント相当
+    """
+    if is_local():
+        from local_backend import StubLLM
+        return StubLLM()
+    import boto3
+    from botocore.config import Config
+    from llm import LLM_MAX_CONCURRENCY, LLM_READ_TIMEOUT
+    # リトライは llm.invoke で行うため SDK のリトライは無効にする
+    return boto3.client('bedrock-runtime', config=Config(
+        read_timeout=LLM_READ_TIMEOUT,
+        connect_timeout=10,
+        retries={'max_attempts': 1, 'mode': 'standard'},
+        max_pool_connections=max(LLM_MAX_CONCURRENCY, 10)
+    ))
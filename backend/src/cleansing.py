@@ -0,0 +1,91 @@
+import re
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+# 全角数字・小数点・マイナスを半角に寄せる変換テーブル
+FULLWIDTH_TABLE = str.maketrans('０１２３４５６７８９．－', '0123456789.-')
+# 数値、マイナス、ドット以外の文字
+NON_NUMERIC_PATTERN = re.compile(r'[^-0-9.]')
+
+
+def clean_num(val):
+    """
+    Aggressive Number Parsing: カンマ、円記号、単位などを除去し、全角数字は半角に変換して数値化
+    (1セルずつ処理する参照実装。集計には clean_metric_columns を使用する)
+    """
+    if pd.isna(val) or val == '':
+        return 0
+    s = str(val).replace(' ', '').replace('　', '').translate(FULLWIDTH_TABLE)
+    # 正規表現で数値、マイナス、ドット以外を除去
+    s = NON_NUMERIC_PATTERN.sub('', s)
+    try:
+        return float(s)
+    except:
+        return 0
+
+
+def is_clean_numeric(s):
+    """
+    既に数値型 (bool以外) でクレンジング不要なカラムか
+    """
+    return is_numeric_dtype(s) and not is_bool_dtype(s)
+
+
+def _fill_numeric(s):
+    """
+    数値型カラムの高速パス: 欠損・無限大を 0 に寄せて float64 化
+    """
+    values = s.to_numpy(dtype='float64', na_value=np.nan)
+    values = np.where(np.isfinite(values), values, 0.0)
+    return pd.Series(values, index=s.index, name=s.name)
+
+
+def _clean_values(values):
+    """
+    値の配列を clean_num と同じ規則で float64 配列に変換
+    ユニーク値だけを文字列処理し、コード配列で元の並びに戻す
+    """
+    codes, uniques = pd.factorize(values)
+    cleaned = (
+        pd.Series(uniques, dtype=object).astype(str)
+        .str.translate(FULLWIDTH_TABLE)
+        .str.replace(NON_NUMERIC_PATTERN, '', regex=True)
+    )
+    parsed = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    parsed = np.where(np.isfinite(parsed), parsed, 0.0)
+    # 欠損 (コード -1) は末尾に追加した 0 を参照させる
+    return np.append(parsed, 0.0)[codes]
+
+
+def clean_numeric_column(s):
+    """
+    clean_num のベクトル化版 (カラム単位)
+    """
+    if is_clean_numeric(s):
+        return _fill_numeric(s)
+    return pd.Series(_clean_values(s.to_numpy(dtype=object)), index=s.index, name=s.name)
+
+
+def clean_metric_columns(df, metrics, dtype='float64'):
+    """
+    metric カラムを一括で数値化 (df を直接更新して返す)
+    文字列カラムは全カラムのユニーク値をまとめて一度だけ正規化する
+    dtype: 変換後の数値型 (メモリ削減のため float32 を指定可能)
+    """
+    text_cols = []
+    for m in metrics:
+        if is_clean_numeric(df[m]):
+            df[m] = _fill_numeric(df[m]).astype(dtype, copy=False)
+        else:
+            text_cols.append(m)
+
+    if not text_cols:
+        return df
+
+    n = len(df)
+    stacked = np.concatenate([df[m].to_numpy(dtype=object) for m in text_cols])
+    cleaned = _clean_values(stacked).astype(dtype, copy=False)
+    for i, m in enumerate(text_cols):
+        df[m] = pd.Series(cleaned[i * n:(i + 1) * n], index=df.index, name=m)
+    return df
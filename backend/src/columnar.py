@@ -0,0 +1,119 @@
+"""
+クレンジング済みデータセットの列指向ファイル (Parquet) への保存と再利用
+
+分析時にクレンジング・型変換した DataFrame を results/{jobId}.parquet に保存し、
+再分析 (source_job_id を指定したジョブ) では CSV の再取得・デコード・数値化・日付パースを行わずに
+必要なカラムのみを読み込む (ローカル実行時はファイルを直接メモリマップする)。
+"""
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import backends
+
+# クレンジング済みデータセットを保存するか
+COLUMNAR_ENABLED = os.environ.get('COLUMNAR_ENABLED', 'true').lower() == 'true'
+# Parquet の圧縮方式
+COLUMNAR_COMPRESSION = os.environ.get('COLUMNAR_COMPRESSION', 'zstd')
+# AWS 実行時にダウンロードしたファイルの置き場 (同じデータセットの再分析では再ダウンロードしない)
+COLUMNAR_TMP_DIR = os.path.join(tempfile.gettempdir(), 'columnar')
+
+
+def dataset_key_for(job_id):
+    """
+    クレンジング済みデータセットの保存先 (結果 JSON と同じ場所)
+    """
+    return f"results/{job_id}.parquet"
+
+
+def store(s3_client, bucket, key, df):
+    """
+    DataFrame を Parquet に書き出して保存 (category は辞書型、日付は timestamp のまま保存される)
+    保存失敗はジョブの成否に影響させない
+    戻り値: 保存できた場合 True
+    """
+    fd, path = tempfile.mkstemp(suffix='.parquet')
+    os.close(fd)
+    try:
+        df.to_parquet(path, engine='pyarrow', compression=COLUMNAR_COMPRESSION, index=False)
+        s3_client.upload_file(path, bucket, key)
+        print(f"Stored columnar dataset: {key} ({os.path.getsize(path)} bytes)")
+        return True
+    except Exception as e:
+        print(f"Failed to store columnar dataset: {str(e)}")
+        return False
+    finally:
+        os.remove(path)
+
+
+def fetch(s3_client, bucket, key):
+    """
+    Parquet ファイルのローカルパスを返す
+    ローカル実行時はオブジェクトストアのファイルをそのまま使い、AWS 実行時は /tmp にダウンロードする
+    """
+    if backends.is_local():
+        return s3_client.path_for(bucket, key)
+
+    os.makedirs(COLUMNAR_TMP_DIR, exist_ok=True)
+    path = os.path.join(COLUMNAR_TMP_DIR, key.replace('/', '_'))
+    size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    # /tmp の容量を超えないよう、前回のデータセットは削除してから取得する
+    for name in os.listdir(COLUMNAR_TMP_DIR):
+        os.remove(os.path.join(COLUMNAR_TMP_DIR, name))
+    s3_client.download_file(bucket, key, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_head(path, nrows=5):
+    """
+    先頭 nrows 行 (計画プロンプトのサンプル用)
+    """
+    parquet = pq.ParquetFile(path, memory_map=True)
+    batch = next(parquet.iter_batches(batch_size=nrows), None)
+    if batch is None:
+        return parquet.schema_arrow.empty_table().to_pandas()
+    return batch.to_pandas()
+
+
+def required_columns(plan):
+    """
+    プランが参照するカラム (metric / date と chart_specs の dimension / metric)
+    """
+    col_map = plan.get('column_mapping', {})
+    cols = [c for c, m in col_map.items() if m.get('role') in ('metric', 'date')]
+    for spec in plan.get('chart_specs', []):
+        cols.extend([spec.get('dimension'), spec.get('metric')])
+    return [c for c in dict.fromkeys(cols) if c]
+
+
+def covers(path, plan):
+    """
+    保存済みデータセットでプランを実行できるか
+    (参照カラムがすべてあり、metric は数値型・date は日時型で保存されている)
+    """
+    schema = pq.read_schema(path, memory_map=True)
+    col_map = plan.get('column_mapping', {})
+    for col in required_columns(plan):
+        if col not in schema.names:
+            return False
+        field_type = schema.field(col).type
+        role = col_map.get(col, {}).get('role')
+        if role == 'metric' and not (pa.types.is_floating(field_type) or pa.types.is_integer(field_type)):
+            return False
+        if role == 'date' and not pa.types.is_timestamp(field_type):
+            return False
+    return True
+
+
+def load(path, plan):
+    """
+    プランが参照するカラムのみをメモリマップで読み込む
+    """
+    columns = [c for c in required_columns(plan) if c in pq.read_schema(path, memory_map=True).names]
+    df = pd.read_parquet(path, engine='pyarrow', columns=columns, memory_map=True)
+    print(f"Loaded columnar dataset: {len(df)} rows, {len(df.columns)} columns")
+    return df
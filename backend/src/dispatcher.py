@@ -1,19 +1,31 @@
 import json
 import os
+import re
 import uuid
-import boto3
 import ipaddress
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from progress import JobProgress
+import backends
+import scheduler
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-lambda_client = boto3.client('lambda')
+s3 = backends.object_store()
+dynamodb = backends.job_database()
+lambda_client = backends.function_invoker()
+# ジョブのキュー (QUEUE_TABLE 未設定時は None で、分析Lambdaを即時に起動する)
+queue_store = scheduler.create_store()
 
-DATA_BUCKET = os.environ['DATA_BUCKET']
-JOB_TABLE = os.environ['JOB_TABLE']
-PROCESS_FUNCTION = os.environ['PROCESS_FUNCTION']
+DATA_BUCKET = backends.env('DATA_BUCKET', 'local-data')
+JOB_TABLE = backends.env('JOB_TABLE', 'local-jobs')
+PROCESS_FUNCTION = backends.env('PROCESS_FUNCTION', 'local-processor')
 ALLOWED_IP_RANGE = os.environ.get('ALLOWED_IP_RANGE', '0.0.0.0/0')
 API_KEY = os.environ.get('API_KEY')
+# バッチ投入で一度に受け付けるジョブ数の上限
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '500'))
+# バッチ投入時に分析Lambdaを並行起動する数
+BATCH_INVOKE_CONCURRENCY = int(os.environ.get('BATCH_INVOKE_CONCURRENCY', '10'))
+# 増分分析の dataset_id (S3 キーの一部になるため使える文字を制限する)
+DATASET_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,128}$')
 
 def is_ip_allowed(source_ip):
     """
@@ -37,6 +49,246 @@ def validate_api_key(headers):
     request_key = headers.get('x-api-key') or headers.get('X-API-Key')
     return request_key == API_KEY
 
+def is_batch_request(event):
+    """
+    バッチ投入 (POST /analyze/batch) のリクエストか
+    """
+    if event.get('routeKey') == 'POST /analyze/batch':
+        return True
+    return (event.get('rawPath') or '').rstrip('/').endswith('/analyze/batch')
+
+def is_s3_source(data_source):
+    """
+    外部S3ソースの指定として有効か
+    """
+    return isinstance(data_source, dict) and data_source.get('type') == 's3' and bool(data_source.get('uri'))
+
+def new_job_item(job_id, callback_url=None, bypass_cache=False, refresh_plan=False, approximate=False,
+                 source_job_id=None, dataset_id=None, priority=None, tenant=None):
+    """
+    ジョブの初期状態
+    """
+    item = {
+        'jobId': job_id,
+        'status': 'PENDING',
+        'createdAt': datetime.utcnow().isoformat(),
+        'ttl': int((datetime.utcnow() + timedelta(days=7)).timestamp())
+    }
+
+    if callback_url:
+        item['callbackUrl'] = callback_url
+
+    # 結果キャッシュを使わずに再分析する
+    if bypass_cache:
+        item['bypassCache'] = True
+
+    # キャッシュ済みの分析プランを使わずに再計画する
+    if refresh_plan:
+        item['refreshPlan'] = True
+
+    # 大規模データでは集計をサンプリングによる近似で行う (誤差範囲を結果に含める)
+    if approximate:
+        item['approximate'] = True
+
+    # 指定したジョブのクレンジング済みデータセットを再分析する
+    if source_job_id:
+        item['sourceJobId'] = source_job_id
+
+    # 同じ dataset_id の前回の入力に追記された行のみを集計する (増分分析)
+    if dataset_id:
+        item['datasetId'] = dataset_id
+
+    # スケジューリングの優先度とテナント (同時実行数の上限の単位)
+    if priority:
+        item['priority'] = priority
+    if tenant:
+        item['tenant'] = tenant
+
+    return item
+
+def processor_payload(job_id, data_source, bypass_cache=False, refresh_plan=False):
+    """
+    分析Lambdaの起動イベント
+    """
+    return {
+        'jobId': job_id,
+        'dataSource': data_source,
+        'bypassCache': bypass_cache,
+        'refreshPlan': refresh_plan
+    }
+
+def invoke_processor(job_id, data_source, bypass_cache=False, refresh_plan=False):
+    """
+    分析Lambdaを非同期で起動
+    """
+    lambda_client.invoke(
+        FunctionName=PROCESS_FUNCTION,
+        InvocationType='Event',
+        Payload=json.dumps(processor_payload(job_id, data_source, bypass_cache, refresh_plan))
+    )
+
+def estimate_job_bytes(data_source, source_item=None):
+    """
+    ジョブの入力バイト数の見積もり (再分析は保存済みデータセットのサイズ)
+    """
+    if source_item:
+        data_source = {'uri': f"s3://{DATA_BUCKET}/{source_item['datasetKey']}"}
+    return scheduler.estimate_bytes(s3, data_source)
+
+def schedule_job(table, item, payload, source_item=None):
+    """
+    ジョブを登録して分析Lambdaを起動
+    スケジューラ有効時は入力サイズからプロファイルを決めてキューに登録し、実行枠に空きがあれば起動する
+    """
+    if queue_store is None:
+        item['status'] = 'PROCESSING' # 即時開始
+        table.put_item(Item=item)
+        lambda_client.invoke(FunctionName=PROCESS_FUNCTION, InvocationType='Event', Payload=json.dumps(payload))
+        return
+
+    entry = scheduler.new_entry(
+        item['jobId'], payload, item['priority'], item['tenant'], estimate_job_bytes(item.get('dataSource'), source_item)
+    )
+    item.update(status='QUEUED', costBytes=entry['costBytes'], profile=entry['profile'])
+    table.put_item(Item=item)
+    scheduler.submit(queue_store, [entry])
+
+def list_prefix_sources(prefix_uri):
+    """
+    S3プレフィックス配下の CSV を外部S3ソースの一覧に展開
+    """
+    if not prefix_uri.startswith('s3://'):
+        raise ValueError(f"Invalid S3 prefix: {prefix_uri}")
+    bucket, _, prefix = prefix_uri[len('s3://'):].partition('/')
+    if not bucket:
+        raise ValueError(f"Invalid S3 prefix: {prefix_uri}")
+
+    sources = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].lower().endswith('.csv'):
+                sources.append({'type': 's3', 'uri': f"s3://{bucket}/{obj['Key']}"})
+            if len(sources) > BATCH_MAX_JOBS:
+                return sources
+    return sources
+
+def collect_batch_sources(body):
+    """
+    バッチ投入の対象 (data_sources の列挙 および s3_prefix 配下の CSV) を収集
+    """
+    data_sources = body.get('data_sources') or []
+    if not isinstance(data_sources, list) or not all(is_s3_source(ds) for ds in data_sources):
+        raise ValueError('data_sources must be a list of {"type": "s3", "uri": ...}')
+
+    sources = list(data_sources)
+    if body.get('s3_prefix'):
+        sources.extend(list_prefix_sources(body['s3_prefix']))
+
+    if not sources:
+        raise ValueError('No data sources found')
+    if len(sources) > BATCH_MAX_JOBS:
+        raise ValueError(f"Too many data sources (max {BATCH_MAX_JOBS})")
+    return sources
+
+def parse_priority(body, default):
+    """
+    リクエストの優先度 (interactive / batch)
+    """
+    priority = body.get('priority') or default
+    if priority not in scheduler.PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(scheduler.PRIORITIES)}")
+    return priority
+
+def submit_batch(body, tenant):
+    """
+    複数ジョブの一括登録
+    1. 対象ソースの収集 (data_sources / s3_prefix)
+    2. batch_writer で全ジョブを一括登録
+    3. スケジューラ有効時はキューに登録して空き枠の分だけ起動、
+       無効時は分析Lambdaを並行数を絞って非同期起動 (起動失敗のジョブは FAILED にする)
+    """
+    try:
+        sources = collect_batch_sources(body)
+        priority = parse_priority(body, 'batch')
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)})
+        }
+
+    batch_id = str(uuid.uuid4())
+    callback_url = body.get('callback_url')
+    bypass_cache = bool(body.get('bypass_cache'))
+    refresh_plan = bool(body.get('refresh_plan'))
+    approximate = bool(body.get('approximate'))
+
+    # 入力サイズの見積もり (スケジューラ有効時のみ)
+    if queue_store is not None:
+        with ThreadPoolExecutor(max_workers=BATCH_INVOKE_CONCURRENCY) as pool:
+            costs = list(pool.map(estimate_job_bytes, sources))
+
+    jobs = []
+    entries = []
+    table = dynamodb.Table(JOB_TABLE)
+    with table.batch_writer() as batch:
+        for i, data_source in enumerate(sources):
+            item = new_job_item(str(uuid.uuid4()), callback_url, bypass_cache, refresh_plan, approximate,
+                                priority=priority, tenant=tenant)
+            item['batchId'] = batch_id
+            item['dataSource'] = data_source
+            if queue_store is not None:
+                entry = scheduler.new_entry(
+                    item['jobId'], processor_payload(item['jobId'], data_source, bypass_cache, refresh_plan),
+                    priority, tenant, costs[i]
+                )
+                item.update(status='QUEUED', costBytes=entry['costBytes'], profile=entry['profile'])
+                entries.append(entry)
+            else:
+                item['status'] = 'PROCESSING' # 即時開始
+            batch.put_item(Item=item)
+            jobs.append(item)
+
+    if queue_store is not None:
+        failed = scheduler.submit(queue_store, entries)['failed']
+        return batch_response(batch_id, jobs, failed, priority)
+
+    def invoke(item):
+        try:
+            invoke_processor(item['jobId'], item['dataSource'], bypass_cache, refresh_plan)
+            return None
+        except Exception as e:
+            print(f"Failed to invoke processor for {item['jobId']}: {str(e)}")
+            JobProgress(table, item['jobId']).update(
+                "#s = :s, #e = :e",
+                names={'#s': 'status', '#e': 'error'},
+                values={':s': 'FAILED', ':e': 'Failed to start processing'}
+            )
+            return item['jobId']
+
+    with ThreadPoolExecutor(max_workers=BATCH_INVOKE_CONCURRENCY) as pool:
+        failed = [job_id for job_id in pool.map(invoke, jobs) if job_id]
+    return batch_response(batch_id, jobs, failed, priority)
+
+def batch_response(batch_id, jobs, failed, priority):
+    """
+    バッチ投入のレスポンス
+    """
+    print(f"Batch {batch_id}: {len(jobs)} jobs submitted, {len(failed)} failed to start")
+    response_body = {
+        'batchId': batch_id,
+        'priority': priority,
+        'jobIds': [item['jobId'] for item in jobs],
+        'jobs': [{'jobId': item['jobId'], 'uri': item['dataSource']['uri']} for item in jobs]
+    }
+    if failed:
+        response_body['failedJobIds'] = failed
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(response_body)
+    }
+
 def handler(event, context):
     """
     分析ジョブの受付
@@ -45,7 +297,8 @@ def handler(event, context):
     3. ジョブID発行
     4. S3 Presigned URL発行 または 外部S3ソースの登録
     5. DynamoDBに初期状態保存
-    6. 分析Lambdaを非同期で起動 (外部ソース時のみ即時)
+    6. 分析Lambdaを非同期で起動 (外部ソース時のみ。スケジューラ有効時はキュー経由)
+    POST /analyze/batch の場合は submit_batch で複数ジョブを一括登録する
     """
     try:
         headers = event.get('headers', {})
@@ -74,40 +327,55 @@ def handler(event, context):
             except:
                 pass
 
+        tenant = scheduler.tenant_of(event)
+        if is_batch_request(event):
+            return submit_batch(body, tenant)
+
         job_id = str(uuid.uuid4())
         data_source = body.get('data_source')
         callback_url = body.get('callback_url')
-        
-        item = {
-            'jobId': job_id,
-            'status': 'PENDING',
-            'createdAt': datetime.utcnow().isoformat(),
-            'ttl': int((datetime.utcnow() + timedelta(days=7)).timestamp())
-        }
+        bypass_cache = bool(body.get('bypass_cache'))
+        refresh_plan = bool(body.get('refresh_plan'))
+        approximate = bool(body.get('approximate'))
+        source_job_id = body.get('source_job_id')
+        dataset_id = body.get('dataset_id')
+        if dataset_id is not None and not (isinstance(dataset_id, str) and DATASET_ID_PATTERN.match(dataset_id)):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'dataset_id must be 1-128 characters of [A-Za-z0-9._-]'})
+            }
+        try:
+            priority = parse_priority(body, 'interactive')
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
 
-        if callback_url:
-            item['callbackUrl'] = callback_url
+        item = new_job_item(job_id, callback_url, bypass_cache, refresh_plan, approximate, source_job_id, dataset_id,
+                            priority, tenant)
 
-        response_body = {'jobId': job_id}
+        response_body = {'jobId': job_id, 'priority': priority}
 
-        if data_source and data_source.get('type') == 's3' and data_source.get('uri'):
+        if source_job_id:
+            # 再分析: 元ジョブの保存済みデータセットを使うためアップロードは不要
+            table = dynamodb.Table(JOB_TABLE)
+            source = table.get_item(Key={'jobId': source_job_id}).get('Item')
+            if not source or not source.get('datasetKey'):
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'source_job_id has no stored dataset'})
+                }
+            schedule_job(table, item, processor_payload(job_id, None, bypass_cache, refresh_plan), source)
+            response_body['status'] = item['status']
+        elif is_s3_source(data_source):
             # 外部S3ソースが指定された場合
             item['dataSource'] = data_source
-            item['status'] = 'PROCESSING' # 即時開始
-            
-            # DynamoDBに登録
+
+            # DynamoDBに登録し、分析Lambdaを非同期で起動
             table = dynamodb.Table(JOB_TABLE)
-            table.put_item(Item=item)
-            
-            # 分析Lambdaを非同期で起動
-            lambda_client.invoke(
-                FunctionName=PROCESS_FUNCTION,
-                InvocationType='Event',
-                Payload=json.dumps({
-                    'jobId': job_id,
-                    'dataSource': data_source
-                })
-            )
+            schedule_job(table, item, processor_payload(job_id, data_source, bypass_cache, refresh_plan))
+            response_body['status'] = item['status']
         else:
             # 通常のアップロードフロー
             file_name = f"uploads/{job_id}.csv"
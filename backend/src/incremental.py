@@ -0,0 +1,352 @@
+"""
+増分分析 (追記され続ける設備ログ向け)
+
+dataset_id ごとに、処理済みのバイト数と集計途中の値 (部分集計) を incremental/{datasetId}.json に保存する。
+新しいアップロードが前回の内容の末尾に行を追記したものであれば、追記分の行だけを読み込んで部分集計を
+マージするため、更新 1 回あたりの処理量は追記分に比例する。
+
+    ranking : (dimension, metric, mean用マスク有無) ごと・dimension の値ごとの n / sum / min / max / mean / M2
+    series  : (日付カラム, metric) ごと・1 時間単位の n / sum / max (+ 日付の最小・最大)
+    summary : 行数と metric ごとの n / sum
+    scatter : 散布図の代表点 (件数つき。マージ時に再度ビン集計する)
+
+追記かどうかは、ヘッダー行と前回処理した範囲の末尾ブロックのハッシュが一致するかで判定する
+(Range 取得のみで判定し、全体は読み込まない)。
+"""
+import csv
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from aggregation import finalize_ranking, normalize_agg, plan_aggregations
+from timeseries import TS_AGG_FUNCS, plan_time_series, resample_rule
+from scatter import merge_points, reduce_scatter
+
+# 追記判定に使う末尾ブロックのサイズ
+TAIL_BYTES = 64 * 1024
+# ヘッダー行を探す先頭ブロックのサイズ
+HEADER_BYTES = 64 * 1024
+STATE_VERSION = 1
+
+
+def state_key_for(dataset_id):
+    """
+    部分集計の保存先
+    """
+    return f"incremental/{dataset_id}.json"
+
+
+def load_state(s3_client, bucket, dataset_id):
+    """
+    保存済みの状態 (なければ None)
+    """
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=state_key_for(dataset_id))
+    except Exception:
+        return None
+    state = json.loads(obj['Body'].read())
+    return state if state.get('version') == STATE_VERSION else None
+
+
+def save_state(s3_client, bucket, dataset_id, state):
+    """
+    状態を保存
+    """
+    state = dict(state, version=STATE_VERSION)
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=state_key_for(dataset_id),
+        Body=json.dumps(state, ensure_ascii=False, default=str),
+        ContentType='application/json'
+    )
+
+
+def read_tail(s3_client, bucket, key, end):
+    """
+    end バイト目までの末尾 TAIL_BYTES
+    """
+    start = max(end - TAIL_BYTES, 0)
+    return s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")['Body'].read()
+
+
+def field_count(line):
+    """
+    CSV の 1 行の列数 (引用符が閉じていない場合は None)
+    ASCII の区切り文字・引用符だけを見るため、latin-1 として解釈する (Shift_JIS / UTF-8 の 2 バイト目以降と衝突しない)
+    """
+    text = line.decode('latin-1').rstrip('\r\n')
+    if text.count('"') % 2:
+        return None
+    return len(next(csv.reader([text]), []))
+
+
+def snapshot(s3_client, bucket, key):
+    """
+    入力オブジェクトの現時点の範囲と追記判定用のハッシュ
+    ファイルが改行で終わらない場合、最終行の列数がヘッダー行と同じなら書き出しが終わった行として末尾まで処理し、
+    列数が足りなければ書き出し途中の行として最後の改行までを処理する (最終行は次回の追記分として扱う)
+    末尾まで処理した場合は complete=False とし、次回は全量を再集計する (最終行が後から書き足されても取りこぼさない)
+    """
+    size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    head = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{min(HEADER_BYTES, size) - 1}")['Body'].read()
+    header = head[:head.find(b'\n') + 1] if b'\n' in head else head
+
+    tail = read_tail(s3_client, bucket, key, size)
+    end, complete = size, True
+    if not tail.endswith(b'\n'):
+        last_newline = tail.rfind(b'\n')
+        finished = field_count(tail[last_newline + 1:]) == field_count(header)
+        if not finished and last_newline >= 0 and size - len(tail) + last_newline + 1 > len(header):
+            end = size - len(tail) + last_newline + 1
+            # 判定用のハッシュは処理する範囲の末尾 TAIL_BYTES で求める
+            tail = read_tail(s3_client, bucket, key, end)
+        else:
+            complete = False
+    return {
+        'bytes': end,
+        'complete': complete,
+        'header': header.decode('latin-1'),
+        'headerHash': hashlib.sha256(header).hexdigest(),
+        'tailHash': hashlib.sha256(tail).hexdigest(),
+    }
+
+
+def extends(s3_client, bucket, key, state, current):
+    """
+    現在のオブジェクト (snapshot) が前回処理した内容の末尾に追記したものか
+    """
+    prev = state.get('snapshot', {})
+    if not prev.get('complete') or current['headerHash'] != prev.get('headerHash'):
+        return False
+    if current['bytes'] < prev['bytes']:
+        return False
+    return hashlib.sha256(read_tail(s3_client, bucket, key, prev['bytes'])).hexdigest() == prev['tailHash']
+
+
+def frame_to_json(df):
+    return {'labels': df.index.tolist(), 'columns': {c: df[c].tolist() for c in df.columns}}
+
+
+def frame_from_json(data):
+    return pd.DataFrame(data['columns'], index=pd.Index(data['labels'], dtype=object))
+
+
+def group_stats(values, keys):
+    """
+    keys ごとの n / sum / min / max / mean / M2 (keys に現れた値はすべて行として残す)
+    """
+    grouped = values.groupby(keys, observed=True)
+    stats = grouped.agg(['count', 'sum', 'min', 'max', 'mean', 'var'])
+    stats.columns = ['n', 'sum', 'min', 'max', 'mean', 'm2']
+    stats['m2'] = (stats['m2'] * (stats['n'] - 1)).fillna(0.0)
+    stats.index = stats.index.astype(object)
+    return stats.astype(float)
+
+
+def merge_stats(a, b):
+    """
+    2 つの部分集計をマージ (M2 は Chan らの並列アルゴリズム)
+    """
+    a, b = a.align(b, join='outer', axis=0)
+    na, nb = a['n'].fillna(0), b['n'].fillna(0)
+    n = na + nb
+    mean_a, mean_b = a['mean'].fillna(0), b['mean'].fillna(0)
+    delta = mean_b - mean_a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (mean_a * na + mean_b * nb) / n
+        m2 = a['m2'].fillna(0) + b['m2'].fillna(0) + delta ** 2 * na * nb / n
+    merged = pd.DataFrame({
+        'n': n,
+        'sum': a['sum'].fillna(0) + b['sum'].fillna(0),
+        'min': pd.concat([a['min'], b['min']], axis=1).min(axis=1),
+        'max': pd.concat([a['max'], b['max']], axis=1).max(axis=1),
+        'mean': mean.where(n > 0),
+        'm2': m2.where(n > 0, 0.0),
+    })
+    return merged.sort_index()
+
+
+def compute_partials(df, plan, col_map):
+    """
+    DataFrame (全量または追記分) の部分集計
+    """
+    specs = plan.get('chart_specs', [])
+    ranking_specs = [
+        s for s in specs
+        if s.get('type') != 'scatter' and col_map.get(s.get('dimension'), {}).get('role') != 'date'
+    ]
+    ts_specs = [
+        s for s in specs
+        if s.get('type') != 'scatter' and col_map.get(s.get('dimension'), {}).get('role') == 'date'
+    ]
+
+    ranking = {}
+    for dim, pairs in plan_aggregations(ranking_specs, df.columns).items():
+        for met, agg_type in pairs:
+            masked = agg_type == 'mean'
+            name = f"{dim}\0{met}\0{int(masked)}"
+            if name not in ranking:
+                s = df[met]
+                ranking[name] = group_stats(s.where(s > 0) if masked else s, df[dim])
+
+    series = {}
+    for d_col, pairs in plan_time_series(ts_specs, df.columns).items():
+        dates = df[d_col]
+        valid = dates.notna()
+        hours = dates[valid].dt.floor('h')
+        for met in dict.fromkeys(m for m, _ in pairs):
+            stats = df[met][valid].groupby(hours).agg(['count', 'sum', 'max'])
+            stats.columns = ['n', 'sum', 'max']
+            series[f"{d_col}\0{met}"] = {
+                'stats': stats.astype(float),
+                'min': dates.min() if valid.any() else None,
+                'max': dates.max() if valid.any() else None,
+            }
+
+    scatter = {}
+    for spec in specs:
+        m1, m2 = spec.get('dimension'), spec.get('metric')
+        if spec.get('type') == 'scatter' and m1 in df.columns and m2 in df.columns:
+            scatter[spec.get('id')] = reduce_scatter(df, m1, m2)
+
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric' and c in df.columns]
+    summary = {
+        'rows': len(df),
+        'metrics': {m: [int(df[m].count()), float(df[m].sum())] for m in metrics},
+    }
+    return {'ranking': ranking, 'series': series, 'scatter': scatter, 'summary': summary}
+
+
+def merge_partials(a, b, plan):
+    """
+    部分集計のマージ (a: 前回までの状態, b: 追記分)
+    """
+    ranking = dict(a['ranking'])
+    for name, stats in b['ranking'].items():
+        ranking[name] = merge_stats(ranking[name], stats) if name in ranking else stats
+
+    series = dict(a['series'])
+    for name, part in b['series'].items():
+        if name not in series:
+            series[name] = part
+            continue
+        prev = series[name]
+        x, y = prev['stats'].align(part['stats'], join='outer', axis=0)
+        stats = pd.DataFrame({
+            'n': x['n'].fillna(0) + y['n'].fillna(0),
+            'sum': x['sum'].fillna(0) + y['sum'].fillna(0),
+            'max': pd.concat([x['max'], y['max']], axis=1).max(axis=1),
+        }).sort_index()
+        bounds = [t for t in (prev['min'], prev['max'], part['min'], part['max']) if t is not None]
+        series[name] = {'stats': stats, 'min': min(bounds, default=None), 'max': max(bounds, default=None)}
+
+    scatter = dict(a['scatter'])
+    for spec in plan.get('chart_specs', []):
+        chart_id = spec.get('id')
+        if chart_id in b['scatter']:
+            prev = scatter.get(chart_id, [])
+            scatter[chart_id] = merge_points(prev, b['scatter'][chart_id], spec.get('dimension'), spec.get('metric'))
+
+    metrics = dict(a['summary']['metrics'])
+    for m, (n, total) in b['summary']['metrics'].items():
+        prev_n, prev_total = metrics.get(m, (0, 0.0))
+        metrics[m] = [prev_n + n, prev_total + total]
+    summary = {'rows': a['summary']['rows'] + b['summary']['rows'], 'metrics': metrics}
+    return {'ranking': ranking, 'series': series, 'scatter': scatter, 'summary': summary}
+
+
+def ranking_values(stats, agg_type, name):
+    """
+    部分集計からランキング用の集計値を求める (厳密集計と同じく mean / std は値のないグループを除外)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if agg_type == 'sum':
+            values = stats['sum']
+        elif agg_type == 'count':
+            values = stats['n']
+        elif agg_type == 'mean':
+            values = (stats['sum'] / stats['n']).where(stats['n'] > 0).dropna()
+        elif agg_type == 'std':
+            values = np.sqrt(stats['m2'] / (stats['n'] - 1)).where(stats['n'] > 1)
+        else:
+            values = stats[agg_type]
+    return values.rename(name)
+
+
+def finalize_charts(partials, plan, col_map):
+    """
+    部分集計からグラフの集計結果を作る (build_charts と同じ形式)
+    """
+    charts_res = {}
+    for spec in plan.get('chart_specs', []):
+        chart_id = spec.get('id')
+        dim, met = spec.get('dimension'), spec.get('metric')
+        if spec.get('type') == 'scatter':
+            if chart_id in partials['scatter']:
+                charts_res[chart_id] = partials['scatter'][chart_id]
+        elif col_map.get(dim, {}).get('role') == 'date':
+            part = partials['series'].get(f"{dim}\0{met}")
+            if part is None:
+                continue
+            agg_type = spec.get('aggregation', 'sum')
+            agg_type = agg_type if agg_type in TS_AGG_FUNCS else 'sum'
+            stats = part['stats']
+            if stats.empty:
+                charts_res[chart_id] = {}
+                continue
+            rule = resample_rule(pd.DatetimeIndex([part['min'], part['max']]))
+            resampled = stats.resample(rule).agg({'n': 'sum', 'sum': 'sum', 'max': 'max'})
+            if agg_type == 'mean':
+                values = (resampled['sum'] / resampled['n']).where(resampled['n'] > 0)
+            else:
+                values = resampled[agg_type]
+            charts_res[chart_id] = {str(k): v for k, v in values.dropna().to_dict().items()}
+        else:
+            agg_type = normalize_agg(spec.get('aggregation', 'sum'))
+            name = f"{dim}\0{met}\0{int(agg_type == 'mean')}"
+            if name not in partials['ranking']:
+                charts_res[chart_id] = {}
+                continue
+            values = ranking_values(partials['ranking'][name], agg_type, met)
+            charts_res[chart_id] = finalize_ranking(values, spec.get('limit', 10), spec.get('type', 'bar'))
+    return charts_res
+
+
+def partials_to_json(partials):
+    """
+    部分集計を JSON に保存できる形に変換
+    """
+    return {
+        'ranking': {name: frame_to_json(stats) for name, stats in partials['ranking'].items()},
+        'series': {
+            name: {
+                'stats': frame_to_json(part['stats'].set_axis(part['stats'].index.astype(str))),
+                'min': None if part['min'] is None else str(part['min']),
+                'max': None if part['max'] is None else str(part['max']),
+            }
+            for name, part in partials['series'].items()
+        },
+        'scatter': partials['scatter'],
+        'summary': partials['summary'],
+    }
+
+
+def partials_from_json(data):
+    """
+    partials_to_json の逆変換
+    """
+    series = {}
+    for name, part in data['series'].items():
+        stats = frame_from_json(part['stats'])
+        stats.index = pd.DatetimeIndex(stats.index)
+        series[name] = {
+            'stats': stats,
+            'min': None if part['min'] is None else pd.Timestamp(part['min']),
+            'max': None if part['max'] is None else pd.Timestamp(part['max']),
+        }
+    return {
+        'ranking': {name: frame_from_json(stats) for name, stats in data['ranking'].items()},
+        'series': series,
+        'scatter': data['scatter'],
+        'summary': data['summary'],
+    }
@@ -0,0 +1,120 @@
+import codecs
+import io
+import os
+import pandas as pd
+
+# エンコーディング判定に使う先頭ブロックのサイズ
+SNIFF_BYTES = int(os.environ.get('CSV_SNIFF_BYTES', str(64 * 1024)))
+# pd.read_csv に渡すチャンク行数 (ピークメモリはこの値に比例する)
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', '100000'))
+# S3 Body からの読み込みバッファサイズ
+READ_BUFFER_BYTES = 1024 * 1024
+
+
+class PrefixedStream(io.RawIOBase):
+    """
+    判定済みの先頭ブロックを再生した後、残りのBodyをそのまま流すバイトストリーム
+    """
+    def __init__(self, head, body):
+        self._head = head
+        self._body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._body.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            super().close()
+
+
+def sniff_encoding(head):
+    """
+    先頭ブロックからエンコーディングを判定 (utf-8-sig → shift_jis)
+    ブロック末尾で切れたマルチバイト文字はエラーとしない
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        decoder.decode(head, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'shift_jis'
+
+
+def read_head(s3_client, bucket, key, nrows=5):
+    """
+    オブジェクト先頭ブロックのみを Range 取得し、ヘッダーとサンプル行を読み込む (計画プロンプト用)
+    戻り値: (サンプル DataFrame (カラム名は生のまま), エンコーディング)
+    """
+    obj = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{SNIFF_BYTES - 1}")
+    head = obj['Body'].read()
+    encoding = sniff_encoding(head)
+
+    # ブロック末尾で切れた行はサンプルに含めない
+    total = obj.get('ContentRange', '').rsplit('/', 1)[-1]
+    if total.isdigit() and len(head) < int(total):
+        head = head[:head.rfind(b'\n') + 1]
+
+    sample = pd.read_csv(io.StringIO(head.decode(encoding, errors='replace')), nrows=nrows)
+    return sample, encoding
+
+
+def open_text_stream(body, encoding=None):
+    """
+    S3 Body (StreamingBody) を逐次デコードするテキストストリームとして開く
+    encoding 未指定時は先頭ブロックで判定する
+    戻り値: (テキストストリーム, エンコーディング)
+    """
+    head = body.read(SNIFF_BYTES)
+    encoding = encoding or sniff_encoding(head)
+    raw = io.BufferedReader(PrefixedStream(head, body), buffer_size=READ_BUFFER_BYTES)
+    # 判定ブロック以降の不正バイトでジョブ全体を落とさないよう replace で読み進める
+    return io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline=''), encoding
+
+
+def read_csv_chunks(body, chunksize=None, encoding=None, usecols=None, dtype=None):
+    """
+    S3 Body を全量メモリに載せずに DataFrame のチャンク列として読み込む
+    usecols / dtype はファイル上の (空白除去前の) カラム名で指定する
+    カラム名は前後の空白を除去して返す
+    """
+    stream, encoding = open_text_stream(body, encoding)
+    print(f"Streaming CSV ingestion: encoding={encoding}, chunksize={chunksize or CSV_CHUNK_ROWS}, "
+          f"columns={len(usecols) if usecols is not None else 'all'}")
+    try:
+        with pd.read_csv(stream, chunksize=chunksize or CSV_CHUNK_ROWS, usecols=usecols, dtype=dtype) as reader:
+            for chunk in reader:
+                chunk.columns = [c.strip() for c in chunk.columns]
+                yield chunk
+    finally:
+        stream.close()
+
+
+def concat_chunks(parts):
+    """
+    チャンクを1つの DataFrame に結合
+    category カラムはチャンクごとにカテゴリが異なるため、和集合に揃えてから結合する
+    """
+    if len(parts) > 1:
+        for c in parts[0].columns:
+            if not isinstance(parts[0][c].dtype, pd.CategoricalDtype):
+                continue
+            categories = parts[0][c].cat.categories.append(
+                [p[c].cat.categories for p in parts[1:]]
+            ).unique().sort_values()
+            for p in parts:
+                p[c] = p[c].cat.set_categories(categories)
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,298 @@
+"""
+Bedrock 呼び出し層 (リトライ・流量制御・ストリーミング応答)
+
+    流量制御   : プロセス内のジョブ・ステージで共有するトークンバケット (リクエスト数 / 入力トークン数 毎分) と
+                 同時呼び出し数の上限。スロットリングを受けるとレートを半減し、成功ごとに設定値まで少しずつ戻す
+    リトライ   : スロットリング・一時的なエラー・タイムアウトは指数バックオフ (full jitter) で LLM_MAX_ATTEMPTS 回まで
+    ストリーミング: invoke_model_with_response_stream で受信しながら JSON を逐次パースし、トップレベルのキーの
+                 値が確定した時点で on_key(key, value) を呼ぶ (分析プランの column_mapping で読み込みを先行開始する)
+
+レートはプロセス (Lambda の実行環境) 単位で、複数の実行環境の間では共有しない。
+"""
+import json
+import os
+import random
+import threading
+import time
+import tracing
+from prompt_digest import estimate_tokens
+
+# 1 回の呼び出しの最大試行回数 (初回を含む)
+LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', '6'))
+# バックオフの基準秒数と上限秒数
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', '1.0'))
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', '20'))
+# 毎分のリクエスト数・入力トークン数の上限 (Bedrock のクォータに合わせる。0 は無制限)
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get('LLM_REQUESTS_PER_MINUTE', '50'))
+LLM_TOKENS_PER_MINUTE = float(os.environ.get('LLM_TOKENS_PER_MINUTE', '200000'))
+# 同時呼び出し数の上限
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+# ストリーミング応答を使うか
+LLM_STREAMING = os.environ.get('LLM_STREAMING', 'true').lower() == 'true'
+# Bedrock の読み取りタイムアウト (秒)。ストリーミングではイベント間の待ち時間に適用される
+LLM_READ_TIMEOUT = int(os.environ.get('LLM_READ_TIMEOUT', '120'))
+
+# リトライするエラーコード (スロットリングはレートも下げる)
+THROTTLE_CODES = ('ThrottlingException', 'TooManyRequestsException', 'throttlingException')
+RETRYABLE_CODES = THROTTLE_CODES + (
+    'ServiceUnavailableException', 'serviceUnavailableException', 'InternalServerException',
+    'internalServerException', 'ModelNotReadyException', 'ModelTimeoutException', 'modelStreamErrorException',
+)
+# リトライする通信エラー (botocore の例外クラス名)
+RETRYABLE_ERRORS = ('ReadTimeoutError', 'ConnectTimeoutError', 'EndpointConnectionError', 'ConnectionClosedError')
+
+
+class StreamError(Exception):
+    """
+    ストリーミング応答の途中で返されたエラーイベント
+    """
+    def __init__(self, code, message=''):
+        super().__init__(f"{code}: {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+def error_code(e):
+    """
+    ClientError 相当の例外のエラーコード (それ以外は例外クラス名)
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        if code:
+            return code
+    return type(e).__name__
+
+
+def is_retryable(e):
+    code = error_code(e)
+    return code in RETRYABLE_CODES or code in RETRYABLE_ERRORS
+
+
+def is_throttle(e):
+    return error_code(e) in THROTTLE_CODES
+
+
+class TokenBucket:
+    """
+    毎分 rate の補充で最大 rate まで貯まるトークンバケット (rate が 0 なら制限なし)
+    penalize / reward でスロットリングに応じてレートを増減する (下限は設定値の 1/8)
+    """
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.base = rate
+        self.rate = rate
+        self.tokens = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def acquire(self, n=1):
+        """
+        n トークンを取得できるまで待つ (容量を超える要求は容量分として扱う)
+        戻り値: 待った秒数
+        """
+        if self.base <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill(self.clock())
+                need = min(n, self.rate)
+                if self.tokens >= need:
+                    self.tokens -= need
+                    return waited
+                wait = (need - self.tokens) * 60 / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    def penalize(self):
+        with self.lock:
+            self.rate = max(self.rate / 2, self.base / 8)
+            self.tokens = min(self.tokens, self.rate)
+
+    def reward(self):
+        with self.lock:
+            self.rate = min(self.rate + self.base / 20, self.base)
+
+
+class RateLimiter:
+    """
+    リクエスト数・入力トークン数のトークンバケットと同時呼び出し数の上限
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def acquire(self, input_tokens):
+        waited = self.requests.acquire(1)
+        waited += self.tokens.acquire(input_tokens)
+        start = time.monotonic()
+        self.slots.acquire()
+        return waited + time.monotonic() - start
+
+    def release(self):
+        self.slots.release()
+
+    def throttled(self):
+        self.requests.penalize()
+        self.tokens.penalize()
+
+    def succeeded(self):
+        self.requests.reward()
+        self.tokens.reward()
+
+
+# プロセス内で共有する流量制御
+limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_CONCURRENCY)
+
+
+class JsonKeyStream:
+    """
+    テキストを少しずつ受け取り、最初の JSON オブジェクトのトップレベルのキーの値が確定するたびに返す
+    (文字列中の括弧・エスケープを考慮して深さを追跡する)
+    """
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = None
+        self.done = False
+
+    def feed(self, text):
+        """
+        戻り値: 新たに確定した [(key, value), ...]
+        """
+        self.buffer += text
+        completed = []
+        while self.pos < len(self.buffer) and not self.done:
+            c = self.buffer[self.pos]
+            if self.depth == 0:
+                # JSON より前の説明文は読み飛ばす
+                if c == '{':
+                    self.depth = 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+                if self.depth == 1 and self.member_start is None:
+                    self.member_start = self.pos
+            elif c in '{[':
+                self.depth += 1
+            elif c in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    completed.extend(self._member(self.pos))
+                    self.done = True
+            elif c == ',' and self.depth == 1:
+                completed.extend(self._member(self.pos))
+            self.pos += 1
+        return completed
+
+    def _member(self, end):
+        start, self.member_start = self.member_start, None
+        if start is None:
+            return []
+        try:
+            return list(json.loads('{' + self.buffer[start:end] + '}', strict=False).items())
+        except ValueError:
+            return []
+
+
+def backoff_seconds(attempt, rng=random):
+    """
+    attempt 回目の失敗後の待ち時間 (full jitter)
+    """
+    return rng.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def invoke(client, model_id, body, on_key=None, streaming=None):
+    """
+    Bedrock (Anthropic Messages API) を呼び出して応答テキストを返す
+    リトライ・流量制御を行い、試行回数・待ち時間・トークン数を実行中のスパンに記録する
+    on_key: ストリーミング時にトップレベルのキーの値が確定するたびに呼ぶ関数 (キーごとに 1 回のみ)
+    """
+    streaming = LLM_STREAMING if streaming is None else streaming
+    streaming = streaming and hasattr(client, 'invoke_model_with_response_stream')
+    input_tokens = estimate_tokens(json.loads(body)['messages'][0]['content'])
+    emitted = set()
+
+    def emit(key, value):
+        if on_key and key not in emitted:
+            emitted.add(key)
+            on_key(key, value)
+
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        waited = limiter.acquire(input_tokens)
+        tracing.record(llm_wait_ms=waited * 1000)
+        try:
+            if streaming:
+                text, usage = invoke_stream(client, model_id, body, emit)
+            else:
+                text, usage = invoke_once(client, model_id, body)
+        except Exception as e:
+            if not is_retryable(e) or attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            if is_throttle(e):
+                limiter.throttled()
+                tracing.record(llm_throttled=1)
+            delay = backoff_seconds(attempt)
+            print(f"Bedrock call failed ({error_code(e)}), retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS})")
+            tracing.record(llm_retries=1, llm_wait_ms=delay * 1000)
+            time.sleep(delay)
+            continue
+        finally:
+            limiter.release()
+
+        limiter.succeeded()
+        tracing.record(input_tokens=usage.get('input_tokens'), output_tokens=usage.get('output_tokens'))
+        return text
+
+
+def invoke_once(client, model_id, body):
+    response = client.invoke_model(modelId=model_id, body=body)
+    res_body = json.loads(response['body'].read())
+    return res_body['content'][0]['text'], res_body.get('usage', {})
+
+
+def invoke_stream(client, model_id, body, emit):
+    """
+    ストリーミング応答を受信しながら JSON を逐次パースする
+    """
+    response = client.invoke_model_with_response_stream(modelId=model_id, body=body)
+    parser = JsonKeyStream()
+    pieces = []
+    usage = {}
+    stream = response['body']
+    try:
+        for event in stream:
+            if 'chunk' not in event:
+                # ストリーム途中のエラー (throttlingException など)
+                code, detail = next(iter(event.items()))
+                raise StreamError(code, (detail or {}).get('message', ''))
+            data = json.loads(event['chunk']['bytes'])
+            kind = data.get('type')
+            if kind == 'message_start':
+                usage['input_tokens'] = data.get('message', {}).get('usage', {}).get('input_tokens')
+            elif kind == 'content_block_delta':
+                text = data.get('delta', {}).get('text', '')
+                pieces.append(text)
+                for key, value in parser.feed(text):
+                    emit(key, value)
+            elif kind == 'message_delta':
+                usage['output_tokens'] = data.get('usage', {}).get('output_tokens')
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+    return ''.join(pieces), usage
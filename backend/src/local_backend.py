@@ -0,0 +1,564 @@
+"""
+AWS を使わずにパイプラインを実行するためのローカル実装 (backends.py から EXECUTION_BACKEND=local で利用)
+
+    LocalObjectStore     : S3 クライアント相当 (LOCAL_DATA_DIR/objects/{bucket}/{key} のファイル)
+    LocalJobDatabase     : DynamoDB リソース相当 (テーブルごとの SQLite ファイル)
+    LocalFunctionInvoker : Lambda クライアント相当 (processor.handler をスレッドプールで実行)
+    StubLLM              : Bedrock Runtime クライアント相当 (決定的な分析プラン・定型文を返す。遅延・スロットリングを再現可能)
+
+いずれも本システムが使う API・引数の範囲のみ実装している。
+"""
+import ast
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from cleansing import FULLWIDTH_TABLE
+
+# 非同期起動 (InvocationType=Event) を実行するスレッド数
+LOCAL_WORKERS = int(os.environ.get('LOCAL_WORKERS', '4'))
+# スタブLLM: 分析プランの JSON ファイル (未指定時は CSV ヘッダーとサンプルから決定的に生成) と応答の疑似遅延 (秒)
+LOCAL_LLM_PLAN = os.environ.get('LOCAL_LLM_PLAN')
+LOCAL_LLM_LATENCY = float(os.environ.get('LOCAL_LLM_LATENCY', '0'))
+# スタブLLM: スロットリングを返す確率、同時呼び出し数の上限 (0 は無制限)、ストリーミングの 1 イベントの文字数
+LOCAL_LLM_THROTTLE_RATE = float(os.environ.get('LOCAL_LLM_THROTTLE_RATE', '0'))
+LOCAL_LLM_MAX_CONCURRENCY = int(os.environ.get('LOCAL_LLM_MAX_CONCURRENCY', '0'))
+LOCAL_LLM_STREAM_CHARS = int(os.environ.get('LOCAL_LLM_STREAM_CHARS', '64'))
+LOCAL_LLM_SEED = int(os.environ.get('LOCAL_LLM_SEED', '0'))
+# オブジェクトのメタデータとして保持する属性 (S3 の copy_object の MetadataDirective に従ってコピーする)
+OBJECT_METADATA = ('ContentType', 'ContentEncoding')
+# スタブLLMが生成するグラフ数の上限
+STUB_MAX_CHARTS = 24
+# micro_insights プロンプトの出力形式 (対象のグラフIDの JSON)
+MICRO_INSIGHTS_PATTERN = re.compile(r'"micro_insights":\s*(\{.*?\})\s*\n')
+
+
+class LocalObjectStore:
+    """
+    ファイルシステム上のオブジェクトストア (S3 クライアントのサブセット)
+    ContentType / ContentEncoding と put_object で書き込んだ内容の ETag (MD5) は {root}/.meta/{bucket}/{key}.json に保存する
+    stage_input でリンクしたファイルの ETag はリンク元のファイルの inode・サイズ・更新時刻から求める
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def path_for(self, bucket, key):
+        """
+        オブジェクトの保存先パス (CLI からの入力ファイル登録用)
+        """
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _read_meta(self, bucket, key):
+        try:
+            with open(self._path(os.path.join('.meta', bucket), key) + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_meta(self, bucket, key, meta):
+        path = self._path(os.path.join('.meta', bucket), key) + '.json'
+        if not meta:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self._path(Bucket, Key)
+        size = os.path.getsize(path)
+        if Range:
+            start, _, end = Range.replace('bytes=', '').partition('-')
+            start = int(start)
+            end = min(int(end) if end else size - 1, size - 1)
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(max(end - start + 1, 0))
+            return {
+                'Body': io.BytesIO(data),
+                'ContentLength': len(data),
+                'ContentRange': f"bytes {start}-{start + len(data) - 1}/{size}"
+            }
+        return dict(self._read_meta(Bucket, Key), Body=open(path, 'rb'), ContentLength=size)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self.path_for(Bucket, Key)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        md5 = hashlib.md5()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(Body, (bytes, bytearray)):
+                f.write(Body)
+                md5.update(Body)
+            else:
+                for block in iter(lambda: Body.read(1024 * 1024), b''):
+                    f.write(block)
+                    md5.update(block)
+        os.replace(tmp_path, path)
+        meta = {k: kwargs[k] for k in OBJECT_METADATA if k in kwargs}
+        self._write_meta(Bucket, Key, dict(meta, ETag=f'"{md5.hexdigest()}"'))
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        stat = os.stat(self._path(Bucket, Key))
+        meta = self._read_meta(Bucket, Key)
+        meta.setdefault('ETag', f'"{stat.st_dev:x}-{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"')
+        return dict(
+            meta,
+            ContentLength=stat.st_size,
+            LastModified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        )
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        src = self._path(CopySource['Bucket'], CopySource['Key'])
+        shutil.copyfile(src, self.path_for(Bucket, Key))
+        meta = self._read_meta(CopySource['Bucket'], CopySource['Key'])
+        if kwargs.get('MetadataDirective') == 'REPLACE':
+            etag = meta.get('ETag')
+            meta = {k: kwargs[k] for k in OBJECT_METADATA if k in kwargs}
+            if etag:
+                meta['ETag'] = etag
+        self._write_meta(Bucket, Key, meta)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        self._write_meta(Bucket, Key, {})
+        return {}
+
+    def list_objects(self, Bucket, Prefix=''):
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(base):
+            for name in filenames:
+                key = os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, '/')
+                if key.startswith(Prefix) and not name.endswith('.tmp'):
+                    contents.append({'Key': key, 'Size': os.path.getsize(os.path.join(dirpath, name))})
+        return sorted(contents, key=lambda obj: obj['Key'])
+
+    def get_paginator(self, operation):
+        if operation != 'list_objects_v2':
+            raise ValueError(f"Unsupported paginator: {operation}")
+        store = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=''):
+                return [{'Contents': store.list_objects(Bucket, Prefix)}]
+        return Paginator()
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600, **kwargs):
+        path = self.path_for(Params['Bucket'], Params['Key'])
+        return 'file://' + path.replace(os.sep, '/')
+
+
+class LocalJobTable:
+    """
+    SQLite 上のジョブテーブル (DynamoDB Table リソースのサブセット)
+    update_item は本システムが使う式 (SET の代入 / list_append / if_not_exists、ADD) のみ解釈する
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, batch_id TEXT, item TEXT NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch_id ON jobs (batch_id)")
+
+    def _load(self, job_id):
+        row = self.conn.execute("SELECT item FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, item):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, batch_id, item) VALUES (?, ?, ?)",
+            (item['jobId'], item.get('batchId'), json.dumps(item, ensure_ascii=False, default=str))
+        )
+
+    def get_item(self, Key, **kwargs):
+        with self.lock:
+            item = self._load(Key['jobId'])
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        with self.lock:
+            self._save(dict(Item))
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, **kwargs):
+        if kwargs.get('ConditionExpression'):
+            raise ValueError('ConditionExpression is not supported by the local job table')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                item = self._load(Key['jobId']) or dict(Key)
+                apply_update(item, UpdateExpression, names, values)
+                self._save(item)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return {}
+
+    def query(self, IndexName=None, KeyConditionExpression=None, **kwargs):
+        expression = KeyConditionExpression.get_expression()
+        key, value = expression['values']
+        if expression['operator'] != '=' or key.name != 'batchId':
+            raise ValueError('Only batchId equality queries are supported by the local job table')
+        with self.lock:
+            rows = self.conn.execute("SELECT item FROM jobs WHERE batch_id = ?", (value,)).fetchall()
+        return {'Items': [json.loads(row[0]) for row in rows]}
+
+    def batch_writer(self):
+        table = self
+
+        class BatchWriter:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def put_item(self, Item):
+                table.put_item(Item=Item)
+        return BatchWriter()
+
+
+ASSIGNMENT_PATTERN = re.compile(r'\s*([#\w]+)\s*=\s*((?:[^,(]|\([^()]*(?:\([^()]*\)[^()]*)*\))+)')
+
+
+def apply_update(item, expression, names, values):
+    """
+    UpdateExpression (SET / ADD) を item に適用
+    """
+    set_part, _, add_part = expression.partition(' ADD ')
+    set_part = set_part.strip()
+    if set_part.startswith('SET '):
+        for attr, value in ASSIGNMENT_PATTERN.findall(set_part[len('SET '):]):
+            item[names.get(attr, attr)] = evaluate_operand(value.strip(), item, names, values)
+    for clause in filter(None, (c.strip() for c in add_part.split(','))):
+        attr, placeholder = clause.split()
+        attr = names.get(attr, attr)
+        item[attr] = item.get(attr, 0) + values[placeholder]
+
+
+def evaluate_operand(operand, item, names, values):
+    """
+    SET の右辺 (:値 / 属性 / if_not_exists / list_append) を評価
+    """
+    if operand.startswith(':'):
+        return values[operand]
+    match = re.fullmatch(r'(if_not_exists|list_append)\((.*)\)', operand)
+    if not match:
+        attr = names.get(operand, operand)
+        return item.get(attr)
+    func, args = match.groups()
+    depth, split_at = 0, None
+    for i, ch in enumerate(args):
+        depth += ch == '('
+        depth -= ch == ')'
+        if ch == ',' and depth == 0:
+            split_at = i
+            break
+    first, second = args[:split_at].strip(), args[split_at + 1:].strip()
+    if func == 'if_not_exists':
+        attr = names.get(first, first)
+        return item[attr] if attr in item else evaluate_operand(second, item, names, values)
+    return list(evaluate_operand(first, item, names, values) or []) + list(
+        evaluate_operand(second, item, names, values) or []
+    )
+
+
+class LocalJobDatabase:
+    """
+    DynamoDB リソース相当 (テーブルごとに SQLite ファイルを持つ)
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                os.makedirs(self.directory, exist_ok=True)
+                self.tables[name] = LocalJobTable(os.path.join(self.directory, f"{name}.sqlite3"))
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            names = request.get('ExpressionAttributeNames') or {}
+            projection = request.get('ProjectionExpression')
+            attrs = [names.get(a.strip(), a.strip()) for a in projection.split(',')] if projection else None
+            items = []
+            for key in request['Keys']:
+                item = table.get_item(Key=key).get('Item')
+                if item is not None:
+                    items.append({k: v for k, v in item.items() if attrs is None or k in attrs})
+            responses[name] = items
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class LocalFunctionInvoker:
+    """
+    Lambda クライアント相当 (processor.handler をプロセス内で実行)
+    """
+    executor = None
+    executor_lock = threading.Lock()
+
+    @classmethod
+    def _executor(cls):
+        with cls.executor_lock:
+            if cls.executor is None:
+                cls.executor = ThreadPoolExecutor(max_workers=LOCAL_WORKERS)
+            return cls.executor
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        import processor
+        event = json.loads(Payload)
+        if InvocationType == 'Event':
+            self._executor().submit(processor.handler, event, None)
+            return {'StatusCode': 202}
+        result = processor.handler(event, None)
+        return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(result, default=str).encode('utf-8'))}
+
+
+class StubClientError(Exception):
+    """
+    botocore の ClientError 相当 (response['Error']['Code'] でエラー種別を判定できる)
+    """
+    def __init__(self, code, message=''):
+        super().__init__(f"An error occurred ({code}): {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class StubLLM:
+    """
+    決定的な応答を返す Bedrock Runtime クライアント相当
+    - 分析プラン: LOCAL_LLM_PLAN の JSON、未指定時は CSV ヘッダーとサンプルデータから生成
+    - 戦略レポート / micro_insights: 定型文
+    - invoke_model_with_response_stream: 同じ応答を LOCAL_LLM_STREAM_CHARS 文字ずつのイベントで返す
+      (疑似遅延は最初のイベントまでに半分、残りをイベント間に均等に割り当てる)
+    - スロットリングの再現: LOCAL_LLM_THROTTLE_RATE の確率、または同時呼び出しが
+      LOCAL_LLM_MAX_CONCURRENCY を超えた場合に ThrottlingException を送出する
+    """
+    lock = threading.Lock()
+    active = 0
+    rng = random.Random(LOCAL_LLM_SEED)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        prompt = json.loads(body)['messages'][0]['content']
+        with self._slot():
+            if LOCAL_LLM_LATENCY > 0:
+                time.sleep(LOCAL_LLM_LATENCY)
+            text = stub_answer(prompt)
+
+        payload = {
+            'content': [{'type': 'text', 'text': text}],
+            'usage': {'input_tokens': len(prompt) // 4, 'output_tokens': len(text) // 4}
+        }
+        return {'body': io.BytesIO(json.dumps(payload, ensure_ascii=False).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        prompt = json.loads(body)['messages'][0]['content']
+        slot = self._slot()
+        slot.__enter__()
+        text = stub_answer(prompt)
+        pieces = [text[i:i + LOCAL_LLM_STREAM_CHARS] for i in range(0, len(text), LOCAL_LLM_STREAM_CHARS)]
+
+        def event(data):
+            return {'chunk': {'bytes': json.dumps(data, ensure_ascii=False).encode('utf-8')}}
+
+        def events():
+            try:
+                if LOCAL_LLM_LATENCY > 0:
+                    time.sleep(LOCAL_LLM_LATENCY / 2)
+                yield event({'type': 'message_start', 'message': {'usage': {'input_tokens': len(prompt) // 4}}})
+                for piece in pieces:
+                    if LOCAL_LLM_LATENCY > 0:
+                        time.sleep(LOCAL_LLM_LATENCY / 2 / len(pieces))
+                    yield event({'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': piece}})
+                yield event({'type': 'message_delta', 'usage': {'output_tokens': len(text) // 4}})
+                yield event({'type': 'message_stop'})
+            finally:
+                slot.__exit__(None, None, None)
+
+        return {'body': events()}
+
+    @contextmanager
+    def _slot(self):
+        """
+        呼び出し 1 回分の同時実行枠 (スロットリングの判定を含む)
+        """
+        with StubLLM.lock:
+            throttled = (
+                (LOCAL_LLM_MAX_CONCURRENCY > 0 and StubLLM.active >= LOCAL_LLM_MAX_CONCURRENCY)
+                or StubLLM.rng.random() < LOCAL_LLM_THROTTLE_RATE
+            )
+            if not throttled:
+                StubLLM.active += 1
+        if throttled:
+            raise StubClientError('ThrottlingException', 'Too many requests, please wait before trying again.')
+        try:
+            yield
+        finally:
+            with StubLLM.lock:
+                StubLLM.active -= 1
+
+
+def stub_answer(prompt):
+    """
+    プロンプトの種類に応じた定型の応答テキスト
+    """
+    if '"column_mapping"' in prompt:
+        answer = load_canned_plan() or stub_plan(prompt)
+    elif '"micro_insights"' in prompt:
+        answer = {'micro_insights': {chart_id: f"{chart_id}: スタブ所見" for chart_id in prompt_chart_ids(prompt)}}
+    else:
+        answer = {'global_report': "# スタブレポート\n\nローカル実行用の定型レポートです。"}
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def load_canned_plan():
+    """
+    LOCAL_LLM_PLAN で指定された分析プラン
+    """
+    if not LOCAL_LLM_PLAN:
+        return None
+    with open(LOCAL_LLM_PLAN, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def prompt_section(prompt, title):
+    """
+    プロンプトの「## title」直後の 1 行
+    """
+    match = re.search(rf'## {title}\s*\n\s*(.*)', prompt)
+    return match.group(1).strip() if match else ''
+
+
+def prompt_chart_ids(prompt):
+    """
+    micro_insights プロンプトの出力形式から対象のグラフIDを取り出す
+    """
+    match = MICRO_INSIGHTS_PATTERN.search(prompt)
+    if not match:
+        return []
+    try:
+        return list(json.loads(match.group(1)))
+    except ValueError:
+        return []
+
+
+def looks_numeric(value):
+    """
+    サンプル値が (桁区切り・全角を含む) 数値か
+    """
+    if value is None or isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    text = str(value).translate(FULLWIDTH_TABLE).replace(',', '').strip()
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def stub_role(column, values):
+    """
+    カラム名とサンプル値からの役割推定
+    """
+    name = column.lower()
+    if any(hint in name for hint in ('timestamp', 'date', '日時', '日付')) or name == 'time':
+        return 'date'
+    if name.endswith('id') or any(hint in name for hint in ('_no', 'number', 'コード', '番号', 'lot')):
+        return 'dimension'
+    present = [v for v in values if v not in (None, '')]
+    if present and all(looks_numeric(v) for v in present):
+        return 'metric'
+    return 'dimension'
+
+
+def stub_plan(prompt):
+    """
+    CSV ヘッダーとサンプルデータから決定的な分析プランを生成
+    """
+    try:
+        headers = ast.literal_eval(prompt_section(prompt, 'CSVヘッダー'))
+    except (ValueError, SyntaxError):
+        headers = []
+    try:
+        records = json.loads(prompt_section(prompt, 'サンプルデータ'))
+    except ValueError:
+        records = []
+
+    column_mapping = {}
+    for column in headers:
+        role = stub_role(column, [r.get(column) for r in records])
+        column_mapping[column] = {'role': role, 'label': column}
+
+    metrics = [c for c, m in column_mapping.items() if m['role'] == 'metric']
+    dimensions = [c for c, m in column_mapping.items() if m['role'] == 'dimension']
+    dates = [c for c, m in column_mapping.items() if m['role'] == 'date']
+
+    specs = []
+    for d in dates[:1]:
+        for m in metrics[:4]:
+            specs.append({'type': 'line', 'dimension': d, 'metric': m, 'aggregation': 'mean'})
+    for dim in dimensions[:4]:
+        for i, m in enumerate(metrics[:3]):
+            specs.append({
+                'type': 'pie' if i == 0 else 'bar',
+                'dimension': dim,
+                'metric': m,
+                'aggregation': 'sum' if i == 0 else 'mean',
+                'limit': 10
+            })
+    for x, y in zip(metrics[:2], metrics[1:3]):
+        specs.append({'type': 'scatter', 'dimension': x, 'metric': y})
+
+    chart_specs = []
+    for i, spec in enumerate(specs[:STUB_MAX_CHARTS], start=1):
+        chart_specs.append(dict(
+            {'id': f"g{i}", 'title': f"{spec['metric']} by {spec['dimension']}"},
+            **spec
+        ))
+    return {'column_mapping': column_mapping, 'chart_specs': chart_specs}
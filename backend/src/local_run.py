@@ -0,0 +1,129 @@
+"""
+ローカル CSV に対して分析パイプライン (processor.handler) を AWS なしで実行する CLI
+
+    python local_run.py input.csv [input2.csv ...] [--plan plan.json] [--workers 4] [--out results/]
+
+EXECUTION_BACKEND=local (ファイルシステム / SQLite / スタブLLM) で実行する。
+複数ファイル指定時は --workers 個のプロセスで並列に処理し、ファイルごとの処理時間とスループットを表示する。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+
+def configure(data_dir=None, plan=None, llm_latency=None):
+    """
+    local バックエンド用の環境変数を設定 (processor などの import 前に呼ぶ)
+    """
+    os.environ['EXECUTION_BACKEND'] = 'local'
+    if data_dir:
+        os.environ['LOCAL_DATA_DIR'] = os.path.abspath(data_dir)
+    if plan:
+        os.environ['LOCAL_LLM_PLAN'] = os.path.abspath(plan)
+    if llm_latency is not None:
+        os.environ['LOCAL_LLM_LATENCY'] = str(llm_latency)
+
+
+def stage_input(store, bucket, key, csv_path):
+    """
+    入力 CSV をオブジェクトストアへ登録 (コピーせずにリンクする)
+    """
+    dest = store.path_for(bucket, key)
+    src = os.path.abspath(csv_path)
+    try:
+        os.link(src, dest)
+    except OSError:
+        try:
+            os.symlink(src, dest)
+        except OSError:
+            import shutil
+            shutil.copyfile(src, dest)
+
+
+def run_file(csv_path, out_dir=None, bypass_cache=False):
+    """
+    1ファイルを 1 ジョブとして processor.handler で処理
+    戻り値: 処理結果の概要 (dict)
+    """
+    import processor
+    import result_format
+    from dispatcher import new_job_item
+
+    job_id = str(uuid.uuid4())
+    key = f"uploads/{job_id}.csv"
+    stage_input(processor.s3, processor.DATA_BUCKET, key, csv_path)
+
+    table = processor.dynamodb.Table(processor.JOB_TABLE)
+    table.put_item(Item=new_job_item(job_id, bypass_cache=bypass_cache))
+
+    started = time.perf_counter()
+    processor.handler({'jobId': job_id, 'bypassCache': bypass_cache}, None)
+    elapsed = time.perf_counter() - started
+
+    item = table.get_item(Key={'jobId': job_id}).get('Item', {})
+    size = os.path.getsize(csv_path)
+    rows = next((e.get('rows') for e in item.get('events', []) if e.get('stage') == 'ingested'), None)
+    summary = {
+        'file': csv_path,
+        'jobId': job_id,
+        'status': item.get('status'),
+        'seconds': round(elapsed, 3),
+        'bytes': size,
+        'rows': rows,
+        'mbPerSec': round(size / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None,
+        'cacheHit': bool(item.get('cacheHit')),
+    }
+    if item.get('error'):
+        summary['error'] = item['error']
+
+    if out_dir and item.get('status') == 'COMPLETED':
+        os.makedirs(out_dir, exist_ok=True)
+        obj = processor.s3.get_object(Bucket=processor.DATA_BUCKET, Key=item['resultKey'])
+        out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(csv_path))[0] + '.json')
+        with obj['Body'] as body:
+            result = result_format.decode_result(body.read())
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        summary['result'] = out_path
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析パイプラインのローカル実行')
+    parser.add_argument('csv', nargs='+', help='入力 CSV ファイル')
+    parser.add_argument('--plan', help='スタブLLMが返す分析プランの JSON (未指定時はヘッダーから生成)')
+    parser.add_argument('--data-dir', help='ローカルのオブジェクトストア / ジョブテーブルの置き場')
+    parser.add_argument('--out', help='結果 JSON の出力先ディレクトリ')
+    parser.add_argument('--workers', type=int, default=1, help='並列に処理するプロセス数')
+    parser.add_argument('--llm-latency', type=float, help='スタブLLMの疑似応答遅延 (秒)')
+    parser.add_argument('--bypass-cache', action='store_true', help='結果キャッシュを使わずに再分析する')
+    args = parser.parse_args()
+
+    configure(args.data_dir, args.plan, args.llm_latency)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    started = time.perf_counter()
+    if args.workers > 1 and len(args.csv) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(run_file, path, args.out, args.bypass_cache) for path in args.csv]
+            summaries = [f.result() for f in futures]
+    else:
+        summaries = [run_file(path, args.out, args.bypass_cache) for path in args.csv]
+    elapsed = time.perf_counter() - started
+
+    for summary in summaries:
+        print(json.dumps(summary, ensure_ascii=False))
+    total_bytes = sum(s['bytes'] for s in summaries)
+    print(
+        f"{len(summaries)} files, {total_bytes / 1024 / 1024:.1f} MB in {elapsed:.2f}s "
+        f"({total_bytes / 1024 / 1024 / elapsed:.2f} MB/s, workers={args.workers})"
+    )
+    return 0 if all(s['status'] == 'COMPLETED' for s in summaries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
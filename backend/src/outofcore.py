@@ -0,0 +1,220 @@
+"""
+メモリに載らない大きな入力の集計 (out-of-core 実行)
+
+入力をチャンク単位で読み込みながら、グラフごとの部分集計だけをメモリに保持し、最後に build_charts と
+同じ形式の集計結果に仕上げる。DataFrame 全体は作らないため、ピークメモリはチャンク行数と部分集計の大きさで決まる。
+部分集計の形式とマージは増分分析 (incremental.py) と共通で、チャンクごとの compute_partials を順にマージする。
+
+    ranking : dimension の値ごとの n / sum / min / max / mean / M2。値の種類が OUT_OF_CORE_MAX_GROUPS を
+              超えたら値のハッシュで OUT_OF_CORE_SPILL_PARTITIONS 個に分割して /tmp に書き出し、
+              仕上げでは分割ごとにマージして上位の候補・件数・合計だけを残す
+    series  : 1 時間単位の n / sum / max (期間に比例し、行数には比例しない)
+    scatter : チャンクごとの代表点を件数で重み付けして再集計 (点数は SCATTER_POINT_BUDGET 以内)
+    summary : 行数と metric ごとの n / sum
+
+散布図は代表点に対して外れ値を判定するため、全行から求めた場合と一致しないことがある
+(各軸の最小・最大の点と件数の合計は一致する)。ランダムサンプル (リザーバ) は外れ値が残らないため使わない。
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import incremental
+from aggregation import finalize_ranking, normalize_agg
+
+# out-of-core で集計するか (auto は入力サイズが OUT_OF_CORE_MIN_BYTES 以上の場合)
+OUT_OF_CORE_MODE = os.environ.get('OUT_OF_CORE_MODE', 'auto')
+# auto で out-of-core にする入力サイズ (既定は Lambda のメモリサイズの半分)
+OUT_OF_CORE_MIN_BYTES = int(os.environ.get(
+    'OUT_OF_CORE_MIN_BYTES', str(int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')) * 1024 * 1024 // 2)
+))
+# ランキングの部分集計をメモリに保持する dimension の値の種類数 (超えたら書き出す)
+OUT_OF_CORE_MAX_GROUPS = int(os.environ.get('OUT_OF_CORE_MAX_GROUPS', '200000'))
+# 書き出し時の分割数
+OUT_OF_CORE_SPILL_PARTITIONS = int(os.environ.get('OUT_OF_CORE_SPILL_PARTITIONS', '16'))
+# 書き出し先 (Lambda では /tmp)
+OUT_OF_CORE_SPILL_DIR = os.environ.get('OUT_OF_CORE_SPILL_DIR', tempfile.gettempdir())
+
+
+def use_out_of_core(input_bytes):
+    """
+    入力サイズから out-of-core で集計するかを決める
+    """
+    if OUT_OF_CORE_MODE == 'always':
+        return True
+    if OUT_OF_CORE_MODE == 'auto':
+        return input_bytes >= OUT_OF_CORE_MIN_BYTES
+    return False
+
+
+def combine_stats(frames):
+    """
+    複数の部分集計 (同じ値が複数のフレームに現れてよい) を値ごとにまとめる
+    M2 は各フレームの M2 と平均の差から求める (incremental.merge_stats と同じ結果)
+    """
+    stats = pd.concat(frames)
+    if stats.empty:
+        return stats
+    grouped = stats.groupby(level=0, sort=True)
+    n = grouped['n'].sum()
+    total = grouped['sum'].sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted = (stats['mean'].fillna(0) * stats['n']).groupby(level=0, sort=True).sum()
+        mean = (weighted / n).where(n > 0)
+        delta = stats['mean'].fillna(0) - mean.reindex(stats.index).fillna(0)
+        m2 = (stats['m2'].fillna(0) + stats['n'] * delta ** 2).groupby(level=0, sort=True).sum()
+    return pd.DataFrame({
+        'n': n,
+        'sum': total,
+        'min': grouped['min'].min(),
+        'max': grouped['max'].max(),
+        'mean': mean,
+        'm2': m2.where(n > 0, 0.0),
+    })
+
+
+class SpillingStats:
+    """
+    dimension の値ごとの部分集計 (値の種類が上限を超えたらハッシュ分割してディスクに書き出す)
+    """
+    def __init__(self, directory, max_groups=None, partitions=None):
+        self.directory = directory
+        self.max_groups = max_groups or OUT_OF_CORE_MAX_GROUPS
+        self.partitions = partitions or OUT_OF_CORE_SPILL_PARTITIONS
+        self.stats = None
+        self.spills = 0
+
+    def add(self, stats):
+        self.stats = stats if self.stats is None else incremental.merge_stats(self.stats, stats)
+        if len(self.stats) > self.max_groups:
+            self.spill()
+
+    def partition_of(self, index):
+        return pd.util.hash_array(np.asarray(index, dtype=object)) % self.partitions
+
+    def spill(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for p, part in self.stats.groupby(self.partition_of(self.stats.index)):
+            part.to_pickle(os.path.join(self.directory, f"{p}-{self.spills}.pkl"))
+        self.spills += 1
+        self.stats = None
+
+    def parts(self):
+        """
+        値の集合が重ならない部分集計を順に返す (書き出していなければメモリ上の 1 つ)
+        """
+        if not self.spills:
+            if self.stats is not None:
+                yield self.stats
+            return
+        memory = None
+        if self.stats is not None:
+            memory = dict(list(self.stats.groupby(self.partition_of(self.stats.index))))
+        for p in range(self.partitions):
+            frames = [
+                pd.read_pickle(os.path.join(self.directory, f"{p}-{i}.pkl")) for i in range(self.spills)
+                if os.path.exists(os.path.join(self.directory, f"{p}-{i}.pkl"))
+            ]
+            if memory and p in memory:
+                frames.append(memory[p])
+            if frames:
+                yield combine_stats(frames)
+
+
+class OutOfCoreAggregator:
+    """
+    チャンクを順に受け取り、プランの全グラフの部分集計を保持する
+    """
+    def __init__(self, plan, spill_dir=None):
+        self.plan = plan
+        self.col_map = plan.get('column_mapping', {})
+        self.directory = tempfile.mkdtemp(prefix='outofcore-', dir=spill_dir or OUT_OF_CORE_SPILL_DIR)
+        self.ranking = {}
+        self.partials = None
+        self.rows = 0
+
+    def add(self, chunk):
+        part = incremental.compute_partials(chunk, self.plan, self.col_map)
+        for name, stats in part['ranking'].items():
+            if name not in self.ranking:
+                self.ranking[name] = SpillingStats(os.path.join(self.directory, str(len(self.ranking))))
+            self.ranking[name].add(stats)
+        part['ranking'] = {}
+        self.partials = part if self.partials is None else incremental.merge_partials(self.partials, part, self.plan)
+        self.rows += len(chunk)
+
+    def spilled(self):
+        """
+        ディスクに書き出したランキングの数
+        """
+        return sum(1 for stats in self.ranking.values() if stats.spills)
+
+    def summary_partials(self):
+        """
+        summarize_partials に渡す部分集計
+        """
+        return self.partials or {'ranking': {}, 'series': {}, 'scatter': {}, 'summary': {'rows': 0, 'metrics': {}}}
+
+    def finalize_charts(self):
+        """
+        build_charts と同じ形式の集計結果
+        """
+        specs = self.plan.get('chart_specs', [])
+        charts_res = incremental.finalize_charts(self.summary_partials(), self.plan, self.col_map)
+
+        # ランキングは (dimension, metric, mean用マスク有無) ごとに分割を 1 回だけ読み、集計種別ごとの候補を集める
+        ranking_specs = []
+        keep = {}
+        for spec in specs:
+            if spec.get('type') == 'scatter' or self.col_map.get(spec.get('dimension'), {}).get('role') == 'date':
+                continue
+            agg_type = normalize_agg(spec.get('aggregation', 'sum'))
+            name = f"{spec.get('dimension')}\0{spec.get('metric')}\0{int(agg_type == 'mean')}"
+            if name in self.ranking:
+                ranking_specs.append((spec, name, agg_type))
+                needs = keep.setdefault(name, {})
+                needs[agg_type] = max(needs.get(agg_type, 0), spec.get('limit', 10) + 2)
+        candidates = {name: self.rank_candidates(name, needs) for name, needs in keep.items()}
+
+        for spec, name, agg_type in ranking_specs:
+            values, groups, total = candidates[name][agg_type]
+            charts_res[spec.get('id')] = finalize_candidates(
+                values, groups, total, spec.get('limit', 10), spec.get('type', 'bar')
+            )
+        return charts_res
+
+    def rank_candidates(self, name, needs):
+        """
+        集計種別ごとの (上位の候補, 値の種類数, 全体の合計)
+        needs: {集計種別: 分割ごとに残す上位件数}
+        """
+        metric = name.split('\0')[1]
+        found = {agg_type: ([], 0, 0.0) for agg_type in needs}
+        for stats in self.ranking[name].parts():
+            for agg_type, k in needs.items():
+                values = incremental.ranking_values(stats, agg_type, metric)
+                top, groups, total = found[agg_type]
+                top.append(values.sort_values(ascending=False).head(k))
+                found[agg_type] = (top, groups + len(values), total + float(values.sum()))
+        return {
+            agg_type: (pd.concat(top) if top else pd.Series(dtype=float, name=metric), groups, total)
+            for agg_type, (top, groups, total) in found.items()
+        }
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def finalize_candidates(values, groups, total, limit=10, chart_type='bar'):
+    """
+    分割ごとの上位の候補から finalize_ranking と同じ結果を作る
+    値の種類が limit + 2 以下なら候補にすべての値が含まれる。それ以外は上位 limit 件と、
+    構成比グラフでは全体の合計から上位の合計を引いた「その他」
+    """
+    if groups <= limit + 2:
+        return finalize_ranking(values, limit, chart_type)
+    top_n = values.sort_values(ascending=False).head(limit)
+    if chart_type in ['pie', 'doughnut']:
+        return pd.concat([top_n, pd.Series({'その他': total - float(top_n.sum())})]).to_dict()
+    return top_n.to_dict()
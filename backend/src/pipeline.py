@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# ステージ実行スレッド数 (Bedrock 呼び出しなど I/O 待ちのステージを並行させる)
+PIPELINE_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', '8'))
+
+
+def run_stages(stages, max_workers=None):
+    """
+    依存関係つきのステージ群 (DAG) をスレッドプールで実行
+    stages: { ステージ名: (関数, [依存ステージ名, ...]) }
+            関数は依存ステージの結果 { ステージ名: 結果 } を受け取る
+    依存がすべて完了したステージから順次投入し、I/O 待ちのステージ同士を並行させる
+    いずれかのステージが例外を送出した場合、未着手のステージは実行せずにその例外を再送出する
+    戻り値: { ステージ名: 結果 }
+    """
+    for name, (_, deps) in stages.items():
+        unknown = [d for d in deps if d not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {unknown}")
+
+    results = {}
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or PIPELINE_MAX_WORKERS) as pool:
+        while pending or running:
+            ready = [name for name, (_, deps) in pending.items() if all(d in results for d in deps)]
+            for name in ready:
+                fn, deps = pending.pop(name)
+                running[pool.submit(fn, {d: results[d] for d in deps})] = name
+
+            if not running:
+                raise ValueError(f"Stage dependencies cannot be resolved: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+    return results
@@ -0,0 +1,222 @@
+"""
+スキーマ単位の分析プランキャッシュ
+
+CSV のカラム名・推論型・DB構造情報 (+ モデルID・プロンプト版) から求めたフィンガープリントで
+分析プラン (column_mapping / chart_specs) を保存し、同じスキーマのジョブでは計画用の Bedrock 呼び出しを省略する。
+
+保存先は PLAN_CACHE_BACKEND で切り替える:
+    s3    : DATA_BUCKET の plan-cache/{fingerprint}.json (既定)
+    local : PLAN_CACHE_DIR 配下の JSON ファイル (ローカル実行・検証用)
+    none  : キャッシュしない
+
+無効化:
+    python plan_cache.py invalidate <fingerprint>   # 1件
+    python plan_cache.py invalidate --all           # 全件
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+PLAN_CACHE_BACKEND = os.environ.get('PLAN_CACHE_BACKEND', 's3')
+PLAN_CACHE_DIR = os.environ.get('PLAN_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'plan-cache'))
+PLAN_CACHE_PREFIX = 'plan-cache/'
+
+# プロセス内のヒット/ミス件数 (ウォームスタート間で累積)
+stats = {'hits': 0, 'misses': 0}
+
+
+def dtype_kind(dtype):
+    """
+    サンプル数行の型推論の揺れを吸収した型分類 (整数/小数は同一視する)
+    """
+    kind = getattr(dtype, 'kind', 'O')
+    if kind in 'iuf':
+        return 'number'
+    if kind == 'b':
+        return 'bool'
+    if kind == 'M':
+        return 'datetime'
+    return 'text'
+
+
+def schema_fingerprint(sample_df, db_info, model_id, prompt_version):
+    """
+    スキーマのフィンガープリント
+    カラム名 (前後空白除去)・推論型・DB.txt のハッシュ・モデルID・プロンプト版から計算する
+    """
+    schema = {
+        'columns': [[str(c).strip(), dtype_kind(t)] for c, t in sample_df.dtypes.items()],
+        'db': hashlib.sha256((db_info or '').encode('utf-8')).hexdigest(),
+        'model': model_id,
+        'prompt': prompt_version,
+    }
+    raw = json.dumps(schema, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def is_valid_plan(plan):
+    """
+    キャッシュ可能なプランか (column_mapping と chart_specs を持つ dict)
+    """
+    return (
+        isinstance(plan, dict)
+        and isinstance(plan.get('column_mapping'), dict)
+        and bool(plan.get('chart_specs'))
+    )
+
+
+class S3PlanCache:
+    """
+    S3 オブジェクトとしてプランを保存するバックエンド
+    """
+    def __init__(self, s3_client, bucket, prefix=PLAN_CACHE_PREFIX):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, fingerprint):
+        return f"{self.prefix}{fingerprint}.json"
+
+    def get(self, fingerprint):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(fingerprint))
+        except Exception:
+            return None
+        return json.loads(obj['Body'].read())
+
+    def put(self, fingerprint, plan):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._key(fingerprint),
+            Body=json.dumps(plan, ensure_ascii=False),
+            ContentType='application/json'
+        )
+
+    def delete(self, fingerprint):
+        self.s3.delete_object(Bucket=self.bucket, Key=self._key(fingerprint))
+
+    def clear(self):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                self.s3.delete_object(Bucket=self.bucket, Key=obj['Key'])
+
+
+class LocalFilePlanCache:
+    """
+    ローカルディレクトリに JSON ファイルとしてプランを保存するバックエンド
+    """
+    def __init__(self, directory=PLAN_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, fingerprint):
+        return os.path.join(self.directory, f"{fingerprint}.json")
+
+    def get(self, fingerprint):
+        try:
+            with open(self._path(fingerprint), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, fingerprint, plan):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(fingerprint))
+
+    def delete(self, fingerprint):
+        try:
+            os.remove(self._path(fingerprint))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def create_backend(s3_client=None, bucket=None, name=None):
+    """
+    PLAN_CACHE_BACKEND に応じたバックエンドを生成 (none の場合は None)
+    """
+    name = name or PLAN_CACHE_BACKEND
+    if name == 's3':
+        return S3PlanCache(s3_client, bucket)
+    if name == 'local':
+        return LocalFilePlanCache()
+    return None
+
+
+def lookup(backend, fingerprint):
+    """
+    キャッシュ済みプランの取得 (ヒット/ミスを計数)
+    """
+    plan = None
+    if backend is not None:
+        try:
+            plan = backend.get(fingerprint)
+        except Exception as e:
+            print(f"Plan cache lookup failed: {str(e)}")
+
+    if is_valid_plan(plan):
+        stats['hits'] += 1
+        print(f"Plan cache hit: {fingerprint} (hits={stats['hits']}, misses={stats['misses']})")
+        return plan
+    stats['misses'] += 1
+    print(f"Plan cache miss: {fingerprint} (hits={stats['hits']}, misses={stats['misses']})")
+    return None
+
+
+def store(backend, fingerprint, plan):
+    """
+    プランをキャッシュに登録 (登録失敗はジョブの成否に影響させない)
+    """
+    if backend is None or not is_valid_plan(plan):
+        return
+    try:
+        backend.put(fingerprint, plan)
+    except Exception as e:
+        print(f"Plan cache store failed: {str(e)}")
+
+
+def invalidate(backend, fingerprint=None):
+    """
+    キャッシュの無効化 (fingerprint 未指定時は全件)
+    """
+    if backend is None:
+        return
+    if fingerprint:
+        backend.delete(fingerprint)
+    else:
+        backend.clear()
+    print(f"Plan cache invalidated: {fingerprint or 'all'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析プランキャッシュの管理')
+    sub = parser.add_subparsers(dest='command', required=True)
+    inv = sub.add_parser('invalidate', help='キャッシュを無効化する')
+    inv.add_argument('fingerprint', nargs='?')
+    inv.add_argument('--all', action='store_true')
+    args = parser.parse_args()
+
+    if not args.fingerprint and not args.all:
+        parser.error('fingerprint または --all を指定してください')
+
+    s3_client = None
+    if PLAN_CACHE_BACKEND == 's3':
+        import boto3
+        s3_client = boto3.client('s3')
+    backend = create_backend(s3_client, os.environ.get('DATA_BUCKET'))
+    invalidate(backend, None if args.all else args.fingerprint)
+
+
+if __name__ == '__main__':
+    main()
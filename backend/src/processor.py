@@ -1,20 +1,58 @@
 import json
 import os
 import re
-import boto3
-import pandas as pd
-import io
-import urllib3
+import threading
+from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+# pandas / pyarrow に依存するモジュール (ingest, cleansing, aggregation, timeseries, approximate, scatter,
+# columnar, incremental, outofcore) は使う関数の中で import する (結果キャッシュにヒットしたジョブでは読み込まない)
+import result_cache
+import prompt_digest
+import result_format
+import sources
+import llm
+import plan_cache
+from pipeline import run_stages
+from progress import JobProgress
+import tracing
+from tracing import Trace
+import backends
+import scheduler
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-bedrock = boto3.client('bedrock-runtime')
-http = urllib3.PoolManager()
+s3 = backends.object_store()
+dynamodb = backends.job_database()
+bedrock = backends.llm_client()
+# ジョブのキュー (QUEUE_TABLE 未設定時は None で、実行枠を確認せずに実行する)
+queue_store = scheduler.create_store()
 
-DATA_BUCKET = os.environ['DATA_BUCKET']
-JOB_TABLE = os.environ['JOB_TABLE']
+@backends.lazy
+def http_pool():
+    """
+    Webhook 送信用の HTTP コネクションプール
+    """
+    import urllib3
+    return urllib3.PoolManager()
+
+http = http_pool()
+# DB.txt の内容 (load_db_info)
+db_info_cache = None
+
+DATA_BUCKET = backends.env('DATA_BUCKET', 'local-data')
+JOB_TABLE = backends.env('JOB_TABLE', 'local-jobs')
 MODEL_ID = os.environ.get('MODEL_ID', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
+# クレンジング後の metric カラムの型 (メモリ削減のため既定は float32)
+METRIC_DTYPE = os.environ.get('METRIC_DTYPE', 'float32')
+# プロンプトテンプレートの版 (プロンプトを変更したら更新し、結果キャッシュを無効化する)
+PROMPT_TEMPLATE_VERSION = '3'
+# 1回の Bedrock 呼び出しで micro_insights を生成するグラフ数 (チャンクごとに並列で呼び出す)
+MICRO_INSIGHT_CHUNK_SIZE = int(os.environ.get('MICRO_INSIGHT_CHUNK_SIZE', '5'))
+# データ概要で合計ではなく平均を取る指標名のキーワード
+MEAN_METRIC_KEYWORDS = ['率', 'タイム', 'Time', '温度', 'Temp', '圧力', 'Press', '単価', '精度']
+# プロンプトの応答から JSON オブジェクトを取り出すパターン
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+# 分析プランの受信中に column_mapping が確定した時点でデータセットの読み込みを先行開始するか
+LOAD_PREFETCH = os.environ.get('LOAD_PREFETCH', 'true').lower() == 'true'
 
 def send_webhook(callback_url, payload):
     """
@@ -22,45 +60,84 @@ def send_webhook(callback_url, payload):
     """
     try:
         encoded_data = json.dumps(payload).encode('utf-8')
-        res = http.request(
-            'POST',
-            callback_url,
-            body=encoded_data,
-            headers={'Content-Type': 'application/json'},
-            timeout=10.0
-        )
+        with tracing.span('webhook'):
+            res = http.request(
+                'POST',
+                callback_url,
+                body=encoded_data,
+                headers={'Content-Type': 'application/json'},
+                timeout=10.0
+            )
         print(f"Webhook sent to {callback_url}, status: {res.status}")
     except Exception as e:
         print(f"Failed to send webhook: {str(e)}")
 
-def clean_num(val):
+def load_db_info():
     """
-    Aggressive Number Parsing: カンマ、円記号、全角数字などを除去して数値化
+    DB構造情報 (DB.txt) の内容 (デプロイパッケージに同梱されるため、初回に読んだ内容をウォームスタート間で再利用する)
     """
-    if pd.isna(val) or val == '':
-        return 0
-    s = str(val).replace(' ', '').replace('　', '')
-    # 正規表現で数値、マイナス、ドット以外を除去
-    s = re.sub(r'[^-0-9.]', '', s)
-    try:
-        return float(s)
-    except:
-        return 0
+    global db_info_cache
+    if db_info_cache is None:
+        db_info_cache = ""
+        db_txt_path = os.path.join(os.path.dirname(__file__), 'DB.txt')
+        if os.path.exists(db_txt_path):
+            try:
+                with open(db_txt_path, 'r', encoding='utf-8') as f:
+                    db_info_cache = f.read()
+            except:
+                pass
+    return db_info_cache
 
-def call_bedrock(prompt, max_tokens=4000):
+def csv_location(job_id, data_source):
+    """
+    ジョブの入力 CSV の場所 (外部S3ソース指定時はその URI、それ以外はアップロード先)
+    """
+    if data_source and data_source.get('type') == 's3':
+        # s3://bucket/key 形式をパース
+        uri = data_source['uri'].replace('s3://', '')
+        bucket, key = uri.split('/', 1)
+        return bucket, key
+    return DATA_BUCKET, f"uploads/{job_id}.csv"
+
+def plain_json(value):
+    """
+    DynamoDB から取得した値 (数値は Decimal) を JSON 相当の型に変換
+    """
+    return json.loads(json.dumps(value, default=lambda d: int(d) if d == int(d) else float(d)))
+
+def complete_job(tracker, result_key, callback_url, cache_hit=False, trace=None):
+    """
+    ジョブを COMPLETED に更新 (ステージ計測結果も保存) し、Webhook を通知
+    """
+    tracker.update(
+        "#s = :s, resultKey = :rk, cacheHit = :ch, #t = :t",
+        names={'#s': 'status', '#t': 'trace'},
+        values={':s': 'COMPLETED', ':rk': result_key, ':ch': cache_hit, ':t': trace}
+    )
+
+    # Webhook通知
+    if callback_url:
+        send_webhook(callback_url, {
+            'jobId': tracker.job_id,
+            'status': 'COMPLETED',
+            'resultKey': result_key
+        })
+
+def call_bedrock(prompt, max_tokens=4000, on_key=None):
     """
     Bedrock (Claude 3.5 Sonnet) 呼び出しの共通関数
+    リトライ・流量制御・ストリーミング受信は llm.invoke で行う
+    on_key: 応答 JSON のトップレベルのキーの値が確定するたびに呼ぶ関数 (受信完了前に後続処理を始める場合)
     """
     body = json.dumps({
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
         "messages": [{"role": "user", "content": prompt}]
     })
-    response = bedrock.invoke_model(modelId=MODEL_ID, body=body)
-    res_raw = json.loads(response['body'].read())['content'][0]['text']
+    res_raw = llm.invoke(bedrock, MODEL_ID, body, on_key=on_key)
     
     # JSON抽出ロジック
-    json_match = re.search(r'\{.*\}', res_raw, re.DOTALL)
+    json_match = JSON_OBJECT_PATTERN.search(res_raw)
     if json_match:
         try:
             return json.loads(json_match.group(), strict=False)
@@ -68,112 +145,47 @@ def call_bedrock(prompt, max_tokens=4000):
             return res_raw
     return res_raw
 
-def aggregate_dynamic(df, spec):
-    """
-    AIプランに基づく動的集計
-    spec: { id, title, type, dimension, metric, aggregation, limit }
-    """
-    dim = spec.get('dimension')
-    met = spec.get('metric')
-    agg_type = spec.get('aggregation', 'sum')
-    limit = spec.get('limit', 10)
-    chart_type = spec.get('type', 'bar')
-
-    if dim not in df.columns or met not in df.columns:
-        return {}
-
-    if agg_type == 'sum':
-        agg = df.groupby(dim)[met].sum()
-    elif agg_type == 'count':
-        agg = df.groupby(dim)[met].count()
-    elif agg_type == 'mean':
-        valid_df = df[df[met] > 0]
-        agg = valid_df.groupby(dim)[met].mean() if not valid_df.empty else pd.Series()
-    elif agg_type == 'max':
-        agg = df.groupby(dim)[met].max()
-    elif agg_type == 'min':
-        agg = df.groupby(dim)[met].min()
-    elif agg_type == 'std':
-        agg = df.groupby(dim)[met].std()
-    else:
-        agg = df.groupby(dim)[met].sum()
-
-    agg = agg.sort_values(ascending=False)
-
-    # Ranking vs Share logic
-    include_others = chart_type in ['pie', 'doughnut']
-    
-    if len(agg) > limit + 2:
-        top_n = agg.head(limit)
-        if include_others:
-            others_val = agg.iloc[limit:].sum()
-            others = pd.Series({'その他': others_val})
-            return pd.concat([top_n, others]).to_dict()
-        return top_n.to_dict()
-    return agg.to_dict()
-
-def handler(event, context):
+def build_load_spec(plan, raw_headers):
     """
-    汎用AI分析エンジン (Universal Semantic Analysis & Dynamic Execution)
+    分析プランから本読み込みで使う usecols / dtype を作る
+    - column_mapping の metric / date と chart_specs が参照するカラムのみ読み込む
+    - 分類軸としてのみ使われる dimension カラムは category で読み込む
+    戻り値: (usecols, dtype) ※ファイル上の (空白除去前の) カラム名で指定
     """
-    table = dynamodb.Table(JOB_TABLE)
-    job_id = None
-    callback_url = None
-
-    try:
-        if 'Records' in event:
-            bucket = event['Records'][0]['s3']['bucket']['name']
-            key = event['Records'][0]['s3']['object']['key']
-            job_id = key.split('/')[-1].replace('.csv', '')
-        else:
-            job_id = event.get('jobId')
-            data_source = event.get('dataSource')
-            if data_source and data_source.get('type') == 's3':
-                # s3://bucket/key 形式をパース
-                uri = data_source['uri'].replace('s3://', '')
-                bucket, key = uri.split('/', 1)
-            else:
-                bucket = DATA_BUCKET
-                key = f"uploads/{job_id}.csv"
-
-        # ジョブ情報の取得 (callbackUrl確認用)
-        job_item = table.get_item(Key={'jobId': job_id}).get('Item', {})
-        callback_url = job_item.get('callbackUrl')
+    col_map = plan.get('column_mapping', {})
+    cols = {c for c, m in col_map.items() if m.get('role') in ('metric', 'date')}
+    axis_only = {c for c, m in col_map.items() if m.get('role') == 'dimension'}
+    for spec in plan.get('chart_specs', []):
+        cols.update([spec.get('dimension'), spec.get('metric')])
+        # 集計対象や散布図の軸に使われるカラムは型推論に任せる
+        axis_only.discard(spec.get('metric'))
+        if spec.get('type') == 'scatter':
+            axis_only.discard(spec.get('dimension'))
 
-        table.update_item(
-            Key={'jobId': job_id},
-            UpdateExpression="SET #s = :s",
-            ExpressionAttributeNames={'#s': 'status'},
-            ExpressionAttributeValues={':s': 'PROCESSING'}
-        )
+    usecols = [h for h in raw_headers if h.strip() in cols]
+    dtype = {h: 'category' for h in usecols if h.strip() in axis_only}
+    return usecols, dtype
 
-        # 1. CSV取得 & エンコーディング判定
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        body = obj['Body'].read()
-        
-        try:
-            text = body.decode('utf-8-sig')
-        except:
-            text = body.decode('shift_jis', errors='replace')
+def prepare_chunk(chunk, metrics, dates, date_formats):
+    """
+    チャンク単位のクレンジング (metric は METRIC_DTYPE へ数値化、date は datetime 化)
+    date_formats: カラムごとの推定日付フォーマットのキャッシュ (チャンク間で共有)
+    """
+    from cleansing import clean_metric_columns
+    from timeseries import parse_date_column
+    clean_metric_columns(chunk, metrics, dtype=METRIC_DTYPE)
 
-        # 2. データ読み込み & サンプル抽出
-        df_raw = pd.read_csv(io.StringIO(text))
-        df_raw.columns = [c.strip() for c in df_raw.columns]
-        sample_data = df_raw.head(5).to_json(orient='records', force_ascii=False)
-        headers = list(df_raw.columns)
+    for d in dates:
+        # YYYYMMDDhhmmss 形式や標準的な形式を柔軟にパース
+        chunk[d] = parse_date_column(chunk[d], date_formats, d)
+        # 日付がパースできない行は除外せず、集計時に考慮
+    return chunk
 
-        # 2.5 DB構造情報の読み込み (もし存在すれば)
-        db_info = ""
-        db_txt_path = os.path.join(os.path.dirname(__file__), 'DB.txt')
-        if os.path.exists(db_txt_path):
-            try:
-                with open(db_txt_path, 'r', encoding='utf-8') as f:
-                    db_info = f.read()
-            except:
-                pass
-
-        # 3. Step 1: Universal Semantic Analysis & Planning (AI)
-        planning_prompt = f"""
+def build_planning_prompt(db_info, headers, sample_data):
+    """
+    Step 1 (分析プラン策定) のプロンプト
+    """
+    return f"""
         あなたは高度なデータサイエンティストであり、製造業の生産技術エキスパートです。
         提供されたCSVの構造と、以下のDB構造情報を分析し、生産性向上、品質改善、設備稼働率最適化の観点から最適な分析プランを策定してください。
 
@@ -218,97 +230,323 @@ def handler(event, context):
           ]
         }}
         """
-        
-        plan = call_bedrock(planning_prompt)
-        if not isinstance(plan, dict):
-            raise Exception("AI Planning failed to return valid JSON")
-
-        # プランをDynamoDBに保存
-        table.update_item(
-            Key={'jobId': job_id},
-            UpdateExpression="SET analysisPlan = :p",
-            ExpressionAttributeValues={':p': plan}
+
+def load_dataset(bucket, key, plan, raw_headers, encoding, byte_range=None, header=None, date_formats=None,
+                 cancel=None):
+    """
+    プランが参照するカラムのみを型指定で読み込み、チャンク単位でクレンジングして結合
+    byte_range: (開始, 終了) バイト位置 (増分分析で追記分のみを読む場合。header にヘッダー行のバイト列を渡す)
+    date_formats: カラムごとの推定日付フォーマット (前回の推定結果を引き継ぐ場合に渡す。推定結果が追加される)
+    cancel: セットされたらチャンクの区切りで読み込みを中止する threading.Event (先行読み込み用)
+    """
+    from ingest import concat_chunks
+    parts = read_chunks(bucket, key, plan, raw_headers, encoding, byte_range, header, date_formats, cancel)
+    with tracing.span('concat') as sp:
+        df = concat_chunks(parts)
+        sp['rows'] = len(df)
+    print(f"Ingested {len(df)} rows, {len(df.columns)} columns")
+    return df
+
+def read_chunks(bucket, key, plan, raw_headers, encoding, byte_range=None, header=None, date_formats=None,
+                cancel=None):
+    """
+    1 オブジェクトをチャンク単位で読み込んでクレンジングし、チャンクのリストを返す (結合は呼び出し側)
+    """
+    return list(iter_chunks(bucket, key, plan, raw_headers, encoding, byte_range, header, date_formats, cancel))
+
+def iter_chunks(bucket, key, plan, raw_headers, encoding, byte_range=None, header=None, date_formats=None,
+                cancel=None):
+    """
+    1 オブジェクトをチャンク単位で読み込み、クレンジング済みのチャンクを順に返す
+    """
+    from ingest import PrefixedStream, read_csv_chunks
+    col_map = plan.get('column_mapping', {})
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
+    dates = [c for c, m in col_map.items() if m.get('role') == 'date']
+    usecols, dtype = build_load_spec(plan, raw_headers)
+
+    with tracing.span('s3_get', merge=True):
+        if byte_range:
+            obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={byte_range[0]}-{byte_range[1] - 1}")
+        else:
+            obj = s3.get_object(Bucket=bucket, Key=key)
+    body = obj['Body']
+    if header is not None:
+        # 範囲取得した本文の前にヘッダー行を補う
+        body = PrefixedStream(header, body)
+    date_formats = {} if date_formats is None else date_formats
+    chunks = read_csv_chunks(body, encoding=encoding, usecols=usecols, dtype=dtype)
+    while True:
+        if cancel is not None and cancel.is_set():
+            raise Exception(f"Loading s3://{bucket}/{key} was cancelled")
+        # S3 からの読み出し・デコード・CSV パースは逐次処理のため 1 つのスパンで計測する
+        with tracing.span('read_csv', merge=True) as sp:
+            chunk = next(chunks, None)
+            sp['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        with tracing.span('cleansing', merge=True) as sp:
+            chunk = prepare_chunk(chunk, metrics, dates, date_formats)
+            sp['rows'] = len(chunk)
+        yield chunk
+
+def load_sources(bucket, keys, plan, cancel=None):
+    """
+    複数オブジェクト (プレフィックス / glob 指定) を並行して取得・パースし、1 つの DataFrame に結合
+    エンコーディング・ヘッダー・日付フォーマットはオブジェクトごとに判定する
+    cancel: load_dataset と同じ
+    """
+    import pandas as pd
+    from ingest import concat_chunks, read_head
+
+    def read_part(key):
+        head_df, part_encoding = read_head(s3, bucket, key)
+        return read_chunks(bucket, key, plan, list(head_df.columns), part_encoding, cancel=cancel)
+
+    read_part = tracing.propagate('source_part', read_part)
+    with ThreadPoolExecutor(max_workers=sources.SOURCE_FETCH_CONCURRENCY) as pool:
+        parts = [chunk for chunks in pool.map(read_part, keys) for chunk in chunks]
+
+    with tracing.span('concat') as sp:
+        df = concat_chunks(align_columns(parts)) if parts else pd.DataFrame()
+        sp['rows'] = len(df)
+    print(f"Ingested {len(df)} rows, {len(df.columns)} columns from {len(keys)} objects")
+    return df
+
+def align_columns(parts):
+    """
+    オブジェクトごとにカラム構成が異なる場合、欠けているカラムを同じ型の欠損値で補う
+    """
+    import pandas as pd
+    dtypes = {}
+    for p in parts:
+        for c in p.columns:
+            dtypes.setdefault(c, p[c].dtype)
+    for p in parts:
+        for c, dtype in dtypes.items():
+            if c not in p.columns:
+                p[c] = pd.Series(index=p.index, dtype=dtype)
+    return [p[list(dtypes)] for p in parts]
+
+def aggregate_out_of_core(bucket, keys, plan, raw_headers, encoding, on_progress=None):
+    """
+    入力をチャンク単位で読み込みながら部分集計し、DataFrame 全体を作らずにグラフの集計結果を作る
+    複数オブジェクトは順に読み込む (エンコーディング・ヘッダーはオブジェクトごとに判定)
+    戻り値: (グラフの集計結果, summarize_partials 用の部分集計)
+    """
+    from ingest import read_head
+    from outofcore import OutOfCoreAggregator
+    aggregator = OutOfCoreAggregator(plan)
+    try:
+        for i, key in enumerate(keys):
+            if i > 0:
+                head_df, encoding = read_head(s3, bucket, key)
+                raw_headers = list(head_df.columns)
+            with tracing.span('outofcore.partials', merge=True) as sp:
+                for chunk in iter_chunks(bucket, key, plan, raw_headers, encoding):
+                    aggregator.add(chunk)
+                sp['rows'] = aggregator.rows
+        print(f"Aggregated {aggregator.rows} rows out of core from {len(keys)} objects "
+              f"({aggregator.spilled()} rankings spilled to disk)")
+        if on_progress:
+            on_progress(aggregator.rows)
+        with tracing.span('outofcore.finalize') as sp:
+            charts_res = aggregator.finalize_charts()
+            sp.update(charts=len(charts_res), spilled=aggregator.spilled())
+        return charts_res, aggregator.summary_partials()
+    finally:
+        aggregator.close()
+
+def build_prefetch_plan(column_mapping):
+    """
+    column_mapping のみから先行読み込み用のプランを作る
+    (chart_specs が未確定のため、dimension カラムはすべて分類軸として category で読み込む)
+    """
+    specs = [{'dimension': c} for c, m in column_mapping.items() if m.get('role') == 'dimension']
+    return {'column_mapping': column_mapping, 'chart_specs': specs}
+
+def take_prefetched(prefetch, plan, raw_headers):
+    """
+    先行読み込みの結果を待ち、確定したプランの読み込みに使える場合はその DataFrame を返す
+    column_mapping が一致し、必要なカラムがすべて同じ型指定で読み込まれている場合のみ使う (それ以外は None)
+    """
+    future = prefetch.pop('future', None)
+    if future is None:
+        return None
+    with tracing.span('prefetch_wait'):
+        try:
+            df = future.result()
+        except Exception as e:
+            print(f"Prefetch failed, loading again: {str(e)}")
+            return None
+    usecols, dtype = build_load_spec(plan, raw_headers)
+    pre_usecols, pre_dtype = build_load_spec(prefetch['plan'], raw_headers)
+    usable = (
+        plan.get('column_mapping') == prefetch['plan']['column_mapping']
+        and set(usecols) <= set(pre_usecols)
+        and all((h in dtype) == (h in pre_dtype) for h in usecols)
+    )
+    if not usable:
+        print("Prefetched dataset does not match the final plan, loading again")
+        return None
+    print(f"Using prefetched dataset ({len(df)} rows)")
+    return df
+
+def discard_prefetch(prefetch):
+    """
+    先行読み込みを中止して終了を待つ (計画に失敗した場合。読み込み途中の結果は捨てる)
+    実行中のスレッドは取り消せないため、次のチャンクの区切りで止まるまで待ち、後続の呼び出しと重ならないようにする
+    """
+    future = prefetch.pop('future', None)
+    if future is None:
+        return
+    prefetch['cancel'].set()
+    if future.cancel():
+        return
+    with tracing.span('prefetch_wait'):
+        try:
+            future.result()
+        except Exception:
+            pass
+
+def chart_meta_update(chart_meta, specs, metas):
+    """
+    近似集計したグラフの誤差範囲などを chart_meta にグラフ ID で格納
+    """
+    if chart_meta is None:
+        return
+    for spec, meta in zip(specs, metas):
+        if meta:
+            chart_meta[spec.get('id')] = meta
+
+def build_charts(df, plan, on_progress=None, approx=False, chart_meta=None):
+    """
+    AIプランの chart_specs に基づく動的集計
+    on_progress(集計済みグラフ数, 全グラフ数) で進捗を通知する
+    approx=True の場合、厳密集計が APPROX_LATENCY_BUDGET に収まらなければサンプリングによる近似集計を行い、
+    グラフごとの誤差範囲を chart_meta (dict) に格納する
+    """
+    import approximate
+    from aggregation import aggregate_chart_specs
+    from scatter import reduce_scatter
+    from timeseries import aggregate_time_series
+    col_map = plan.get('column_mapping', {})
+    # ランキング/構成比グラフは dimension ごとに一度の groupby でまとめて計算しておく
+    specs = plan.get('chart_specs', [])
+    ranking_idx = [
+        i for i, spec in enumerate(specs)
+        if spec.get('type') != 'scatter' and col_map.get(spec.get('dimension'), {}).get('role') != 'date'
+    ]
+    # 時系列グラフは日付カラムごとに一度の resample でまとめて計算しておく
+    ts_idx = [
+        i for i, spec in enumerate(specs)
+        if spec.get('type') != 'scatter' and col_map.get(spec.get('dimension'), {}).get('role') == 'date'
+    ]
+    ranking_specs = [specs[i] for i in ranking_idx]
+    ts_specs = [specs[i] for i in ts_idx]
+
+    fraction = 1.0
+    if approx:
+        # 先頭行での厳密集計の時間から抽出率を決める (予算内なら 1.0 = 厳密集計)
+        fraction = approximate.sample_fraction(
+            df, lambda pilot: (aggregate_chart_specs(pilot, ranking_specs), aggregate_time_series(pilot, ts_specs))
         )
+    draws = approximate.uniform_draws(len(df)) if fraction < 1.0 else None
 
-        # 4. Step 2: Dynamic Execution (Pandas)
-        # データクレンジング
-        df = df_raw.copy()
-        col_map = plan.get('column_mapping', {})
-        
-        metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
-        dates = [c for c, m in col_map.items() if m.get('role') == 'date']
-        
-        for m in metrics:
-            df[m] = df[m].apply(clean_num)
-        
-        for d in dates:
-            # YYYYMMDDhhmmss 形式や標準的な形式を柔軟にパース
-            df[d] = pd.to_datetime(df[d], format='%Y%m%d%H%M%S', errors='coerce').fillna(
-                pd.to_datetime(df[d], errors='coerce')
-            )
-            # 日付がパースできない行は除外せず、集計時に考慮
-        
-        # 動的集計
-        charts_res = {}
-        for spec in plan.get('chart_specs', []):
-            chart_id = spec.get('id')
-            if spec.get('type') == 'scatter':
-                # 散布図はサンプリングして生データを返す
-                m1 = spec.get('dimension') # X
-                m2 = spec.get('metric')    # Y
-                if m1 in df.columns and m2 in df.columns:
-                    charts_res[chart_id] = df.sample(min(100, len(df)))[[m1, m2]].to_dict(orient='records')
-            elif col_map.get(spec.get('dimension'), {}).get('role') == 'date':
-                # 時系列集計
-                d_col = spec.get('dimension')
-                m_col = spec.get('metric')
-                agg_type = spec.get('aggregation', 'sum')
-                
-                if d_col in df.columns and m_col in df.columns:
-                    # 期間に応じて粒度を自動調整 (時間, 日, 月)
-                    delta = df[d_col].max() - df[d_col].min()
-                    if delta.days < 2:
-                        resampled = df.set_index(d_col)[m_col].resample('H')
-                    elif delta.days < 60:
-                        resampled = df.set_index(d_col)[m_col].resample('D')
-                    else:
-                        resampled = df.set_index(d_col)[m_col].resample('M')
-                    
-                    if agg_type == 'mean':
-                        charts_res[chart_id] = resampled.mean().dropna().to_dict()
-                    elif agg_type == 'max':
-                        charts_res[chart_id] = resampled.max().dropna().to_dict()
-                    else:
-                        charts_res[chart_id] = resampled.sum().dropna().to_dict()
-                    
-                    # キーを文字列に変換
-                    charts_res[chart_id] = {str(k): v for k, v in charts_res[chart_id].items()}
-            else:
-                charts_res[chart_id] = aggregate_dynamic(df, spec)
-
-        # 5. Step 3: Strategic Insight (AI)
-        metrics_summary = {}
-        for m in metrics[:5]:
-            # 指標名に「率」や「タイム」「温度」「圧力」が含まれる場合は平均、それ以外は合計
-            if any(x in m for x in ['率', 'タイム', 'Time', '温度', 'Temp', '圧力', 'Press', '単価', '精度']):
-                metrics_summary[m] = float(df[m].mean())
-            else:
-                metrics_summary[m] = float(df[m].sum())
+    with tracing.span('charts.ranking') as sp:
+        if draws is None:
+            ranking_charts = aggregate_chart_specs(df, ranking_specs)
+        else:
+            ranking_charts, metas = approximate.aggregate_chart_specs(df, ranking_specs, fraction, draws)
+            chart_meta_update(chart_meta, ranking_specs, metas)
+            sp['sampleRows'] = max((m['sampleRows'] for m in metas if m), default=0)
+        ranking_res = dict(zip(ranking_idx, ranking_charts))
+        sp.update(rows=len(df), charts=len(ranking_idx))
+    if on_progress:
+        on_progress(len(ranking_idx), len(specs))
+    with tracing.span('charts.timeseries') as sp:
+        if draws is None:
+            ts_charts = aggregate_time_series(df, ts_specs)
+        else:
+            ts_charts, metas = approximate.aggregate_time_series(df, ts_specs, fraction, draws)
+            chart_meta_update(chart_meta, ts_specs, metas)
+            sp['sampleRows'] = max((m['sampleRows'] for m in metas if m), default=0)
+        ts_res = dict(zip(ts_idx, ts_charts))
+        sp.update(rows=len(df), charts=len(ts_idx))
+    if on_progress:
+        on_progress(len(ranking_idx) + len(ts_idx), len(specs))
 
-        summary = {
-            "total_rows": len(df),
-            "metrics_summary": metrics_summary
-        }
+    charts_res = {}
+    for i, spec in enumerate(specs):
+        chart_id = spec.get('id')
+        if spec.get('type') == 'scatter':
+            # 散布図は 2 次元ビンの重心 (件数つき) と外れ値を代表点として返す
+            m1 = spec.get('dimension') # X
+            m2 = spec.get('metric')    # Y
+            if m1 in df.columns and m2 in df.columns:
+                with tracing.span(f"chart.{chart_id}"):
+                    charts_res[chart_id] = reduce_scatter(df, m1, m2)
+        elif col_map.get(spec.get('dimension'), {}).get('role') == 'date':
+            # 時系列集計
+            if ts_res[i] is not None:
+                charts_res[chart_id] = ts_res[i]
+        else:
+            charts_res[chart_id] = ranking_res[i]
+    if on_progress:
+        on_progress(len(specs), len(specs))
+    return charts_res
+
+def summarize_metrics(df, plan):
+    """
+    洞察生成に渡すデータ概要 (件数と主要指標)
+    """
+    col_map = plan.get('column_mapping', {})
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
+    metrics_summary = {}
+    for m in metrics[:5]:
+        # 指標名に「率」や「タイム」「温度」「圧力」が含まれる場合は平均、それ以外は合計
+        if any(x in m for x in MEAN_METRIC_KEYWORDS):
+            metrics_summary[m] = float(df[m].mean())
+        else:
+            metrics_summary[m] = float(df[m].sum())
 
-        insight_prompt = f"""
+    return {
+        "total_rows": len(df),
+        "metrics_summary": metrics_summary
+    }
+
+def summarize_partials(partials, plan):
+    """
+    増分分析の部分集計から summarize_metrics と同じデータ概要を作る
+    """
+    col_map = plan.get('column_mapping', {})
+    metrics = [c for c, m in col_map.items() if m.get('role') == 'metric']
+    metrics_summary = {}
+    for m in metrics[:5]:
+        n, total = partials['summary']['metrics'].get(m, (0, 0.0))
+        if any(x in m for x in MEAN_METRIC_KEYWORDS):
+            metrics_summary[m] = float(total / n) if n else float('nan')
+        else:
+            metrics_summary[m] = float(total)
+
+    return {
+        "total_rows": partials['summary']['rows'],
+        "metrics_summary": metrics_summary
+    }
+
+def build_insight_prompt(summary, charts_res):
+    """
+    Step 3 (戦略レポート) のプロンプト
+    """
+    return f"""
         あなたは製造現場の改善を専門とする生産技術コンサルタントです。
         以下の集計結果を分析し、現場の生産性向上と品質改善に向けた戦略レポートを作成してください。
 
         ## データ概要
         {json.dumps(summary, ensure_ascii=False)}
 
-        ## 集計結果 (一部)
-        {json.dumps({k: v for k, v in list(charts_res.items())[:10]}, ensure_ascii=False)}
+        ## 集計結果 (点数の多いグラフは代表点と統計量に要約)
+        {json.dumps(prompt_digest.fit_charts(charts_res, prompt_digest.INSIGHT_TOKEN_BUDGET), ensure_ascii=False, default=str)}
 
         ## レポート要件 (Markdown)
         1. 現状の課題と傾向分析 (70%): ボトルネック、バラツキ、異常値の指摘。
@@ -319,66 +557,485 @@ def handler(event, context):
         - **太字**や<u>下線</u>（HTMLタグ <u></u> を使用可）、リスト（- や 1.）を多用し、視覚的に重要なポイントがすぐわかるようにしてください。
         - 数値や重要なキーワードは強調してください。
         - 見出しに「70%」等の数値を含めないこと。
-        - 各グラフ(g1-g20)への短い気づき(micro_insights)も作成してください。
 
         ## 出力形式 (JSON)
         {{
-          "global_report": "Markdown形式のレポート",
-          "micro_insights": {{ "g1": "...", "g2": "...", ... }}
+          "global_report": "Markdown形式のレポート"
         }}
         """
-        
-        ai_data = call_bedrock(insight_prompt)
-        if not isinstance(ai_data, dict):
-            ai_data = {"global_report": str(ai_data), "micro_insights": {}}
-
-        # 6. 結果保存
-        final_result = {
-            'jobId': job_id,
-            'summary': summary,
-            'charts': charts_res,
-            'ai_report': ai_data.get('global_report', ''),
-            'micro_insights': ai_data.get('micro_insights', {}),
-            'analysisPlan': plan,
-            'processedAt': datetime.utcnow().isoformat()
+
+def build_micro_insight_prompt(summary, specs, charts_res):
+    """
+    Step 3 (グラフごとの短い気づき) のプロンプト
+    specs: 対象グラフの chart_specs (チャンク単位)
+    """
+    digest = prompt_digest.fit_charts(
+        charts_res, prompt_digest.MICRO_INSIGHT_TOKEN_BUDGET, [spec.get('id') for spec in specs]
+    )
+    charts = [
+        {
+            'id': spec.get('id'),
+            'title': spec.get('title'),
+            'type': spec.get('type'),
+            'dimension': spec.get('dimension'),
+            'metric': spec.get('metric'),
+            'aggregation': spec.get('aggregation'),
+            'data': digest.get(spec.get('id'))
         }
-        
+        for spec in specs
+    ]
+    return f"""
+        あなたは製造現場の改善を専門とする生産技術コンサルタントです。
+        以下の各グラフの集計結果について、現場の生産技術者向けの短い気づき (1〜2文) を作成してください。
+
+        ## データ概要
+        {json.dumps(summary, ensure_ascii=False)}
+
+        ## グラフ定義と集計結果
+        {json.dumps(charts, ensure_ascii=False, default=str)}
+
+        ※重要事項：
+        - ボトルネック、バラツキ、異常値など、改善につながる点を具体的な数値とともに指摘してください。
+        - 対象のグラフID以外のキーは出力しないでください。
+
+        ## 出力形式 (JSON)
+        {{
+          "micro_insights": {json.dumps({spec.get('id'): '...' for spec in specs}, ensure_ascii=False)}
+        }}
+        """
+
+def handler(event, context):
+    """
+    汎用AI分析エンジン (Universal Semantic Analysis & Dynamic Execution)
+    """
+    table = dynamodb.Table(JOB_TABLE)
+    job_id = None
+    callback_url = None
+    tracker = None
+    trace = None
+    # スケジューラの実行枠をこの呼び出しで確保したか (終了時に解放する)
+    leased = False
+
+    if len(event.get('Records', [])) > 1:
+        # 複数レコードの S3 イベントはアップロードごとに 1 ジョブとして順に処理する
+        for record in event['Records']:
+            handler({'Records': [record]}, context)
+        return
+
+    try:
+        if 'Records' in event:
+            bucket = event['Records'][0]['s3']['bucket']['name']
+            key = unquote_plus(event['Records'][0]['s3']['object']['key'])
+            job_id = key.split('/')[-1].replace('.csv', '')
+        else:
+            job_id = event.get('jobId')
+            bucket, key = csv_location(job_id, event.get('dataSource'))
+
+        # ステージごとの実時間・CPU時間・行数・メモリ・トークン数の計測
+        trace = Trace(job_id)
+
+        # ジョブ情報の取得 (callbackUrl確認用)
+        job_item = table.get_item(Key={'jobId': job_id}).get('Item', {})
+        callback_url = job_item.get('callbackUrl')
+
+        # アップロード (S3 イベント) のジョブはディスパッチャーを経由しないため、ここで実行枠を確保する
+        # 空きがない場合はキューに登録して終了し、枠が空き次第 scheduled のイベントで起動される
+        if queue_store is not None and 'Records' in event:
+            entry = scheduler.new_entry(
+                job_id, {'jobId': job_id}, job_item.get('priority', 'interactive'), job_item.get('tenant', 'anonymous'),
+                event['Records'][0]['s3']['object'].get('size', 0)
+            )
+            JobProgress(table, job_id).update(
+                "#s = :s, costBytes = :c, profile = :p",
+                names={'#s': 'status'},
+                values={':s': 'QUEUED', ':c': entry['costBytes'], ':p': entry['profile']}
+            )
+            leased = scheduler.submit(queue_store, [entry], inline_job_id=job_id)['inline']
+            if not leased:
+                return
+
+        # ジョブの更新と進捗イベント (ingested / planned / aggregated / insights) の記録
+        tracker = JobProgress(table, job_id)
+        tracker.update("#s = :s", names={'#s': 'status'}, values={':s': 'PROCESSING'})
+
+        # 再分析: 指定したジョブのクレンジング済みデータセット (Parquet) を CSV の代わりに読み込む
+        # プランが保存済みのカラムで実行できない場合は元の CSV から読み込む
+        source_job_id = event.get('sourceJobId') or job_item.get('sourceJobId')
+        source_item = None
+        if source_job_id:
+            source_item = table.get_item(Key={'jobId': source_job_id}).get('Item')
+            if not source_item or not source_item.get('datasetKey'):
+                raise Exception(f"Source job {source_job_id} has no stored dataset")
+            bucket, key = csv_location(source_job_id, source_item.get('dataSource'))
+
+        # プレフィックス / glob 指定の場合は一致するオブジェクトをまとめて 1 つのデータセットとして扱う
+        objects = sources.resolve_objects(s3, bucket, key)
+        keys = [obj['Key'] for obj in objects]
+        key = keys[0]
+
+        # 増分分析: 同じ dataset_id の前回の入力に行が追記されただけなら、追記分のみを集計してマージする
+        dataset_id = None if source_item else (event.get('datasetId') or job_item.get('datasetId'))
+        if dataset_id and len(keys) > 1:
+            print(f"Incremental mode is not supported for multi-object sources, ignoring datasetId {dataset_id}")
+            dataset_id = None
+
+        # 0. DB構造情報の読み込み (もし存在すれば)
+        db_info = load_db_info()
+
+        # 0.5 結果キャッシュの確認
+        # 入力データ・モデル・プロンプト版・DB構造情報が同一なら過去の結果を再利用する
         result_key = f"results/{job_id}.json"
-        s3.put_object(
-            Bucket=DATA_BUCKET,
-            Key=result_key,
-            Body=json.dumps(final_result, ensure_ascii=False),
-            ContentType='application/json'
-        )
+        cache_key = None
+        # 増分分析は部分集計の状態を更新する必要があるため結果キャッシュを使わない
+        if result_cache.is_enabled() and not dataset_id:
+            with trace.span('result_cache'):
+                if source_item:
+                    cache_key = result_cache.cache_key_for(
+                        s3, DATA_BUCKET, source_item['datasetKey'], MODEL_ID, PROMPT_TEMPLATE_VERSION, db_info
+                    )
+                else:
+                    cache_key = result_cache.cache_key_for(s3, bucket, keys, MODEL_ID, PROMPT_TEMPLATE_VERSION, db_info)
+                bypass_cache = bool(event.get('bypassCache') or job_item.get('bypassCache'))
+                cache_hit = not bypass_cache and result_cache.lookup(s3, DATA_BUCKET, cache_key)
+                if cache_hit:
+                    print(f"Result cache hit: {cache_key}")
+                    # 結果本文の jobId / processedAt / trace はこのジョブのものに書き換える
+                    result_cache.restore(s3, DATA_BUCKET, cache_key, result_key, {
+                        'jobId': job_id,
+                        'processedAt': datetime.utcnow().isoformat(),
+                        'trace': trace.to_dict()
+                    })
+            if cache_hit:
+                complete_job(tracker, result_key, callback_url, cache_hit=True, trace=trace.to_dict())
+                trace.flush()
+                return
 
-        table.update_item(
-            Key={'jobId': job_id},
-            UpdateExpression="SET #s = :s, resultKey = :rk",
-            ExpressionAttributeNames={'#s': 'status'},
-            ExpressionAttributeValues={':s': 'COMPLETED', ':rk': result_key}
-        )
+        # ここから CSV / Parquet を扱うため pandas に依存するモジュールを読み込む
+        import pandas as pd
+        import approximate
+        import columnar
+        import incremental
+        import outofcore
+        from ingest import read_head
+
+        # 1. 先頭ブロックのみ取得 & エンコーディング判定
+        # 全量の読み込みは分析プラン確定後、必要なカラムに絞って行う
+        dataset_path = None
+        with trace.span('read_head'):
+            if source_item:
+                dataset_path = columnar.fetch(s3, DATA_BUCKET, source_item['datasetKey'])
+                head_df, encoding = columnar.read_head(dataset_path), None
+            else:
+                head_df, encoding = read_head(s3, bucket, key)
+        raw_headers = list(head_df.columns)
+        head_df.columns = [c.strip() for c in raw_headers]
+
+        # 入力がメモリに載らない大きさなら、DataFrame を作らずにチャンクごとの部分集計で集計する
+        # (再分析・増分分析はそれぞれ保存済みデータセット・追記分のみを読むため対象外)
+        out_of_core = False
+        if not source_item and not dataset_id and outofcore.OUT_OF_CORE_MODE != 'never':
+            input_bytes = sources.total_bytes(s3, bucket, objects)
+            out_of_core = outofcore.use_out_of_core(input_bytes)
+            if out_of_core:
+                print(f"Out-of-core aggregation: {input_bytes} bytes in {len(keys)} objects")
+
+        refresh_plan = bool(event.get('refreshPlan') or job_item.get('refreshPlan'))
+        inc_state = None
+        if dataset_id:
+            with trace.span('incremental_check') as sp:
+                inc_snapshot = incremental.snapshot(s3, bucket, key)
+                inc_state = incremental.load_state(s3, DATA_BUCKET, dataset_id)
+                # プランを作り直す場合は部分集計も作り直す
+                if inc_state and (refresh_plan or not incremental.extends(s3, bucket, key, inc_state, inc_snapshot)):
+                    inc_state = None
+                sp['delta'] = inc_state is not None
+            if inc_state:
+                print(f"Incremental update: {dataset_id} bytes {inc_state['snapshot']['bytes']}-{inc_snapshot['bytes']}")
+
+        # 2. サンプル抽出
+        sample_data = head_df.to_json(orient='records', force_ascii=False)
+        headers = list(head_df.columns)
+
+        # 3. Step 1: Universal Semantic Analysis & Planning (AI)
+        # 同じスキーマ (カラム名・型・DB構造情報) のプランがキャッシュにあれば計画の呼び出しを省略する
+        plan_store = plan_cache.create_backend(s3, DATA_BUCKET)
+        fingerprint = plan_cache.schema_fingerprint(head_df, db_info, MODEL_ID, PROMPT_TEMPLATE_VERSION)
+        approx_requested = bool(event.get('approximate') or job_item.get('approximate'))
+        # 計画の受信中に先行して読み込んだデータセット
+        prefetch = {}
+        with trace.span('plan') as sp:
+            if inc_state:
+                # 追記分の集計は前回と同じプランで行う
+                plan = inc_state['plan']
+            elif source_item and source_item.get('analysisPlan') and not refresh_plan:
+                # 再分析では元ジョブのプランを再利用する
+                plan = plain_json(source_item['analysisPlan'])
+            else:
+                plan = None if refresh_plan else plan_cache.lookup(plan_store, fingerprint)
+            plan_cache_hit = plan is not None
+            sp['cacheHit'] = plan_cache_hit
 
-        # Webhook通知
-        if callback_url:
-            send_webhook(callback_url, {
+            if plan is None:
+                on_key = None
+                if LOAD_PREFETCH and not source_item and not dataset_id and not out_of_core:
+                    # ストリーミング受信中に column_mapping が確定したら、chart_specs の受信を待たずに読み込みを始める
+                    def on_key(name, value):
+                        if name == 'column_mapping' and isinstance(value, dict) and not prefetch:
+                            prefetch_plan = build_prefetch_plan(value)
+                            cancel = threading.Event()
+                            if len(keys) > 1:
+                                fn = lambda: load_sources(bucket, keys, prefetch_plan, cancel=cancel)
+                            else:
+                                fn = lambda: load_dataset(bucket, key, prefetch_plan, raw_headers, encoding, cancel=cancel)
+                            pool = ThreadPoolExecutor(max_workers=1)
+                            prefetch['plan'] = prefetch_plan
+                            prefetch['cancel'] = cancel
+                            prefetch['future'] = pool.submit(tracing.propagate('load_prefetch', fn))
+                            pool.shutdown(wait=False)
+                try:
+                    plan = call_bedrock(build_planning_prompt(db_info, headers, sample_data), on_key=on_key)
+                    if not isinstance(plan, dict):
+                        raise Exception("AI Planning failed to return valid JSON")
+                except Exception:
+                    # 先行読み込みがジョブの失敗後も (次の呼び出しと重なって) メモリ・S3 読み込みを使い続けないよう止める
+                    discard_prefetch(prefetch)
+                    raise
+                plan_cache.store(plan_store, fingerprint, plan)
+        tracker.event('planned', charts=len(plan.get('chart_specs', [])), planCacheHit=plan_cache_hit)
+        reuse_dataset = dataset_path is not None and columnar.covers(dataset_path, plan)
+        if dataset_path and not reuse_dataset:
+            print(f"Stored dataset does not cover the plan, reading CSV: s3://{bucket}/{key}")
+
+        # 4-6. Dynamic Execution / Strategic Insight / 結果保存
+        # 依存関係つきのステージとして実行し、独立した I/O (プラン保存と集計、
+        # チャンク分割した micro_insights の Bedrock 呼び出しなど) を並行させる
+        # DynamoDB の更新は JobProgress のロックで直列化している (Table リソースはスレッドセーフでないため)
+        specs = plan.get('chart_specs', [])
+        micro_chunks = [
+            specs[i:i + MICRO_INSIGHT_CHUNK_SIZE] for i in range(0, len(specs), MICRO_INSIGHT_CHUNK_SIZE)
+        ]
+        micro_stages = [f"micro_insights_{i}" for i in range(len(micro_chunks))]
+        insight_calls = 1 + len(micro_chunks)
+        # 近似集計したグラフの誤差範囲 (空なら全グラフ厳密集計)
+        chart_meta = {}
+        # 日付フォーマットの推定結果 (増分分析では次回の追記分の読み込みに引き継ぐ)
+        date_formats = dict(inc_state['dateFormats']) if inc_state else {}
+
+        def save_plan(deps):
+            # プランをDynamoDBに保存
+            tracker.update(
+                "analysisPlan = :p, planFingerprint = :f, planCacheHit = :h",
+                values={':p': plan, ':f': fingerprint, ':h': plan_cache_hit}
+            )
+
+        def load(deps):
+            prefetched = take_prefetched(prefetch, plan, raw_headers)
+            if prefetched is not None:
+                df = prefetched
+            elif reuse_dataset:
+                with tracing.span('columnar_load') as sp:
+                    df = columnar.load(dataset_path, plan)
+                    sp['rows'] = len(df)
+            elif len(keys) > 1:
+                df = load_sources(bucket, keys, plan)
+            elif source_item:
+                csv_head, csv_encoding = read_head(s3, bucket, key)
+                df = load_dataset(bucket, key, plan, list(csv_head.columns), csv_encoding)
+            elif inc_state:
+                # 前回処理した位置以降 (追記分) のみを、前回のヘッダー行を補って読み込む
+                start, end = inc_state['snapshot']['bytes'], inc_snapshot['bytes']
+                if end > start:
+                    df = load_dataset(
+                        bucket, key, plan, inc_state['rawHeaders'], inc_state['encoding'],
+                        byte_range=(start, end), header=inc_snapshot['header'].encode('latin-1'),
+                        date_formats=date_formats
+                    )
+                else:
+                    df = pd.DataFrame()
+            elif dataset_id:
+                # 書き出し途中の最終行は読み込まず、次回の追記分として扱う
+                df = load_dataset(
+                    bucket, key, plan, raw_headers, encoding,
+                    byte_range=(0, inc_snapshot['bytes']), date_formats=date_formats
+                )
+            else:
+                df = load_dataset(bucket, key, plan, raw_headers, encoding)
+            tracker.event('ingested', rows=len(df))
+            return df
+
+        def store_dataset(deps):
+            # クレンジング済みデータセットを保存し、再分析で使えるようにする
+            if reuse_dataset:
+                dataset_key = source_item['datasetKey']
+            elif inc_state:
+                # 追記分のみのため保存しない
+                return
+            elif columnar.COLUMNAR_ENABLED:
+                dataset_key = columnar.dataset_key_for(job_id)
+                if not columnar.store(s3, DATA_BUCKET, dataset_key, deps['load']):
+                    return
+            else:
+                return
+            tracker.update("datasetKey = :d", values={':d': dataset_key})
+
+        def aggregate_stream(deps):
+            # out-of-core: 集計結果と、データ概要用の部分集計 (行数と metric ごとの n / sum)
+            return aggregate_out_of_core(
+                bucket, keys, plan, raw_headers, encoding,
+                on_progress=lambda rows: tracker.event('ingested', rows=rows)
+            )
+
+        def partials(deps):
+            # 増分分析の部分集計 (前回の状態があればマージ)
+            part = incremental.compute_partials(deps['load'], plan, plan.get('column_mapping', {}))
+            if inc_state:
+                part = incremental.merge_partials(incremental.partials_from_json(inc_state['partials']), part, plan)
+            return part
+
+        def save_state(deps):
+            incremental.save_state(s3, DATA_BUCKET, dataset_id, {
                 'jobId': job_id,
-                'status': 'COMPLETED',
-                'resultKey': result_key
+                'plan': plan,
+                'snapshot': inc_snapshot,
+                'encoding': inc_state['encoding'] if inc_state else encoding,
+                'rawHeaders': inc_state['rawHeaders'] if inc_state else raw_headers,
+                'dateFormats': date_formats,
+                'partials': incremental.partials_to_json(deps['partials']),
             })
 
+        def charts(deps):
+            if out_of_core:
+                charts_res = deps['stream'][0]
+                tracker.event('aggregated', len(charts_res), len(specs))
+                return charts_res
+            if dataset_id:
+                return incremental.finalize_charts(deps['partials'], plan, plan.get('column_mapping', {}))
+            df = deps['load']
+            return build_charts(
+                df, plan,
+                on_progress=lambda done, total: tracker.event('aggregated', done, total),
+                approx=approximate.use_approximation(len(df), approx_requested),
+                chart_meta=chart_meta
+            )
+
+        def summarize(deps):
+            if out_of_core:
+                return summarize_partials(deps['stream'][1], plan)
+            if dataset_id:
+                return summarize_partials(deps['partials'], plan)
+            return summarize_metrics(deps['load'], plan)
+
+        def traced(name, fn):
+            # ステージ全体をスパンとして計測 (行数は DataFrame を扱うステージのみ)
+            def run(deps):
+                with trace.span(name) as sp:
+                    result = fn(deps)
+                    df = deps.get('load') if name != 'load' else result
+                    if isinstance(df, pd.DataFrame):
+                        sp['rows'] = len(df)
+                    return result
+            return run
+
+        def report(deps):
+            ai_data = call_bedrock(build_insight_prompt(deps['summary'], deps['charts']))
+            tracker.advance('insights', insight_calls)
+            if not isinstance(ai_data, dict):
+                return str(ai_data)
+            return ai_data.get('global_report', '')
+
+        def micro_insights(chunk):
+            def run(deps):
+                ai_data = call_bedrock(build_micro_insight_prompt(deps['summary'], chunk, deps['charts']))
+                tracker.advance('insights', insight_calls)
+                if not isinstance(ai_data, dict):
+                    return {}
+                return ai_data.get('micro_insights', {})
+            return run
+
+        def save_result(deps):
+            micro = {}
+            for name in micro_stages:
+                micro.update(deps[name])
+
+            final_result = {
+                'jobId': job_id,
+                'summary': deps['summary'],
+                'charts': deps['charts'],
+                'ai_report': deps['report'],
+                'micro_insights': micro,
+                'analysisPlan': plan,
+                'processedAt': datetime.utcnow().isoformat(),
+                'trace': trace.to_dict()
+            }
+            if chart_meta:
+                final_result['chart_meta'] = chart_meta
+            if dataset_id:
+                final_result['incremental'] = {
+                    'datasetId': dataset_id,
+                    'mode': 'delta' if inc_state else 'full',
+                    'newRows': len(deps['load']),
+                    'totalRows': deps['summary']['total_rows'],
+                }
+            body, extra = result_format.encode_result(final_result)
+            s3.put_object(Bucket=DATA_BUCKET, Key=result_key, Body=body, **extra)
+
+        def store_cache(deps):
+            # 近似結果は厳密な結果を求めるジョブに再利用されないよう結果キャッシュに保存しない
+            if cache_key and not chart_meta:
+                result_cache.store(s3, DATA_BUCKET, cache_key, result_key)
+
+        def complete(deps):
+            complete_job(tracker, result_key, callback_url, trace=trace.to_dict())
+
+        stages = {
+            'save_plan': (save_plan, []),
+            'load': (load, []),
+            'store_dataset': (store_dataset, ['load']),
+            'charts': (charts, ['partials'] if dataset_id else ['load']),
+            'summary': (summarize, ['partials'] if dataset_id else ['load']),
+            'report': (report, ['summary', 'charts']),
+            'save_result': (save_result, ['summary', 'charts', 'report'] + micro_stages),
+            'store_cache': (store_cache, ['save_result']),
+            'complete': (complete, ['save_result', 'save_plan', 'store_dataset']),
+        }
+        for name, chunk in zip(micro_stages, micro_chunks):
+            stages[name] = (micro_insights(chunk), ['summary', 'charts'])
+        if dataset_id:
+            stages['partials'] = (partials, ['load'])
+            stages['save_state'] = (save_state, ['partials'])
+            stages['complete'] = (complete, ['save_result', 'save_plan', 'store_dataset', 'save_state'])
+            stages['save_result'] = (save_result, stages['save_result'][1] + ['load'])
+        if out_of_core:
+            # DataFrame を作らないため、読み込みとデータセットの保存 (再分析用) は行わない
+            del stages['load'], stages['store_dataset']
+            stages['stream'] = (aggregate_stream, [])
+            stages['charts'] = (charts, ['stream'])
+            stages['summary'] = (summarize, ['stream'])
+            stages['complete'] = (complete, ['save_result', 'save_plan'])
+        run_stages({name: (traced(name, fn), deps) for name, (fn, deps) in stages.items()})
+        trace.flush()
+
     except Exception as e:
         print(f"Error: {str(e)}")
         if job_id:
-            table.update_item(
-                Key={'jobId': job_id},
-                UpdateExpression="SET #s = :s, #e = :e",
-                ExpressionAttributeNames={'#s': 'status', '#e': 'error'},
-                ExpressionAttributeValues={':s': 'FAILED', ':e': str(e)}
+            (tracker or JobProgress(table, job_id)).update(
+                "#s = :s, #e = :e, #t = :t",
+                names={'#s': 'status', '#e': 'error', '#t': 'trace'},
+                values={':s': 'FAILED', ':e': str(e), ':t': trace.to_dict() if trace else None}
             )
+            if trace:
+                trace.flush()
             if callback_url:
                 send_webhook(callback_url, {
                     'jobId': job_id,
                     'status': 'FAILED',
                     'error': str(e)
                 })
+    finally:
+        # 実行枠を解放し、待機中のジョブを起動する
+        if queue_store is not None and job_id and (leased or event.get('scheduled')):
+            try:
+                scheduler.finish(queue_store, job_id)
+            except Exception as e:
+                print(f"Failed to release scheduler lease for {job_id}: {str(e)}")
 
@@ -0,0 +1,59 @@
+import threading
+from datetime import datetime
+
+
+class JobProgress:
+    """
+    ジョブ item の更新と進捗イベントの記録
+    更新のたびに version を加算し updatedAt を記録する (ステータス照会の ETag / ロングポーリングが変化を検知する)
+    並行ステージからの更新はロックで直列化する (Table リソースはスレッドセーフでないため)
+    table は get_item / update_item を持つ DynamoDB Table 互換オブジェクト
+    """
+    def __init__(self, table, job_id):
+        self.table = table
+        self.job_id = job_id
+        self.lock = threading.RLock()
+        self.counters = {}
+
+    def update(self, expression, names=None, values=None):
+        """
+        ジョブ item の更新 (expression は SET 句の代入部分)
+        """
+        now = datetime.utcnow().isoformat()
+        args = {
+            'Key': {'jobId': self.job_id},
+            'UpdateExpression': f"SET {expression}, updatedAt = :updated_at ADD version :one",
+            'ExpressionAttributeValues': dict(values or {}, **{':updated_at': now, ':one': 1})
+        }
+        if names:
+            args['ExpressionAttributeNames'] = names
+        with self.lock:
+            self.table.update_item(**args)
+
+    def event(self, stage, done=None, total=None, **detail):
+        """
+        進捗イベントの記録 (progress に最新イベント、events に履歴を追記)
+        記録の失敗はジョブの成否に影響させない
+        """
+        evt = {'stage': stage, 'at': datetime.utcnow().isoformat()}
+        if total is not None:
+            evt['done'] = done or 0
+            evt['total'] = total
+        evt.update(detail)
+        try:
+            self.update(
+                "progress = :evt, events = list_append(if_not_exists(events, :empty), :evts)",
+                values={':evt': evt, ':evts': [evt], ':empty': []}
+            )
+        except Exception as e:
+            print(f"Failed to record progress event {stage}: {str(e)}")
+        return evt
+
+    def advance(self, stage, total, **detail):
+        """
+        stage の完了件数を 1 進めてイベントを記録 (並行ステージから呼ばれる)
+        """
+        with self.lock:
+            done = self.counters.get(stage, 0) + 1
+            self.counters[stage] = done
+            return self.event(stage, done, total, **detail)
@@ -0,0 +1,115 @@
+"""
+洞察生成プロンプトに埋め込むグラフ集計結果の要約 (トークン数の上限つき)
+
+高カーディナリティの dimension や長期間の時系列をそのまま埋め込むと Bedrock の入力トークンが膨らむため、
+グラフごとに代表点を最大 k 点に絞った要約を作り、全体が予算 (推定トークン数) に収まるまで k を小さくする。
+最小の k でも収まらない場合は後ろのグラフから省略し、省略したグラフ ID を _omitted に記録する。
+
+    {label: value}  : k 点以下ならそのまま。超える場合は件数・最小・最大・平均と、
+                      先頭・末尾・最大・最小を含む等間隔の k 点 (元の並び順)
+    散布図の代表点  : 点数・件数合計・各軸の範囲と、外れ値 (先頭) と件数の多い点から k 点
+"""
+import json
+import math
+import os
+
+# 戦略レポートのプロンプトに埋め込む集計結果の推定トークン数の上限
+INSIGHT_TOKEN_BUDGET = int(os.environ.get('INSIGHT_TOKEN_BUDGET', '2000'))
+# micro_insights のプロンプト (1 チャンク分) に埋め込む集計結果の推定トークン数の上限
+MICRO_INSIGHT_TOKEN_BUDGET = int(os.environ.get('MICRO_INSIGHT_TOKEN_BUDGET', '1000'))
+# グラフごとの代表点数の候補 (予算に収まるまで順に小さくする)
+POINT_STEPS = (50, 20, 10, 5, 2)
+# 要約に含める数値の有効桁数
+DIGEST_DIGITS = 4
+
+
+def estimate_tokens(text):
+    """
+    トークン数の概算 (ASCII は 4 文字で 1 トークン、それ以外の文字は 1 文字 1 トークン)
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def short(v):
+    """
+    数値を DIGEST_DIGITS 桁に丸める
+    """
+    if isinstance(v, float):
+        return float(f"{v:.{DIGEST_DIGITS}g}") if math.isfinite(v) else None
+    return v
+
+
+def pick_indices(values, k):
+    """
+    先頭・末尾・最大・最小を含む等間隔の k 点の位置 (昇順)
+    """
+    n = len(values)
+    numeric = [(v, i) for i, v in enumerate(values) if isinstance(v, (int, float)) and v == v]
+    keep = {0, n - 1}
+    if numeric:
+        keep.update({max(numeric)[1], min(numeric)[1]})
+    step = n / max(k - len(keep), 1)
+    i = 0.0
+    while len(keep) < k and i < n:
+        keep.add(int(i))
+        i += step
+    return sorted(keep)
+
+
+def digest_chart(data, k):
+    """
+    1 グラフ分の集計結果の要約 (最大 k 点)
+    """
+    if isinstance(data, dict):
+        if len(data) <= k:
+            return {label: short(v) for label, v in data.items()}
+        labels, values = list(data), list(data.values())
+        numeric = [v for v in values if isinstance(v, (int, float)) and v == v]
+        digest = {
+            'n': len(values),
+            'min': short(min(numeric)) if numeric else None,
+            'max': short(max(numeric)) if numeric else None,
+            'mean': short(sum(numeric) / len(numeric)) if numeric else None,
+        }
+        digest['points'] = {labels[i]: short(values[i]) for i in pick_indices(values, k)}
+        return digest
+    if isinstance(data, list) and data and all(isinstance(p, dict) for p in data):
+        if len(data) <= k:
+            return [{f: short(v) for f, v in p.items()} for p in data]
+        fields = list(data[0])
+        count_key = next((f for f in ('count', '_count') if f in fields), None)
+        digest = {'points': len(data)}
+        if count_key:
+            digest['total_count'] = sum(p.get(count_key, 0) for p in data)
+        for f in fields:
+            if f != count_key:
+                vals = [p[f] for p in data if isinstance(p.get(f), (int, float))]
+                digest[f'{f}_range'] = [short(min(vals)), short(max(vals))] if vals else None
+        # 外れ値 (先頭に並ぶ件数 1 の点) と件数の多い点を半数ずつ
+        head = data[:k // 2]
+        rest = sorted(data[k // 2:], key=lambda p: -p.get(count_key, 0) if count_key else 0)[:k - len(head)]
+        digest['sample'] = [{f: short(v) for f, v in p.items()} for p in head + rest]
+        return digest
+    return data
+
+
+def fit_charts(charts_res, budget, chart_ids=None):
+    """
+    グラフの集計結果を推定トークン数 budget 以内の要約にする
+    chart_ids: 対象のグラフ ID (未指定時は全グラフ、並び順が優先度)
+    """
+    chart_ids = list(charts_res) if chart_ids is None else [c for c in chart_ids if c in charts_res]
+    for k in POINT_STEPS:
+        digest = {c: digest_chart(charts_res[c], k) for c in chart_ids}
+        if estimate_tokens(json.dumps(digest, ensure_ascii=False, default=str)) <= budget:
+            return digest
+
+    # 最小の点数でも収まらない場合は後ろのグラフから省略する
+    omitted = []
+    while digest and estimate_tokens(json.dumps(dict(digest, _omitted=omitted), ensure_ascii=False, default=str)) > budget:
+        omitted.insert(0, chart_ids.pop())
+        del digest[omitted[0]]
+    if omitted:
+        digest['_omitted'] = omitted
+    return digest
@@ -0,0 +1,115 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import result_format
+
+# キャッシュの有効期間 (時間)。0 でキャッシュ無効
+RESULT_CACHE_TTL_HOURS = float(os.environ.get('RESULT_CACHE_TTL_HOURS', '24'))
+# 複数オブジェクトの入力のメタデータを取得する際の並行数
+HEAD_CONCURRENCY = int(os.environ.get('SOURCE_FETCH_CONCURRENCY', '8'))
+
+
+def is_enabled():
+    """
+    結果キャッシュが有効か
+    """
+    return RESULT_CACHE_TTL_HOURS > 0
+
+
+def object_fingerprint(s3_client, bucket, key):
+    """
+    オブジェクトの内容を識別する値 (ETag とサイズ、本文は読み込まない)
+    単一パートでアップロードしたオブジェクトの ETag は内容の MD5 のため、同じ内容を別のキーに
+    アップロードした場合も同じ値になる
+    """
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    if not head.get('ETag'):
+        # ETag を返さないストアではキーと更新時刻で識別する
+        return f"{key}:{head.get('LastModified')}:{head.get('ContentLength')}"
+    return f"{head['ETag']}:{head.get('ContentLength')}"
+
+
+def cache_key_for(s3_client, bucket, key, model_id, prompt_version, db_info):
+    """
+    入力オブジェクトの ETag・サイズ、モデルID・プロンプトテンプレート版・DB.txt の内容から結果キャッシュのキーを計算
+    入力の本文は読み込まないため、out-of-core で扱う大きな入力でも head_object のみで求まる
+    key にキーのリストを渡した場合 (複数オブジェクトの入力) は、オブジェクトごとの値を並行して求めてキー名とともに結合する
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    digest = hashlib.sha256()
+    if len(keys) == 1:
+        digest.update(object_fingerprint(s3_client, bucket, keys[0]).encode('utf-8'))
+    else:
+        with ThreadPoolExecutor(max_workers=HEAD_CONCURRENCY) as pool:
+            parts = list(pool.map(lambda k: object_fingerprint(s3_client, bucket, k), keys))
+        for k, part in zip(keys, parts):
+            digest.update(k.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(part.encode('utf-8'))
+
+    for part in (model_id, prompt_version, db_info):
+        digest.update(b'\0')
+        digest.update(hashlib.sha256((part or '').encode('utf-8')).digest())
+    return digest.hexdigest()
+
+
+def result_key_for(cache_key):
+    """
+    キャッシュ済み結果の保存先
+    """
+    return f"results/{cache_key}.json"
+
+
+def lookup(s3_client, bucket, cache_key):
+    """
+    有効なキャッシュ済み結果があればそのキーを返す
+    TTL を過ぎたエントリは削除してミス扱いにする
+    """
+    cached_key = result_key_for(cache_key)
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=cached_key)
+    except Exception:
+        return None
+
+    last_modified = head.get('LastModified')
+    if last_modified is not None:
+        expires_at = last_modified + timedelta(hours=RESULT_CACHE_TTL_HOURS)
+        if datetime.now(timezone.utc) >= expires_at:
+            print(f"Result cache expired: {cached_key}")
+            try:
+                s3_client.delete_object(Bucket=bucket, Key=cached_key)
+            except Exception as e:
+                print(f"Failed to evict result cache: {str(e)}")
+            return None
+    return cached_key
+
+
+def restore(s3_client, bucket, cache_key, result_key, fields):
+    """
+    キャッシュ済み結果をジョブの結果キーへ保存
+    jobId / processedAt / trace などジョブ固有の項目は fields で書き換え、元のジョブの jobId と
+    processedAt を cachedFrom に残す (結果は小さいため取得して書き換える)
+    gzip / compact の形式はキャッシュ済み結果のものを引き継ぐ
+    """
+    body = s3_client.get_object(Bucket=bucket, Key=result_key_for(cache_key))['Body'].read()
+    source = result_format.decode_result(body)
+    fields = dict(fields, cachedFrom={'jobId': source.get('jobId'), 'processedAt': source.get('processedAt')})
+    body, extra = result_format.update_result(body, fields)
+    s3_client.put_object(Bucket=bucket, Key=result_key, Body=body, **extra)
+
+
+def store(s3_client, bucket, cache_key, result_key):
+    """
+    ジョブの結果をキャッシュとして登録 (サーバーサイドコピー)
+    登録失敗はジョブの成否に影響させない
+    """
+    try:
+        s3_client.copy_object(
+            Bucket=bucket,
+            Key=result_key_for(cache_key),
+            CopySource={'Bucket': bucket, 'Key': result_key},
+            MetadataDirective='COPY'
+        )
+    except Exception as e:
+        print(f"Failed to store result cache: {str(e)}")
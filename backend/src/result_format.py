@@ -0,0 +1,120 @@
+"""
+結果 JSON (results/{jobId}.json) のエンコード
+
+RESULT_FORMAT=compact の場合、グラフの集計結果を列指向 (ラベルと値の並列配列) にし、
+浮動小数点数を RESULT_FLOAT_DIGITS 桁に丸め、区切り文字の空白を省いて保存する。
+
+    {label: value, ...}               → {"labels": [...], "values": [...]}
+    [{x: .., y: .., count: ..}, ...]  → {"fields": [x, y, count], "columns": [[...], [...], [...]]}
+
+結果には "format": "compact/1" を付け、decode_result (フロントエンドは expandResult) で元の形式に戻せる。
+RESULT_GZIP=true の場合は gzip 圧縮して Content-Encoding: gzip で保存する
+(Presigned URL 経由のブラウザ取得では自動で展開される)。
+"""
+import gzip
+import json
+import math
+import os
+
+# 結果 JSON の形式 (json: 従来形式 / compact: 列指向)
+RESULT_FORMAT = os.environ.get('RESULT_FORMAT', 'json')
+# 結果 JSON を gzip 圧縮して保存するか
+RESULT_GZIP = os.environ.get('RESULT_GZIP', 'false').lower() == 'true'
+# compact 形式で浮動小数点数を丸める有効桁数
+RESULT_FLOAT_DIGITS = int(os.environ.get('RESULT_FLOAT_DIGITS', '6'))
+COMPACT_FORMAT = 'compact/1'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def round_value(v, digits=None):
+    """
+    浮動小数点数を有効桁数で丸める (NaN / inf は JSON に書けないため None)
+    """
+    if not isinstance(v, float):
+        return v
+    if not math.isfinite(v):
+        return None
+    return float(f"{v:.{digits or RESULT_FLOAT_DIGITS}g}")
+
+
+def encode_chart(data, digits=None):
+    """
+    1 グラフ分の集計結果を列指向に変換
+    """
+    if isinstance(data, dict):
+        return {'labels': list(data), 'values': [round_value(v, digits) for v in data.values()]}
+    if isinstance(data, list) and data and all(isinstance(p, dict) for p in data):
+        fields = list(dict.fromkeys(k for p in data for k in p))
+        return {'fields': fields, 'columns': [[round_value(p.get(f), digits) for p in data] for f in fields]}
+    return data
+
+
+def decode_chart(data):
+    """
+    encode_chart の逆変換
+    """
+    if isinstance(data, dict) and 'labels' in data and 'values' in data:
+        return dict(zip(data['labels'], data['values']))
+    if isinstance(data, dict) and 'fields' in data and 'columns' in data:
+        return [dict(zip(data['fields'], row)) for row in zip(*data['columns'])]
+    return data
+
+
+def encode_result(result, result_format=None, use_gzip=None):
+    """
+    結果を保存用のバイト列にする
+    戻り値: (本文, put_object に追加する引数)
+    """
+    result_format = result_format or RESULT_FORMAT
+    use_gzip = RESULT_GZIP if use_gzip is None else use_gzip
+    if result_format == 'compact':
+        result = dict(result, format=COMPACT_FORMAT)
+        result['charts'] = {k: encode_chart(v) for k, v in result.get('charts', {}).items()}
+        body = json.dumps(result, ensure_ascii=False, separators=(',', ':'), default=str)
+    else:
+        body = json.dumps(result, ensure_ascii=False)
+    body = body.encode('utf-8')
+
+    extra = {'ContentType': 'application/json'}
+    if use_gzip:
+        body = gzip.compress(body, compresslevel=6)
+        extra['ContentEncoding'] = 'gzip'
+    return body, extra
+
+
+def update_result(body, fields):
+    """
+    保存済みの結果 (gzip / compact のいずれも可) のトップレベルの項目を書き換える
+    グラフの集計結果は変換せず、元の形式・圧縮のまま保存用のバイト列にする
+    戻り値: (本文, put_object に追加する引数)
+    """
+    use_gzip = body[:2] == GZIP_MAGIC
+    if use_gzip:
+        body = gzip.decompress(body)
+    result = json.loads(body)
+    result.update(fields)
+    if result.get('format') == COMPACT_FORMAT:
+        body = json.dumps(result, ensure_ascii=False, separators=(',', ':'), default=str)
+    else:
+        body = json.dumps(result, ensure_ascii=False, default=str)
+    body = body.encode('utf-8')
+
+    extra = {'ContentType': 'application/json'}
+    if use_gzip:
+        body = gzip.compress(body, compresslevel=6)
+        extra['ContentEncoding'] = 'gzip'
+    return body, extra
+
+
+def decode_result(body):
+    """
+    保存された結果 (gzip / compact のいずれも可) を従来形式の dict に戻す
+    """
+    if body[:2] == GZIP_MAGIC:
+        body = gzip.decompress(body)
+    result = json.loads(body)
+    if result.get('format') == COMPACT_FORMAT:
+        result = dict(result)
+        del result['format']
+        result['charts'] = {k: decode_chart(v) for k, v in result.get('charts', {}).items()}
+    return result
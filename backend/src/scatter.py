@@ -0,0 +1,215 @@
+"""
+散布図の代表点の抽出 (2 次元ビン集計 + 外れ値の保持)
+
+全行からのランダムサンプルでは外れ値 (例: Temperature > 200 と Defect_Count の関係) が
+ほとんど残らないため、点数の上限 SCATTER_POINT_BUDGET の中で次の点を返す。
+
+    - 外れ値: 各軸の最小・最大の点と、中央値からのロバスト z 値 (IQR 基準) が
+              SCATTER_OUTLIER_Z を超える点を大きい順に SCATTER_OUTLIER_SHARE 分
+    - 密度: 外れ値以外を格子状にビン分割し、点のあるビンごとに重心と件数を 1 点として返す
+            (点のあるビン数が残りの点数に収まる範囲で格子を細かくする)
+
+乱数を使わないため同じ入力からは常に同じ点が返る (結果キャッシュの内容も安定する)。
+各点には元データの件数を count として付ける (外れ値は 1)。
+
+軸のどちらかが数値でない (category の dimension や文字列のカラム) 場合はビン分割できないため、
+固定シードの乱数で最大 SCATTER_POINT_BUDGET 行を抽出し、元の値のまま返す (件数は全行数を抽出した点に配分する)。
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# 散布図 1 つあたりの点数の上限
+SCATTER_POINT_BUDGET = int(os.environ.get('SCATTER_POINT_BUDGET', '300'))
+# 点数のうち外れ値に割り当てる割合
+SCATTER_OUTLIER_SHARE = float(os.environ.get('SCATTER_OUTLIER_SHARE', '0.2'))
+# 外れ値とみなすロバスト z 値
+SCATTER_OUTLIER_Z = 3.0
+# 格子を細かくする試行回数 (1 回ごとに 2 倍)
+GRID_REFINE_STEPS = 3
+# 数値でない軸の散布図で行を抽出する乱数のシード
+SCATTER_SAMPLE_SEED = 0
+
+
+def robust_scale(v):
+    """
+    中央値と IQR による尺度 (IQR が 0 の場合は標準偏差、それも 0 なら 1)
+    """
+    q1, med, q3 = np.percentile(v, [25, 50, 75])
+    scale = (q3 - q1) / 1.349
+    if not scale > 0:
+        scale = v.std()
+    return med, scale if scale > 0 else 1.0
+
+
+def select_outliers(x, y, k):
+    """
+    外れ値の位置 (最大 k 件)
+    各軸の最小・最大の点を優先し、残りはロバスト z 値が SCATTER_OUTLIER_Z を超える点を大きい順に選ぶ (同値は元の行順)
+    """
+    extremes = list(dict.fromkeys(int(i) for i in (x.argmin(), x.argmax(), y.argmin(), y.argmax())))[:k]
+    mx, sx = robust_scale(x)
+    my, sy = robust_scale(y)
+    score = np.maximum(np.abs(x - mx) / sx, np.abs(y - my) / sy)
+    score[extremes] = 0
+    candidates = np.flatnonzero(score > SCATTER_OUTLIER_Z)
+    n = k - len(extremes)
+    if n > 0 and len(candidates) > n:
+        candidates = candidates[np.argpartition(-score[candidates], n - 1)[:n]]
+    candidates = candidates[np.lexsort((candidates, -score[candidates]))][:max(n, 0)]
+    return np.array(extremes + candidates.tolist(), dtype=np.int64)
+
+
+def density_points(x, y, grid, weights=None):
+    """
+    grid x grid の格子でビン集計し、点のあるビンの (重心 x, 重心 y, 件数) を返す
+    weights: 点ごとの件数 (代表点を再集計する場合)。未指定時は 1
+    """
+    lo_x, hi_x = x.min(), x.max()
+    lo_y, hi_y = y.min(), y.max()
+    ix = np.zeros(len(x), dtype=np.int64) if hi_x == lo_x else np.minimum(((x - lo_x) / (hi_x - lo_x) * grid).astype(np.int64), grid - 1)
+    iy = np.zeros(len(y), dtype=np.int64) if hi_y == lo_y else np.minimum(((y - lo_y) / (hi_y - lo_y) * grid).astype(np.int64), grid - 1)
+    flat = ix * grid + iy
+    counts = np.bincount(flat, weights=weights, minlength=grid * grid)
+    occupied = np.flatnonzero(counts)
+    wx, wy = (x, y) if weights is None else (x * weights, y * weights)
+    cx = np.bincount(flat, weights=wx, minlength=grid * grid)[occupied] / counts[occupied]
+    cy = np.bincount(flat, weights=wy, minlength=grid * grid)[occupied] / counts[occupied]
+    return cx, cy, counts[occupied]
+
+
+def numeric_axis(s):
+    """
+    軸の値を float64 の配列にする (数値に変換できない値を含む軸は None)
+    """
+    if pd.api.types.is_bool_dtype(s):
+        return None
+    if pd.api.types.is_numeric_dtype(s):
+        return s.to_numpy(dtype='float64', na_value=np.nan)
+    values = pd.to_numeric(s, errors='coerce')
+    if (values.isna() & s.notna()).any():
+        return None
+    return values.to_numpy(dtype='float64', na_value=np.nan)
+
+
+def reduce_scatter(df, x_col, y_col, budget=None):
+    """
+    散布図の代表点 ([{x_col: x, y_col: y, 'count': 件数}, ...]) を返す
+    2 カラムだけを取り出して処理し、DataFrame 全体はコピーしない
+    """
+    x = numeric_axis(df[x_col])
+    y = numeric_axis(df[y_col])
+    if x is None or y is None:
+        return sample_scatter(df, x_col, y_col, budget)
+    valid = np.isfinite(x) & np.isfinite(y)
+    return reduce_points(x[valid], y[valid], None, x_col, y_col, budget)
+
+
+def plain_value(v):
+    """
+    JSON に書ける値にする (numpy のスカラーは Python の値、日時は ISO 形式の文字列)
+    """
+    if hasattr(v, 'isoformat'):
+        return v.isoformat()
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+
+def spread_counts(total, k):
+    """
+    total 件を k 点に配分した件数 (合計が total になるよう先頭の点に 1 件ずつ上乗せする)
+    """
+    counts = np.full(k, total // k, dtype=np.int64)
+    counts[:total % k] += 1
+    return counts
+
+
+def sample_scatter(df, x_col, y_col, budget=None):
+    """
+    数値でない軸の散布図 (固定シードで抽出した行を元の値のまま返す)
+    """
+    budget = SCATTER_POINT_BUDGET if budget is None else budget
+    count_key = 'count' if 'count' not in (x_col, y_col) else '_count'
+    x, y = df[x_col], df[y_col]
+    rows = np.flatnonzero((x.notna() & y.notna()).to_numpy())
+    if len(rows) == 0 or budget <= 0:
+        return []
+    picked = rows
+    if len(rows) > budget:
+        rng = np.random.default_rng(SCATTER_SAMPLE_SEED)
+        picked = np.sort(rng.choice(rows, budget, replace=False))
+    counts = spread_counts(len(rows), len(picked))
+    xs, ys = x.iloc[picked].tolist(), y.iloc[picked].tolist()
+    return [
+        {x_col: plain_value(a), y_col: plain_value(b), count_key: int(c)} for a, b, c in zip(xs, ys, counts)
+    ]
+
+
+def is_number(v):
+    return isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))
+
+
+def merge_sampled(points, x_col, y_col, budget=None):
+    """
+    数値でない軸の点 (sample_scatter の結果) のマージ
+    点数の上限を超える場合は件数に比例した確率で固定シードの乱数により抽出し、件数の合計を保って配分し直す
+    """
+    budget = SCATTER_POINT_BUDGET if budget is None else budget
+    count_key = 'count' if 'count' not in (x_col, y_col) else '_count'
+    if len(points) <= budget:
+        return points
+    w = np.array([p.get(count_key, 1) for p in points], dtype='float64')
+    rng = np.random.default_rng(SCATTER_SAMPLE_SEED)
+    picked = np.sort(rng.choice(len(points), budget, replace=False, p=w / w.sum()))
+    counts = spread_counts(int(round(w.sum())), len(picked))
+    return [dict(points[i], **{count_key: int(c)}) for i, c in zip(picked, counts)]
+
+
+def merge_points(a, b, x_col, y_col, budget=None):
+    """
+    2 つの代表点のリストをマージし、点数の上限を超える場合は件数で重み付けして再集計する (増分分析用)
+    外れ値の判定は代表点に対して行うため、全行から求めた場合とは一致しないことがある
+    """
+    count_key = 'count' if 'count' not in (x_col, y_col) else '_count'
+    points = list(a) + list(b)
+    if not all(is_number(p[x_col]) and is_number(p[y_col]) for p in points):
+        return merge_sampled(points, x_col, y_col, budget)
+    x = np.array([p[x_col] for p in points], dtype='float64')
+    y = np.array([p[y_col] for p in points], dtype='float64')
+    w = np.array([p.get(count_key, 1) for p in points], dtype='float64')
+    return reduce_points(x, y, w, x_col, y_col, budget)
+
+
+def reduce_points(x, y, weights, x_col, y_col, budget=None):
+    """
+    点の配列 (weights: 点ごとの件数。None は 1) から代表点を作る
+    """
+    budget = SCATTER_POINT_BUDGET if budget is None else budget
+    count_key = 'count' if 'count' not in (x_col, y_col) else '_count'
+    w = np.ones(len(x)) if weights is None else weights
+
+    if len(x) <= budget:
+        return [{x_col: float(a), y_col: float(b), count_key: int(c)} for a, b, c in zip(x, y, w)]
+
+    outliers = select_outliers(x, y, int(budget * SCATTER_OUTLIER_SHARE))
+    rest = np.ones(len(x), dtype=bool)
+    rest[outliers] = False
+    x_rest, y_rest = x[rest], y[rest]
+    w_rest = None if weights is None else weights[rest]
+
+    # 外れ値を除いた範囲を、点のあるビン数が残りの点数に収まる格子で分割する
+    remaining = budget - len(outliers)
+    grid = max(int(np.sqrt(remaining)), 1)
+    cx, cy, counts = density_points(x_rest, y_rest, grid, w_rest)
+    for _ in range(GRID_REFINE_STEPS):
+        # 離散値の軸などで点のあるビンが少なければ格子を細かくする
+        finer = density_points(x_rest, y_rest, grid * 2, w_rest)
+        if len(finer[2]) > remaining:
+            break
+        grid *= 2
+        cx, cy, counts = finer
+
+    points = [{x_col: float(x[i]), y_col: float(y[i]), count_key: int(w[i])} for i in outliers]
+    points.extend({x_col: float(a), y_col: float(b), count_key: int(round(c))} for a, b, c in zip(cx, cy, counts))
+    return points
@@ -0,0 +1,371 @@
+"""
+分析ジョブのスケジューリング (優先度・同時実行数の制御)
+
+分析 Lambda を即時に起動する代わりに、ジョブを優先度別のキューに登録し、実行枠に空きがある分だけ起動する。
+大量のバッチ投入が対話的なジョブ (画面からのアップロード・単発の API 呼び出し) と
+Bedrock のクォータや Lambda の同時実行数を奪い合わないよう、次の上限を設ける。
+
+    SCHEDULER_MAX_RUNNING     全体の実行中ジョブ数
+    SCHEDULER_MAX_BATCH       優先度 batch の実行中ジョブ数 (残りは interactive 専用の枠になる)
+    SCHEDULER_MAX_PER_TENANT  テナント・優先度ごとの実行中ジョブ数
+    SCHEDULER_MAX_HEAVY       heavy プロファイルの実行中ジョブ数
+
+ジョブのコストは入力オブジェクトのバイト数で見積もり、SCHEDULER_HEAVY_BYTES 以上のジョブは
+heavy プロファイル (メモリ・タイムアウトの大きい PROCESS_FUNCTION_HEAVY) で実行する。
+
+実行枠は jobId ごとのリース (実行中の印) で管理する。リースを書き込んだ後に全リースを読み直し、
+先に取得されたリースだけで上限に達していれば取り消すため、複数の Lambda が同時に起動判定しても上限を超えない。
+リースはジョブ終了時 (finish) に削除し、異常終了で残ったリースは SCHEDULER_LEASE_SECONDS 後に無効になる。
+キューはジョブの登録時と終了時に処理する (pump)。タイムアウトやメモリ不足で終了時の処理を行えなかったジョブの
+リースは、定期実行 (EventBridge) の handler が期限切れ後に回収し、空いた枠で待機中のジョブを起動する。
+SCHEDULER_LEASE_SECONDS は分析 Lambda の最大のタイムアウト (heavy の 900 秒) より長くする。
+
+保存先は QUEUE_TABLE (DynamoDB、パーティションキー pk / ソートキー sk) で、
+local バックエンドでは LOCAL_DATA_DIR の SQLite ファイルを使う。QUEUE_TABLE 未設定 (aws) の場合は
+スケジューリングを行わず、従来どおり即時に起動する。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+import backends
+import sources
+
+QUEUE_TABLE = os.environ.get('QUEUE_TABLE') or ('local-queue' if backends.is_local() else None)
+JOB_TABLE = backends.env('JOB_TABLE', 'local-jobs')
+PROCESS_FUNCTION = backends.env('PROCESS_FUNCTION', 'local-processor')
+# heavy プロファイルの分析 Lambda (未設定時は通常の関数で実行する)
+PROCESS_FUNCTION_HEAVY = os.environ.get('PROCESS_FUNCTION_HEAVY') or PROCESS_FUNCTION
+# この Lambda のプロファイル (S3 イベントで起動されたジョブをそのまま実行できるかの判定に使う)
+PROCESS_PROFILE = os.environ.get('PROCESS_PROFILE', 'standard')
+
+SCHEDULER_MAX_RUNNING = int(os.environ.get('SCHEDULER_MAX_RUNNING', '20'))
+SCHEDULER_MAX_BATCH = int(os.environ.get('SCHEDULER_MAX_BATCH', '12'))
+SCHEDULER_MAX_PER_TENANT = int(os.environ.get('SCHEDULER_MAX_PER_TENANT', '4'))
+SCHEDULER_MAX_HEAVY = int(os.environ.get('SCHEDULER_MAX_HEAVY', '2'))
+# heavy プロファイルで実行する入力サイズ (バイト)
+SCHEDULER_HEAVY_BYTES = int(os.environ.get('SCHEDULER_HEAVY_BYTES', str(256 * 1024 * 1024)))
+# リースの有効期間 (秒)。分析 Lambda の最大タイムアウトより長くする
+SCHEDULER_LEASE_SECONDS = int(os.environ.get('SCHEDULER_LEASE_SECONDS', '960'))
+# 1 回の pump で優先度ごとに確認するキューの先頭件数
+SCHEDULER_SCAN_LIMIT = int(os.environ.get('SCHEDULER_SCAN_LIMIT', '100'))
+
+# 優先度 (起動を判定する順)
+PRIORITIES = ('interactive', 'batch')
+LEASE_PK = 'running'
+
+
+class DynamoQueueStore:
+    """
+    DynamoDB のキュー・リース
+        キュー  : pk = queue#{priority}, sk = {queuedAt}#{jobId}
+        リース  : pk = running, sk = {jobId}
+    """
+    def __init__(self, dynamodb, table_name):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    def _table(self):
+        return self.dynamodb.Table(self.table_name)
+
+    def _query(self, pk, limit=None):
+        from boto3.dynamodb.conditions import Key
+        args = {'KeyConditionExpression': Key('pk').eq(pk), 'ConsistentRead': True}
+        items = []
+        while True:
+            if limit:
+                args['Limit'] = limit - len(items)
+            response = self._table().query(**args)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response or (limit and len(items) >= limit):
+                return [plain(item) for item in items]
+            args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def enqueue(self, entry):
+        self._table().put_item(Item=dict(entry, pk=queue_pk(entry['priority']), sk=queue_sk(entry)))
+
+    def queued(self, priority, limit):
+        return self._query(queue_pk(priority), limit)
+
+    def remove(self, entry):
+        self._table().delete_item(Key={'pk': queue_pk(entry['priority']), 'sk': queue_sk(entry)})
+
+    def leases(self):
+        return self._query(LEASE_PK)
+
+    def acquire(self, lease):
+        try:
+            self._table().put_item(
+                Item=dict(lease, pk=LEASE_PK, sk=lease['jobId']),
+                ConditionExpression='attribute_not_exists(sk)'
+            )
+            return True
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, job_id):
+        self._table().delete_item(Key={'pk': LEASE_PK, 'sk': job_id})
+
+
+class LocalQueueStore:
+    """
+    SQLite のキュー・リース (local バックエンド用、DynamoQueueStore と同じ操作)
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS queue (pk TEXT, sk TEXT, entry TEXT, PRIMARY KEY (pk, sk))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS leases (job_id TEXT PRIMARY KEY, lease TEXT)")
+
+    def enqueue(self, entry):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO queue (pk, sk, entry) VALUES (?, ?, ?)",
+                (queue_pk(entry['priority']), queue_sk(entry), json.dumps(entry))
+            )
+
+    def queued(self, priority, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT entry FROM queue WHERE pk = ? ORDER BY sk LIMIT ?", (queue_pk(priority), limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def remove(self, entry):
+        with self.lock:
+            self.conn.execute("DELETE FROM queue WHERE pk = ? AND sk = ?", (queue_pk(entry['priority']), queue_sk(entry)))
+
+    def leases(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT lease FROM leases").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def acquire(self, lease):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO leases (job_id, lease) VALUES (?, ?)", (lease['jobId'], json.dumps(lease))
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE job_id = ?", (job_id,))
+
+
+def create_store():
+    """
+    QUEUE_TABLE に応じたキュー (スケジューリングしない場合は None)
+    """
+    if not QUEUE_TABLE:
+        return None
+    if backends.is_local():
+        return LocalQueueStore(os.path.join(backends.LOCAL_DATA_DIR, f"{QUEUE_TABLE}.sqlite3"))
+    return DynamoQueueStore(backends.job_database(), QUEUE_TABLE)
+
+
+def plain(item):
+    """
+    DynamoDB から取得した値 (数値は Decimal) を int に戻す
+    """
+    return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+
+def queue_pk(priority):
+    return f"queue#{priority}"
+
+
+def queue_sk(entry):
+    return f"{entry['queuedAt']}#{entry['jobId']}"
+
+
+def tenant_of(event):
+    """
+    リクエストのテナント (Cognito ユーザー、API Key のハッシュ、いずれもなければ anonymous)
+    """
+    claims = event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {})
+    if claims.get('sub'):
+        return f"user:{claims['sub']}"
+    headers = event.get('headers') or {}
+    api_key = headers.get('x-api-key') or headers.get('X-API-Key')
+    if api_key:
+        return f"key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]}"
+    return 'anonymous'
+
+
+def estimate_bytes(s3_client, data_source):
+    """
+    外部S3ソースの入力バイト数 (プレフィックス / glob 指定は一致するオブジェクトの合計、取得できなければ 0)
+    """
+    try:
+        bucket, key = data_source['uri'].replace('s3://', '').split('/', 1)
+        return int(sources.total_bytes(s3_client, bucket, sources.resolve_objects(s3_client, bucket, key)))
+    except Exception as e:
+        print(f"Failed to estimate job size for {data_source.get('uri')}: {str(e)}")
+        return 0
+
+
+def profile_for(cost_bytes):
+    """
+    入力サイズに応じた実行プロファイル
+    """
+    return 'heavy' if cost_bytes >= SCHEDULER_HEAVY_BYTES else 'standard'
+
+
+def new_entry(job_id, payload, priority, tenant, cost_bytes):
+    """
+    キューのエントリ (payload は分析 Lambda の起動イベント)
+    """
+    return {
+        'jobId': job_id,
+        'priority': priority,
+        'tenant': tenant,
+        'costBytes': int(cost_bytes or 0),
+        'profile': profile_for(cost_bytes or 0),
+        'queuedAt': datetime.utcnow().isoformat(timespec='microseconds'),
+        'payload': json.dumps(payload),
+    }
+
+
+def active_leases(store):
+    """
+    有効なリース (期限切れのリースは削除する)
+    """
+    now = time.time()
+    leases = []
+    for lease in store.leases():
+        if lease['expiresAt'] < now:
+            print(f"Lease for {lease['jobId']} expired, releasing")
+            store.release(lease['jobId'])
+        else:
+            leases.append(lease)
+    return leases
+
+
+def admissible(entry, leases):
+    """
+    leases が実行中の状態で entry を起動できるか
+    """
+    if len(leases) >= SCHEDULER_MAX_RUNNING:
+        return False
+    if entry['priority'] == 'batch' and sum(l['priority'] == 'batch' for l in leases) >= SCHEDULER_MAX_BATCH:
+        return False
+    same_tenant = sum(l['tenant'] == entry['tenant'] and l['priority'] == entry['priority'] for l in leases)
+    if same_tenant >= SCHEDULER_MAX_PER_TENANT:
+        return False
+    if entry['profile'] == 'heavy' and sum(l['profile'] == 'heavy' for l in leases) >= SCHEDULER_MAX_HEAVY:
+        return False
+    return True
+
+
+def holds_slot(lease, leases):
+    """
+    先に取得されたリースだけで上限に達していないか (同時に取得した場合は取得時刻の早い方を優先)
+    """
+    order = lambda l: (l['leasedAt'], l['jobId'])
+    return admissible(lease, [l for l in leases if order(l) < order(lease)])
+
+
+def start(entry):
+    """
+    分析 Lambda をプロファイルに応じて非同期で起動 (起動に失敗したジョブは FAILED にする)
+    戻り値: 起動できたか
+    """
+    function_name = PROCESS_FUNCTION_HEAVY if entry['profile'] == 'heavy' else PROCESS_FUNCTION
+    payload = dict(json.loads(entry['payload']), scheduled=True)
+    try:
+        backends.function_invoker().invoke(
+            FunctionName=function_name, InvocationType='Event', Payload=json.dumps(payload)
+        )
+        return True
+    except Exception as e:
+        print(f"Failed to invoke processor for {entry['jobId']}: {str(e)}")
+        from progress import JobProgress
+        JobProgress(backends.job_database().Table(JOB_TABLE), entry['jobId']).update(
+            "#s = :s, #e = :e",
+            names={'#s': 'status', '#e': 'error'},
+            values={':s': 'FAILED', ':e': 'Failed to start processing'}
+        )
+        return False
+
+
+def pump(store, inline_job_id=None):
+    """
+    実行枠の空きに応じて、キューのジョブを優先度順・登録順に起動する
+    (上限に達したテナント・プロファイルのジョブは飛ばし、後ろのジョブを先に起動する)
+    inline_job_id: 呼び出し元の Lambda でそのまま実行するジョブ (起動せずに枠だけ確保する)
+    戻り値: {'inline': inline_job_id の枠を確保できたか, 'started': [...], 'failed': [...]}
+    """
+    result = {'inline': False, 'started': [], 'failed': []}
+    leases = active_leases(store)
+    for priority in PRIORITIES:
+        for entry in store.queued(priority, SCHEDULER_SCAN_LIMIT):
+            if len(leases) >= SCHEDULER_MAX_RUNNING:
+                return result
+            if not admissible(entry, leases):
+                continue
+            now = time.time()
+            lease = {
+                'jobId': entry['jobId'], 'priority': entry['priority'], 'tenant': entry['tenant'],
+                'profile': entry['profile'],
+                'leasedAt': datetime.utcnow().isoformat(timespec='microseconds'),
+                'expiresAt': int(now + SCHEDULER_LEASE_SECONDS),
+            }
+            if not store.acquire(lease):
+                # 別の Lambda が起動済み
+                store.remove(entry)
+                continue
+            leases = active_leases(store)
+            if not holds_slot(lease, leases):
+                # 同時に枠を取得した他のジョブが優先された
+                store.release(entry['jobId'])
+                return result
+            store.remove(entry)
+            if entry['jobId'] == inline_job_id and entry['profile'] == PROCESS_PROFILE:
+                result['inline'] = True
+            elif start(entry):
+                result['started'].append(entry['jobId'])
+            else:
+                store.release(entry['jobId'])
+                leases = [l for l in leases if l['jobId'] != entry['jobId']]
+                result['failed'].append(entry['jobId'])
+    return result
+
+
+def submit(store, entries, inline_job_id=None):
+    """
+    ジョブをキューに登録し、空いている枠の分だけ起動する
+    """
+    for entry in entries:
+        store.enqueue(entry)
+    result = pump(store, inline_job_id)
+    print(f"Scheduler: {len(entries)} queued, {len(result['started'])} started, {len(result['failed'])} failed"
+          + (", running inline" if result['inline'] else ''))
+    return result
+
+
+def finish(store, job_id):
+    """
+    ジョブの終了 (リースを解放し、空いた枠で待機中のジョブを起動する)
+    """
+    store.release(job_id)
+    return pump(store)
+
+
+def handler(event, context):
+    """
+    定期実行のエントリーポイント (期限切れのリースを回収し、空いた枠で待機中のジョブを起動する)
+    """
+    store = create_store()
+    if store is None:
+        return {'started': [], 'failed': []}
+    result = pump(store)
+    print(f"Scheduler pump: {len(result['started'])} started, {len(result['failed'])} failed")
+    return {'started': result['started'], 'failed': result['failed']}
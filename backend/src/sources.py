@@ -0,0 +1,118 @@
+"""
+複数オブジェクトからなる入力データ (プレフィックス / glob 指定) の解決
+
+dataSource の uri に次の形式を指定すると、一致する CSV をまとめて 1 つのデータセットとして分析する。
+
+    s3://bucket/line1/2025/12/01/           末尾が / の場合はプレフィックス配下のすべての .csv
+    s3://bucket/line1/2025/12/01/*.csv      * / ? は / をまたがない 1 階層内のワイルドカード
+    s3://bucket/line1/2025/12/**/*.csv      ** は任意の階層
+
+一覧取得はワイルドカードより前の固定部分をプレフィックスとして行い、キーの昇順で返す。
+"""
+import os
+import re
+
+# 1 ジョブで読み込むオブジェクト数の上限
+SOURCE_MAX_OBJECTS = int(os.environ.get('SOURCE_MAX_OBJECTS', '2000'))
+# オブジェクトを並行して取得・パースするスレッド数
+SOURCE_FETCH_CONCURRENCY = int(os.environ.get('SOURCE_FETCH_CONCURRENCY', '8'))
+WILDCARDS = ('*', '?')
+
+
+def is_pattern(key):
+    """
+    キーが複数オブジェクトの指定 (プレフィックス / glob) か
+    """
+    return key.endswith('/') or any(w in key for w in WILDCARDS)
+
+
+def pattern_regex(pattern):
+    """
+    glob パターンを正規表現に変換 (** は任意の階層、* と ? は / 以外)
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+
+def list_keys(s3_client, bucket, pattern):
+    """
+    パターンに一致するオブジェクトのキー (昇順)
+    """
+    return [obj['Key'] for obj in list_objects(s3_client, bucket, pattern)]
+
+
+def list_objects(s3_client, bucket, pattern):
+    """
+    パターンに一致するオブジェクト ({'Key', 'Size'}、キーの昇順)
+    空のオブジェクト (フォルダの代わりに作られるキーなど) は除外する
+    """
+    if pattern.endswith('/'):
+        prefix, regex = pattern, None
+    else:
+        cut = min(pattern.find(w) for w in WILDCARDS if w in pattern)
+        prefix, regex = pattern[:cut], pattern_regex(pattern)
+
+    objects = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if obj.get('Size', 1) == 0:
+                continue
+            if regex is None and not key.lower().endswith('.csv'):
+                continue
+            if regex is not None and not regex.match(key):
+                continue
+            objects.append({'Key': key, 'Size': obj.get('Size', 0)})
+            if len(objects) > SOURCE_MAX_OBJECTS:
+                raise Exception(f"Too many objects match s3://{bucket}/{pattern} (max {SOURCE_MAX_OBJECTS})")
+    return sorted(objects, key=lambda obj: obj['Key'])
+
+
+def resolve(s3_client, bucket, key):
+    """
+    入力のキー一覧 (単一オブジェクトの場合はそのキーのみ)
+    """
+    return [obj['Key'] for obj in resolve_objects(s3_client, bucket, key)]
+
+
+def resolve_objects(s3_client, bucket, key):
+    """
+    入力のオブジェクト一覧 ({'Key', 'Size'})
+    単一オブジェクトの場合は一覧取得を行わないため Size は None (必要なら total_bytes で求める)
+    """
+    if not is_pattern(key):
+        return [{'Key': key, 'Size': None}]
+    objects = list_objects(s3_client, bucket, key)
+    if not objects:
+        raise Exception(f"No objects match s3://{bucket}/{key}")
+    print(f"Resolved s3://{bucket}/{key} to {len(objects)} objects")
+    return objects
+
+
+def total_bytes(s3_client, bucket, objects):
+    """
+    resolve_objects の結果の合計バイト数 (Size が不明なオブジェクトは head_object で取得する)
+    """
+    return sum(
+        obj['Size'] if obj['Size'] is not None
+        else s3_client.head_object(Bucket=bucket, Key=obj['Key'])['ContentLength']
+        for obj in objects
+    )
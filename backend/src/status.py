@@ -1,14 +1,38 @@
+import hashlib
 import json
 import os
-import boto3
+import time
+from decimal import Decimal
 import ipaddress
+import backends
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-JOB_TABLE = os.environ['JOB_TABLE']
-DATA_BUCKET = os.environ.get('DATA_BUCKET')
+s3 = backends.object_store()
+dynamodb = backends.job_database()
+JOB_TABLE = backends.env('JOB_TABLE', 'local-jobs')
+DATA_BUCKET = backends.env('DATA_BUCKET', 'local-data')
 ALLOWED_IP_RANGE = os.environ.get('ALLOWED_IP_RANGE', '0.0.0.0/0')
 API_KEY = os.environ.get('API_KEY')
+# batchId でジョブを引くための GSI
+BATCH_INDEX = os.environ.get('BATCH_INDEX', 'batchId-index')
+FINISHED_STATUSES = ('COMPLETED', 'FAILED')
+# 結果取得用 Presigned URL の有効期間と、期限切れ前に再発行する余裕 (秒)
+RESULT_URL_EXPIRES = int(os.environ.get('RESULT_URL_EXPIRES', '3600'))
+RESULT_URL_REFRESH_MARGIN = int(os.environ.get('RESULT_URL_REFRESH_MARGIN', '300'))
+RESULT_URL_CACHE_SIZE = 1024
+# GET /jobs?ids= で一度に問い合わせできるジョブ数 (batch_get_item の上限)
+MAX_STATUS_IDS = 100
+# 複数ジョブ照会で返す属性 (analysisPlan などの大きな属性は返さない)
+STATUS_ATTRIBUTES = (
+    'jobId', 'status', 'resultKey', 'error', 'cacheHit', 'batchId', 'createdAt', 'updatedAt', 'version', 'progress',
+    'priority'
+)
+# ロングポーリング (GET /jobs/{id}?wait=秒) の最大待機秒数と DynamoDB の再確認間隔
+# API Gateway の統合タイムアウト (30秒) 未満に収める
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', '25'))
+LONG_POLL_INTERVAL = float(os.environ.get('LONG_POLL_INTERVAL', '1'))
+
+# resultKey ごとの Presigned URL キャッシュ { resultKey: (url, 発行した期間) } (ウォームスタート間で再利用)
+result_urls = {}
 
 def is_ip_allowed(source_ip):
     """
@@ -32,9 +56,251 @@ def validate_api_key(headers):
     request_key = headers.get('x-api-key') or headers.get('X-API-Key')
     return request_key == API_KEY
 
+def result_url_period(now=None):
+    """
+    Presigned URL を再利用する期間の番号 (RESULT_URL_EXPIRES - RESULT_URL_REFRESH_MARGIN 秒ごとに切り替わる)
+    時刻だけで決まるため、どのコンテナでも同じ値になる。期間内に発行した URL は期間の終了後も
+    RESULT_URL_REFRESH_MARGIN 秒以上有効
+    """
+    now = time.time() if now is None else now
+    return int(now // max(RESULT_URL_EXPIRES - RESULT_URL_REFRESH_MARGIN, 1))
+
+def get_result_url(result_key):
+    """
+    結果取得用の Presigned URL (同じ期間 (result_url_period) 内はキャッシュを再利用)
+    """
+    period = result_url_period()
+    cached = result_urls.get(result_key)
+    if cached and cached[1] == period:
+        return cached[0]
+
+    url = s3.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': DATA_BUCKET,
+            'Key': result_key
+        },
+        ExpiresIn=RESULT_URL_EXPIRES
+    )
+    if result_key not in result_urls and len(result_urls) >= RESULT_URL_CACHE_SIZE:
+        result_urls.pop(next(iter(result_urls)))
+    result_urls[result_key] = (url, period)
+    return url
+
+def attach_result_url(item):
+    """
+    COMPLETED の場合、結果取得用の Presigned URL を付与
+    """
+    if item.get('status') == 'COMPLETED' and item.get('resultKey'):
+        try:
+            item['resultUrl'] = get_result_url(item['resultKey'])
+        except Exception as e:
+            print(f"Error generating presigned URL: {str(e)}")
+    return item
+
+def normalize_progress(item):
+    """
+    version / progress / events の数値 (Decimal) を JSON 数値に変換
+    """
+    def plain(value):
+        if isinstance(value, Decimal):
+            return int(value) if value == value.to_integral_value() else float(value)
+        if isinstance(value, dict):
+            return {k: plain(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [plain(v) for v in value]
+        return value
+
+    item['version'] = plain(item.get('version', 0))
+    for attr in ('progress', 'events'):
+        if attr in item:
+            item[attr] = plain(item[attr])
+    return item
+
+def wait_for_job(table, job_id, is_changed, timeout, interval=None, sleep=time.sleep, clock=time.monotonic):
+    """
+    ジョブ item が変化する (is_changed(item) が真になる) か timeout 秒経過するまで再取得を繰り返す
+    table は get_item を持つ DynamoDB Table 互換オブジェクト
+    戻り値: 最後に取得した item (ジョブが存在しない場合は None)
+    """
+    interval = interval or LONG_POLL_INTERVAL
+    deadline = clock() + timeout
+    while True:
+        item = table.get_item(Key={'jobId': job_id}).get('Item')
+        if item is None or is_changed(item):
+            return item
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return item
+        sleep(min(interval, remaining))
+
+def long_poll_timeout(event, context):
+    """
+    ロングポーリングの待機秒数 (?wait=秒、Lambda の残り時間も考慮)
+    """
+    try:
+        wait = float((event.get('queryStringParameters') or {}).get('wait') or 0)
+    except ValueError:
+        return 0
+    wait = min(max(wait, 0), LONG_POLL_MAX_WAIT)
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        wait = min(wait, context.get_remaining_time_in_millis() / 1000 - 2)
+    return max(wait, 0)
+
+def job_etag(items):
+    """
+    ジョブの状態・更新時刻 (未更新なら作成時刻)・version から ETag を計算
+    Presigned URL はコンテナごとに発行されるため含めず、結果URLを返すジョブには URL を発行した期間の番号を含める
+    (期間が切り替わると 304 にならず、期限切れ前の新しい URL が返る)
+    """
+    def url_period(item):
+        if not item.get('resultUrl'):
+            return None
+        cached = result_urls.get(item.get('resultKey'))
+        return cached[1] if cached else result_url_period()
+
+    state = [
+        [
+            item.get('jobId'), item.get('status'), item.get('updatedAt') or item.get('createdAt'),
+            item.get('version'), url_period(item)
+        ]
+        for item in items
+    ]
+    return body_etag(state)
+
+def body_etag(value):
+    """
+    任意の値 (JSON化可能) から弱い ETag を計算
+    """
+    raw = json.dumps(value, default=str, sort_keys=True)
+    return 'W/"' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32] + '"'
+
+def etag_matches(headers, etag):
+    """
+    If-None-Match が ETag と一致するか (弱い比較)
+    """
+    header = headers.get('if-none-match') or headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(',')]
+    if '*' in candidates:
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any((c[2:] if c.startswith('W/') else c) == opaque for c in candidates)
+
+def conditional_response(headers, body, etag):
+    """
+    ETag 付きのレスポンス (If-None-Match が一致すれば本文なしの 304)
+    """
+    response_headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(headers, etag):
+        return {'statusCode': 304, 'headers': response_headers}
+
+    response_headers['Content-Type'] = 'application/json'
+    return {
+        'statusCode': 200,
+        'headers': response_headers,
+        'body': json.dumps(body, default=str)
+    }
+
+def is_multi_job_request(event):
+    """
+    複数ジョブ照会 (GET /jobs?ids=...) のリクエストか
+    """
+    if event.get('routeKey') == 'GET /jobs':
+        return True
+    return (event.get('rawPath') or '').rstrip('/') == '/jobs'
+
+def get_jobs(job_ids):
+    """
+    batch_get_item で複数ジョブの状態を取得 (未処理キーは再試行)
+    戻り値: ジョブID順の item リスト, 見つからなかったジョブID のリスト
+    """
+    names = {f"#a{i}": attr for i, attr in enumerate(STATUS_ATTRIBUTES)}
+    request = {
+        JOB_TABLE: {
+            'Keys': [{'jobId': job_id} for job_id in job_ids],
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names
+        }
+    }
+    found = {}
+    for attempt in range(5):
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for item in response.get('Responses', {}).get(JOB_TABLE, []):
+            found[item['jobId']] = item
+        request = response.get('UnprocessedKeys') or {}
+        if not request:
+            break
+        time.sleep(0.05 * (2 ** attempt))
+    else:
+        raise RuntimeError('Failed to read all job statuses (throttled)')
+
+    items = [found[job_id] for job_id in job_ids if job_id in found]
+    missing = [job_id for job_id in job_ids if job_id not in found]
+    return items, missing
+
+def is_batch_request(event):
+    """
+    バッチ進捗 (GET /batches/{id}) のリクエストか
+    """
+    if event.get('routeKey') == 'GET /batches/{id}':
+        return True
+    return (event.get('rawPath') or '').startswith('/batches/')
+
+def get_batch_status(batch_id):
+    """
+    バッチ配下のジョブを GSI から取得し、進捗を集計
+    """
+    # boto3 は DynamoDB リソースの初回生成まで読み込まない (backends.lazy) ため、ここで import する
+    from boto3.dynamodb.conditions import Key
+    table = dynamodb.Table(JOB_TABLE)
+    query_args = {
+        'IndexName': BATCH_INDEX,
+        'KeyConditionExpression': Key('batchId').eq(batch_id)
+    }
+    jobs = []
+    while True:
+        response = table.query(**query_args)
+        jobs.extend({'jobId': item['jobId'], 'status': item.get('status')} for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    if not jobs:
+        return None
+
+    counts = {}
+    for job in jobs:
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+    finished = sum(counts.get(s, 0) for s in FINISHED_STATUSES)
+
+    if finished < len(jobs):
+        status = 'PROCESSING'
+    elif counts.get('FAILED'):
+        status = 'COMPLETED_WITH_ERRORS'
+    else:
+        status = 'COMPLETED'
+
+    return {
+        'batchId': batch_id,
+        'status': status,
+        'total': len(jobs),
+        'finished': finished,
+        'progress': round(finished / len(jobs), 4),
+        'counts': counts,
+        'jobs': jobs
+    }
+
 def handler(event, context):
     """
     ジョブのステータス確認
+    GET /jobs?ids=a,b,... の場合は複数ジョブをまとめて返す
+    GET /batches/{id} の場合はバッチ全体の進捗を返す
+    いずれも ETag を付与し、If-None-Match が一致すれば 304 (本文なし) を返す
+    GET /jobs/{id}?wait=秒 の場合はロングポーリング:
+      ?version=N (前回の version) と異なる version になるか、
+      version 未指定なら If-None-Match の ETag と異なる状態になるまで待ってから返す
     """
     try:
         headers = event.get('headers', {})
@@ -55,37 +321,52 @@ def handler(event, context):
                 'body': json.dumps({'error': 'Unauthorized: Invalid API Key'})
             }
 
+        if is_batch_request(event):
+            batch_id = (event.get('pathParameters') or {}).get('id')
+            if not batch_id:
+                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing batch ID'})}
+            batch = get_batch_status(batch_id)
+            if batch is None:
+                return {'statusCode': 404, 'body': json.dumps({'error': 'Batch not found'})}
+            return conditional_response(headers, batch, body_etag(batch))
+
+        if is_multi_job_request(event):
+            raw_ids = ((event.get('queryStringParameters') or {}).get('ids') or '').split(',')
+            job_ids = list(dict.fromkeys(i.strip() for i in raw_ids if i.strip()))
+            if not job_ids:
+                return {'statusCode': 400, 'body': json.dumps({'error': 'Missing job IDs'})}
+            if len(job_ids) > MAX_STATUS_IDS:
+                return {'statusCode': 400, 'body': json.dumps({'error': f'Too many job IDs (max {MAX_STATUS_IDS})'})}
+
+            items, missing = get_jobs(job_ids)
+            for item in items:
+                attach_result_url(normalize_progress(item))
+            return conditional_response(
+                headers,
+                {'jobs': items, 'notFound': missing},
+                job_etag(items + [{'jobId': job_id} for job_id in missing])
+            )
+
         job_id = event.get('pathParameters', {}).get('id')
         if not job_id:
             return {'statusCode': 400, 'body': json.dumps({'error': 'Missing job ID'})}
             
         table = dynamodb.Table(JOB_TABLE)
-        response = table.get_item(Key={'jobId': job_id})
-        
-        if 'Item' not in response:
+        since = (event.get('queryStringParameters') or {}).get('version')
+
+        def is_changed(item):
+            if since is not None:
+                return str(item.get('version', 0)) != since
+            if headers.get('if-none-match') or headers.get('If-None-Match'):
+                return not etag_matches(headers, job_etag([attach_result_url(normalize_progress(dict(item)))]))
+            return True
+
+        item = wait_for_job(table, job_id, is_changed, long_poll_timeout(event, context))
+        if item is None:
             return {'statusCode': 404, 'body': json.dumps({'error': 'Job not found'})}
-            
-        item = response['Item']
-        
-        # COMPLETED の場合、結果取得用の Presigned URL を発行
-        if item.get('status') == 'COMPLETED' and item.get('resultKey'):
-            try:
-                presigned_url = s3.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': DATA_BUCKET,
-                        'Key': item['resultKey']
-                    },
-                    ExpiresIn=3600
-                )
-                item['resultUrl'] = presigned_url
-            except Exception as e:
-                print(f"Error generating presigned URL: {str(e)}")
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps(item, default=str)
-        }
+        item = attach_result_url(normalize_progress(item))
+        return conditional_response(headers, item, job_etag([item]))
         
     except Exception as e:
         print(f"Error: {str(e)}")
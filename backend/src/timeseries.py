@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+# 製造設備ログで多い YYYYMMDDhhmmss 形式を最優先で試す
+DEFAULT_DATE_FORMAT = '%Y%m%d%H%M%S'
+# フォーマット推定に使うサンプル件数
+FORMAT_SAMPLE_SIZE = 100
+# 時系列グラフで扱う集計 (それ以外は sum として扱う既存仕様)
+TS_AGG_FUNCS = ('mean', 'max')
+
+
+def infer_date_format(s):
+    """
+    非欠損値のサンプルから最も多くの行をパースできる日付フォーマットを推定
+    どの候補でもパースできない場合は None (pandas の自動判定に任せる)
+    """
+    sample = s.dropna().head(FORMAT_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+
+    candidates = [DEFAULT_DATE_FORMAT]
+    for val in sample.astype(str).str.strip().unique():
+        guessed = guess_datetime_format(val)
+        if guessed and guessed not in candidates:
+            candidates.append(guessed)
+
+    best, best_hits = None, 0
+    for fmt in candidates:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+
+def parse_date_column(s, format_cache, key=None):
+    """
+    日付カラムを1回のパースで datetime 化
+    フォーマットはカラムごとに推定して format_cache に保持し、後続チャンクでも再利用する
+    推定フォーマットで失敗した行だけを要素単位の自動判定 (mixed) で再パースする
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+
+    key = s.name if key is None else key
+    if key not in format_cache:
+        format_cache[key] = infer_date_format(s)
+    fmt = format_cache[key]
+
+    parsed = pd.to_datetime(s, format=fmt, errors='coerce')
+    failed = parsed.isna() & s.notna()
+    if fmt is not None and failed.any():
+        parsed[failed] = pd.to_datetime(s[failed], format='mixed', errors='coerce')
+    return parsed
+
+
+def resample_rule(index):
+    """
+    期間に応じて粒度を自動調整 (時間, 日, 月)
+    """
+    delta = index.max() - index.min() if len(index) else pd.NaT
+    if pd.notna(delta) and delta.days < 2:
+        return 'H'
+    elif pd.notna(delta) and delta.days < 60:
+        return 'D'
+    return 'M'
+
+
+def plan_time_series(specs, columns):
+    """
+    時系列グラフを日付カラム単位にまとめた実行計画を作る
+    戻り値: { 日付カラム: [(metric, aggregation), ...] }
+    """
+    ts_plan = {}
+    for spec in specs:
+        d_col = spec.get('dimension')
+        m_col = spec.get('metric')
+        if d_col not in columns or m_col not in columns:
+            continue
+        agg_type = spec.get('aggregation', 'sum')
+        pair = (m_col, agg_type if agg_type in TS_AGG_FUNCS else 'sum')
+        pairs = ts_plan.setdefault(d_col, [])
+        if pair not in pairs:
+            pairs.append(pair)
+    return ts_plan
+
+
+def execute_time_series(df, ts_plan):
+    """
+    日付カラムごとにソート済み DatetimeIndex を一度だけ作り、
+    その列を使う全ての (metric, aggregation) を一回の resample で計算
+    戻り値: { (日付カラム, metric, aggregation): {日時文字列: 値} }
+    """
+    results = {}
+    for d_col, pairs in ts_plan.items():
+        dates = df[d_col].to_numpy(dtype='datetime64[ns]')
+        valid = ~np.isnat(dates)
+        order = np.argsort(dates[valid], kind='stable')
+        index = pd.DatetimeIndex(dates[valid][order])
+
+        metric_cols = list(dict.fromkeys(m for m, _ in pairs))
+        frame = pd.DataFrame(
+            {i: df[m].to_numpy()[valid][order] for i, m in enumerate(metric_cols)},
+            index=index
+        )
+        funcs = {}
+        for m_col, agg_type in pairs:
+            funcs.setdefault(metric_cols.index(m_col), []).append(agg_type)
+
+        resampled = frame.resample(resample_rule(index)).agg(funcs)
+        for m_col, agg_type in pairs:
+            series = resampled[(metric_cols.index(m_col), agg_type)].dropna()
+            # キーを文字列に変換
+            results[(d_col, m_col, agg_type)] = {str(k): v for k, v in series.to_dict().items()}
+    return results
+
+
+def aggregate_time_series(df, specs):
+    """
+    時系列集計 (複数グラフを一括実行)
+    戻り値: specs と同じ並びの集計結果 dict のリスト (カラムが存在しない場合は None)
+    """
+    results = execute_time_series(df, plan_time_series(specs, df.columns))
+
+    charts = []
+    for spec in specs:
+        agg_type = spec.get('aggregation', 'sum')
+        key = (spec.get('dimension'), spec.get('metric'), agg_type if agg_type in TS_AGG_FUNCS else 'sum')
+        charts.append(results.get(key))
+    return charts
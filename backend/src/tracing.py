@@ -0,0 +1,182 @@
+"""
+パイプラインのステージ計測 (実時間・CPU時間・処理行数・メモリ・Bedrock トークン数)
+
+    trace = Trace(job_id)
+    with trace.span('load') as s:        # ステージ (スレッドごとに入れ子にできる)
+        s['rows'] = len(df)
+    tracing.span('charts.ranking')       # 実行中のスパンの内側に追加 (トレース外では何もしない)
+    tracing.record(input_tokens=123)     # 実行中のスパンに数値を加算
+
+スパン終了ごとに構造化ログ (JSON 1 行) を出力し、trace.to_dict() を結果 JSON / DynamoDB に保存する。
+数値はすべて整数 (ms / MB) で記録する (DynamoDB は float を受け付けないため)。
+"""
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def peak_rss_mb():
+    """
+    プロセスのピーク RSS (MB)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return int(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024))
+
+
+def current_rss_mb():
+    """
+    プロセスの現在の RSS (MB)。/proc がない環境では None
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return int(pages * resource.getpagesize() / 1024 / 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Trace:
+    """
+    1ジョブ分のスパンの記録
+    """
+    def __init__(self, job_id, emit=True):
+        self.job_id = job_id
+        self.emit = emit
+        self.spans = []
+        self.merged = set()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, merge=False):
+        """
+        ステージの計測 (yield する dict に rows などを設定できる)
+        merge=True の場合は同名のスパンに加算する (チャンクごとの繰り返し処理向け)
+        """
+        entry = {'name': name}
+        stack = _stack()
+        stack.append((self, entry))
+        peak_before = peak_rss_mb()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield entry
+        except Exception as e:
+            entry['error'] = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            entry['wall_ms'] = int((time.perf_counter() - wall) * 1000)
+            entry['cpu_ms'] = int((time.thread_time() - cpu) * 1000)
+            entry['peak_rss_mb'] = peak_rss_mb()
+            entry['rss_growth_mb'] = entry['peak_rss_mb'] - peak_before
+            rss = current_rss_mb()
+            if rss is not None:
+                entry['rss_mb'] = rss
+            self._finish(entry, merge)
+
+    def _finish(self, entry, merge):
+        with self.lock:
+            target = None
+            if merge:
+                self.merged.add(entry['name'])
+                target = next((s for s in self.spans if s['name'] == entry['name']), None)
+            if target is None:
+                entry.setdefault('calls', 1)
+                self.spans.append(entry)
+            else:
+                for k, v in entry.items():
+                    if k in ('wall_ms', 'cpu_ms', 'rows', 'rss_growth_mb', 'input_tokens', 'output_tokens'):
+                        target[k] = target.get(k, 0) + v
+                    elif k != 'name':
+                        target[k] = v
+                target['calls'] = target.get('calls', 1) + 1
+        if self.emit and not merge:
+            self.log(entry)
+
+    def log(self, entry):
+        """
+        スパンを構造化ログとして出力
+        """
+        print(json.dumps(dict({'type': 'trace', 'jobId': self.job_id}, **entry), ensure_ascii=False))
+
+    def to_dict(self):
+        """
+        結果 JSON / DynamoDB に保存する計測結果
+        """
+        with self.lock:
+            spans = [dict(s) for s in self.spans]
+        return {
+            'wall_ms': int((time.perf_counter() - self.started) * 1000),
+            'peak_rss_mb': peak_rss_mb(),
+            'input_tokens': sum(s.get('input_tokens', 0) for s in spans),
+            'output_tokens': sum(s.get('output_tokens', 0) for s in spans),
+            'spans': spans,
+        }
+
+    def flush(self):
+        """
+        merge したスパン (チャンク単位の繰り返し) の合計をログ出力し、全体の要約を出力
+        """
+        if not self.emit:
+            return
+        with self.lock:
+            merged = [dict(s) for s in self.spans if s['name'] in self.merged]
+        for entry in merged:
+            self.log(entry)
+        summary = self.to_dict()
+        del summary['spans']
+        print(json.dumps(dict({'type': 'trace_summary', 'jobId': self.job_id}, **summary)))
+
+
+@contextmanager
+def span(name, merge=False):
+    """
+    現在のスレッドで実行中のトレースにスパンを追加 (トレース外では計測しない)
+    """
+    stack = _stack()
+    if not stack:
+        yield {}
+        return
+    with stack[-1][0].span(name, merge) as entry:
+        yield entry
+
+
+def record(**values):
+    """
+    現在のスレッドで実行中のスパンに数値を加算 (トークン数など)
+    """
+    stack = _stack()
+    if not stack:
+        return
+    entry = stack[-1][1]
+    for k, v in values.items():
+        entry[k] = entry.get(k, 0) + int(v or 0)
+
+
+def propagate(name, fn):
+    """
+    別スレッドで実行する fn を、呼び出し元スレッドのトレースに name のスパン (merge) として記録する
+    fn の内側の span / record も同じトレースに追加される
+    """
+    stack = _stack()
+    trace = stack[-1][0] if stack else None
+
+    def run(*args, **kwargs):
+        if trace is None:
+            return fn(*args, **kwargs)
+        with trace.span(name, merge=True):
+            return fn(*args, **kwargs)
+    return run
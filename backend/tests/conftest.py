@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# AWS を使わずに実行する (processor などの import 前に設定する)
+os.environ['EXECUTION_BACKEND'] = 'local'
+os.environ['LOCAL_DATA_DIR'] = tempfile.mkdtemp(prefix='majin-test-')
+os.environ['RESULT_CACHE_TTL_HOURS'] = '0'
+
+# backend/src のモジュールを Lambda と同じくトップレベルで import する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,61 @@
+import uuid
+import pytest
+
+processor = pytest.importorskip('processor')
+from dispatcher import new_job_item  # noqa: E402
+from result_format import decode_result  # noqa: E402
+
+HEADER = 'Timestamp,Machine_ID,Temperature,Defect_Count\n'
+
+
+def rows(start, n):
+    return ''.join(
+        f"2025-01-01 {i // 60 % 24:02d}:{i % 60:02d}:00,M{i % 3},{20 + i % 7 * 1.5},{i % 4}\n" for i in range(start, start + n)
+    )
+
+
+def run_job(body, dataset_id=None):
+    """
+    本文をアップロードとして登録し、processor.handler で処理した結果
+    """
+    job_id = str(uuid.uuid4())
+    processor.s3.put_object(Bucket=processor.DATA_BUCKET, Key=f"uploads/{job_id}.csv", Body=body.encode('utf-8'))
+    table = processor.dynamodb.Table(processor.JOB_TABLE)
+    table.put_item(Item=new_job_item(job_id, dataset_id=dataset_id))
+    processor.handler({'jobId': job_id}, None)
+    item = table.get_item(Key={'jobId': job_id})['Item']
+    assert item['status'] == 'COMPLETED', item.get('error')
+    obj = processor.s3.get_object(Bucket=processor.DATA_BUCKET, Key=item['resultKey'])
+    return decode_result(obj['Body'].read())
+
+
+def assert_same(incremental, full):
+    assert incremental['summary']['total_rows'] == full['summary']['total_rows']
+    assert incremental['charts'].keys() == full['charts'].keys()
+    for chart_id, data in full['charts'].items():
+        if isinstance(data, dict):
+            assert incremental['charts'][chart_id] == pytest.approx(data), chart_id
+
+
+def test_last_row_without_trailing_newline_is_included():
+    dataset_id = str(uuid.uuid4())
+    body = HEADER + rows(0, 40).rstrip('\n')
+    full = run_job(body)
+    assert full['summary']['total_rows'] == 40
+    assert_same(run_job(body, dataset_id), full)
+
+    # 前回の最終行 (改行なし) の後に追記した場合も取りこぼさない
+    body = body + '\n' + rows(40, 20).rstrip('\n')
+    full = run_job(body)
+    assert full['summary']['total_rows'] == 60
+    assert_same(run_job(body, dataset_id), full)
+
+
+def test_partial_last_row_waits_for_next_upload():
+    dataset_id = str(uuid.uuid4())
+    complete = HEADER + rows(0, 40)
+    partial = complete + rows(40, 1)[:12]
+    assert run_job(partial, dataset_id)['summary']['total_rows'] == 40
+
+    body = complete + rows(40, 10)
+    assert_same(run_job(body, dataset_id), run_job(body))
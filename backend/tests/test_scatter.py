@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from scatter import merge_points, reduce_scatter
+
+
+def test_categorical_axis_returns_records():
+    df = pd.DataFrame({'M': pd.Categorical(['A', 'B', 'A']), 'T': [1., 2., 3.]})
+    assert reduce_scatter(df, 'M', 'T') == [
+        {'M': 'A', 'T': 1.0, 'count': 1},
+        {'M': 'B', 'T': 2.0, 'count': 1},
+        {'M': 'A', 'T': 3.0, 'count': 1},
+    ]
+
+
+def test_string_axis_is_sampled_within_budget():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({'M': rng.choice(['A', 'B', 'C'], 5000), 'T': np.arange(5000.)})
+    df.loc[::7, 'T'] = np.nan
+    points = reduce_scatter(df, 'M', 'T', budget=100)
+    assert len(points) == 100
+    assert sum(p['count'] for p in points) == int(df['T'].notna().sum())
+    assert all(isinstance(p['M'], str) for p in points)
+    assert points == reduce_scatter(df, 'M', 'T', budget=100)
+
+
+def test_merge_categorical_points():
+    df = pd.DataFrame({'M': pd.Categorical(['A', 'B'] * 200), 'T': np.arange(400.)})
+    part = reduce_scatter(df, 'M', 'T', budget=50)
+    merged = merge_points(part, part, 'M', 'T', budget=50)
+    assert len(merged) == 50
+    assert sum(p['count'] for p in merged) == 800
+
+
+def test_numeric_axes_keep_binning():
+    df = pd.DataFrame({'X': np.arange(1000.), 'Y': np.arange(1000.) % 10})
+    points = reduce_scatter(df, 'X', 'Y', budget=50)
+    assert len(points) <= 50
+    assert sum(p['count'] for p in points) == 1000
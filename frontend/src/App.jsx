@@ -14,6 +14,26 @@ marked.setOptions({
   breaks: true,
   gfm: true
 });
+
+// 列指向 (RESULT_FORMAT=compact) で保存された結果のグラフを従来の形式に戻す
+const expandResult = (result) => {
+  if (result?.format !== 'compact/1') return result;
+  const charts = {};
+  Object.entries(result.charts || {}).forEach(([id, chart]) => {
+    if (chart && chart.labels && chart.values) {
+      charts[id] = Object.fromEntries(chart.labels.map((label, i) => [label, chart.values[i]]));
+    } else if (chart && chart.fields && chart.columns) {
+      const rows = chart.columns[0]?.length || 0;
+      charts[id] = Array.from({ length: rows }, (_, i) =>
+        Object.fromEntries(chart.fields.map((field, j) => [field, chart.columns[j][i]]))
+      );
+    } else {
+      charts[id] = chart;
+    }
+  });
+  const { format, ...rest } = result;
+  return { ...rest, charts };
+};
 const App = () => {
   const [isLoaded, setIsLoaded] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
@@ -73,7 +93,7 @@ const App = () => {
   const fetchResult = async (url) => {
     try {
       const { data } = await axios.get(url);
-      setAnalysisResult(data);
+      setAnalysisResult(expandResult(data));
       setIsLoading(false);
     } catch (error) {
       console.error('Fetch result failed:', error);
@@ -275,7 +295,7 @@ const App = () => {
         <div className="fixed inset-0 z-[100] flex flex-col items-center justify-center bg-white/80 backdrop-blur-sm">
           <Loader2 className="w-12 h-12 text-blue-600 animate-spin mb-4" />
           <p className="text-lg font-bold text-slate-700">
-            {jobStatus === 'PROCESSING' ? 'AIがデータを分析中...' : 'システムを起動中...'}
+            {jobStatus === 'PROCESSING' ? 'AIがデータを分析中...' : jobStatus === 'QUEUED' ? '実行待ち (混雑中)...' : 'システムを起動中...'}
           </p>
         </div>
       )}
@@ -35,8 +35,10 @@ $ApiId = ($ApiOutputs | Where-Object { $_.OutputKey -eq "ApiId" }).OutputValue
 $DispatcherName = ($ApiOutputs | Where-Object { $_.OutputKey -eq "DispatcherFunctionName" }).OutputValue
 $StatusName = ($ApiOutputs | Where-Object { $_.OutputKey -eq "StatusFunctionName" }).OutputValue
 $ProcessorName = ($ApiOutputs | Where-Object { $_.OutputKey -eq "ProcessorFunctionName" }).OutputValue
+$ProcessorHeavyName = ($ApiOutputs | Where-Object { $_.OutputKey -eq "ProcessorHeavyFunctionName" }).OutputValue
+$SchedulerPumpName = ($ApiOutputs | Where-Object { $_.OutputKey -eq "SchedulerPumpFunctionName" }).OutputValue
 
-if (-not $ApiId -or -not $DispatcherName -or -not $StatusName -or -not $ProcessorName) {
+if (-not $ApiId -or -not $DispatcherName -or -not $StatusName -or -not $ProcessorName -or -not $ProcessorHeavyName -or -not $SchedulerPumpName) {
     Write-Error "Required outputs missing in stack $ApiStackName. (Outputs found: $(($ApiOutputs.OutputKey) -join ', '))"
     exit 1
 }
@@ -66,7 +68,7 @@ if ($dbCopied) {
 }
 
 # 2. Update Lambda Functions
-$Functions = @($DispatcherName, $StatusName, $ProcessorName)
+$Functions = @($DispatcherName, $StatusName, $ProcessorName, $ProcessorHeavyName, $SchedulerPumpName)
 foreach ($FuncName in $Functions) {
     Write-Host "Updating Lambda function: $FuncName..." -ForegroundColor Yellow
     aws lambda update-function-code --function-name $FuncName --zip-file "fileb://$TempZip" > $null
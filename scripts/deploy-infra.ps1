@@ -37,9 +37,10 @@ $BaseOutputs = $BaseOutputsJson | ConvertFrom-Json
 
 $DataBucketName = ($BaseOutputs | Where-Object { $_.OutputKey -eq "DataBucketName" }).OutputValue
 $JobTableName = ($BaseOutputs | Where-Object { $_.OutputKey -eq "JobTableName" }).OutputValue
+$QueueTableName = ($BaseOutputs | Where-Object { $_.OutputKey -eq "QueueTableName" }).OutputValue
 $LambdaRoleArn = ($BaseOutputs | Where-Object { $_.OutputKey -eq "LambdaRoleArn" }).OutputValue
 
-if (-not $DataBucketName -or -not $JobTableName -or -not $LambdaRoleArn) {
+if (-not $DataBucketName -or -not $JobTableName -or -not $QueueTableName -or -not $LambdaRoleArn) {
     Write-Error "Required outputs missing from $BaseStackName. Please check the stack outputs."
     exit 1
 }
@@ -53,6 +54,7 @@ aws cloudformation deploy `
     --parameter-overrides `
     DataBucketName=$DataBucketName `
     JobTableName=$JobTableName `
+    QueueTableName=$QueueTableName `
     LambdaRoleArn=$LambdaRoleArn
 
 if ($LASTEXITCODE -ne 0) {